@@ -0,0 +1,251 @@
+"""Benchmarks the hot paths of the TRD training: the n-step replay buffer's `add` throughput, the replay buffer's
+`sample` latency, the compile and step time of the TRD update, and the end-to-end steps per second of the training
+loop with a fake env of a fixed cost per step.
+
+The results are saved as JSON with the run's metadata (see `utils/benchmark.py`), and compared to a previous run
+with `--baseline`, exiting with an error if any result regressed by more than `--regression-threshold`, e.g.,
+`python -m temporal_reward_decomposition.benchmark_trd --quick --baseline benchmarks/main.json`
+"""
+
+import argparse
+import sys
+import time
+from distutils.util import strtobool
+from typing import List
+
+import gymnasium as gym
+import jax
+import numpy as np
+import optax
+
+from temporal_reward_decomposition.dqn_trd import QNetwork, TrainState, make_update
+from temporal_reward_decomposition.models import QNetwork as AtariQNetwork
+from temporal_reward_decomposition.utils.benchmark import (
+    BenchmarkResult,
+    benchmark_metadata,
+    compare_results,
+    load_results,
+    save_results,
+    time_calls,
+)
+from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+
+BENCHMARKS = ("n_step_add", "sample", "update", "sps")
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmarks", type=str, nargs="+", default=list(BENCHMARKS), choices=BENCHMARKS,
+        help="the benchmarks to run")
+    parser.add_argument("--quick", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, smaller grids and fewer steps, e.g., for a regression check on each change")
+    parser.add_argument("--repeats", type=int, default=20,
+        help="the number of timed repeats of each measurement")
+    parser.add_argument("--seed", type=int, default=1,
+        help="the seed of the random data and networks")
+    parser.add_argument("--output", type=str, default=f"benchmarks/{int(time.time())}.json",
+        help="the path of the JSON results")
+    parser.add_argument("--baseline", type=str, default=None,
+        help="if set, the JSON results of a previous run that the results are compared to")
+    parser.add_argument("--regression-threshold", type=float, default=0.2,
+        help="the relative change from the baseline considered a regression")
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+class FixedCostEnv(gym.Env):
+    """CartPole-shaped env with random observations, where each step busy-waits for `step_cost` seconds and the
+    episodes are `episode_length` steps, such that the training loop's cost is measured without a simulator"""
+
+    def __init__(self, step_cost: float = 0.0, episode_length: int = 200):
+        self.observation_space = gym.spaces.Box(-1, 1, (4,), dtype=np.float32)
+        self.action_space = gym.spaces.Discrete(2)
+        self.step_cost = step_cost
+        self.episode_length = episode_length
+        self.t = 0
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        self.t = 0
+        return self.observation_space.sample(), {}
+
+    def step(self, action):
+        end = time.perf_counter() + self.step_cost
+        while time.perf_counter() < end:
+            pass
+
+        self.t += 1
+        return self.observation_space.sample(), 1.0, False, self.t >= self.episode_length, {}
+
+
+def make_q_state(q_network, observation: np.ndarray, seed: int) -> TrainState:
+    params = q_network.init(jax.random.PRNGKey(seed), observation)
+    return TrainState.create(apply_fn=q_network.apply, params=params, target_params=params, tx=optax.adam(2.5e-4))
+
+
+def benchmark_n_step_add(args) -> List[BenchmarkResult]:
+    """The transitions per second added to the n-step replay buffer by each env step, over n-steps and episode lengths"""
+    num_envs, steps = 4, 500 if args.quick else 5_000
+    n_steps, episode_lengths = ((1, 3), (10, 1000)) if args.quick else ((1, 3, 5, 10), (10, 100, 1000))
+    observation_space, action_space = gym.spaces.Box(-1, 1, (4,), dtype=np.float32), gym.spaces.Discrete(2)
+
+    rng = np.random.default_rng(args.seed)
+    observations = rng.random((steps + 1, num_envs, 4), dtype=np.float32)
+    actions = rng.integers(2, size=(steps, num_envs))
+    rewards = rng.random((steps, num_envs), dtype=np.float32)
+    truncated = np.zeros(num_envs, dtype=np.bool_)
+
+    results = []
+    for n_step in n_steps:
+        for episode_length in episode_lengths:
+            # the envs' episodes are staggered such that they end on different steps
+            terminated = (np.arange(steps)[:, None] + np.arange(num_envs)[None, :] * 7) % episode_length == episode_length - 1
+
+            def add_steps():
+                rb = NStepReplayBuffer(ReplayBuffer(steps * num_envs, observation_space, action_space), n_step, 0.99, num_envs)
+                for t in range(steps):
+                    rb.add(observations[t], observations[t + 1], actions[t], rewards[t], terminated[t], truncated)
+
+            durations = time_calls(add_steps, repeats=max(args.repeats // 5, 1))
+            results.append(BenchmarkResult(
+                "n_step_add", {"n_step": n_step, "episode_length": episode_length, "num_envs": num_envs},
+                "throughput", float(steps * num_envs / np.median(durations)), "transitions/s", higher_is_better=True,
+            ))
+    return results
+
+
+def benchmark_sample(args) -> List[BenchmarkResult]:
+    """The latency of sampling a batch from a full replay buffer, over buffer sizes and batch sizes"""
+    buffer_sizes, batch_sizes = ((10_000,), (32,)) if args.quick else ((10_000, 1_000_000), (32, 256))
+    observation_space, action_space = gym.spaces.Box(-1, 1, (4,), dtype=np.float32), gym.spaces.Discrete(2)
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for buffer_size in buffer_sizes:
+        rb = ReplayBuffer(buffer_size, observation_space, action_space, seed=args.seed)
+        for start in range(0, buffer_size, 100_000):
+            num_transitions = min(100_000, buffer_size - start)
+            rb.add(
+                rng.random((num_transitions, 4), dtype=np.float32),
+                rng.random((num_transitions, 4), dtype=np.float32),
+                rng.integers(2, size=num_transitions),
+                rng.random(num_transitions, dtype=np.float32),
+                rng.random(num_transitions) < 0.01,
+            )
+
+        for batch_size in batch_sizes:
+            durations = time_calls(lambda: rb.sample(batch_size), repeats=args.repeats * 50, warmup=10)
+            params = {"buffer_size": buffer_size, "batch_size": batch_size}
+            results.append(BenchmarkResult("sample", params, "median_latency", float(np.median(durations)), "s"))
+            results.append(BenchmarkResult("sample", params, "p99_latency", float(np.percentile(durations, 99)), "s"))
+    return results
+
+
+def benchmark_update(args) -> List[BenchmarkResult]:
+    """The compile time and steady-state step time of the TRD update of `dqn_trd.py`, over networks, numbers of bins
+    and batch sizes"""
+    networks = {"mlp": (QNetwork, (4,), np.float32, 2), "cnn": (AtariQNetwork, (4, 84, 84), np.uint8, 6)}
+    num_bins_grid, batch_sizes = ((2, 8), (32,)) if args.quick else ((2, 8, 32), (32, 256))
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    for network_name, (network_cls, observation_shape, observation_dtype, num_actions) in networks.items():
+        for num_bins in num_bins_grid:
+            for batch_size in batch_sizes:
+                q_network = network_cls(action_dim=num_actions, num_bins=num_bins)
+                observations = (rng.random((2, batch_size) + observation_shape) * 255).astype(observation_dtype)
+                q_state = make_q_state(q_network, observations[0], args.seed)
+                batch = jax.device_put((
+                    observations[0],
+                    rng.integers(num_actions, size=(batch_size, 1)),
+                    observations[1],
+                    rng.random(batch_size, dtype=np.float32),
+                    (rng.random(batch_size) < 0.01).astype(np.float32),
+                ))
+
+                update = jax.jit(make_update(q_network, batch_size, 0.99))
+                start = time.perf_counter()
+                compiled_update = update.lower(q_state, *batch).compile()
+                compile_time = time.perf_counter() - start
+                durations = time_calls(lambda: jax.block_until_ready(compiled_update(q_state, *batch)), args.repeats, warmup=3)
+
+                params = {"network": network_name, "num_bins": num_bins, "batch_size": batch_size}
+                results.append(BenchmarkResult("update", params, "compile_time", compile_time, "s"))
+                results.append(BenchmarkResult("update", params, "step_time", float(np.median(durations)), "s"))
+    return results
+
+
+def benchmark_sps(args) -> List[BenchmarkResult]:
+    """The steps per second of the `dqn_trd.py` training loop (action selection, env step, n-step buffer add, sample
+    and update) with a fake env, after `learning_starts` such that the updates are included"""
+    num_envs, num_bins, n_step, batch_size, train_frequency = 4, 8, 3, 128, 10
+    learning_starts, total_steps = (500, 1_500) if args.quick else (1_000, 10_000)
+    step_costs = (0.0,) if args.quick else (0.0, 1e-4, 1e-3)
+
+    results = []
+    for step_cost in step_costs:
+        envs = gym.vector.SyncVectorEnv([lambda: FixedCostEnv(step_cost) for _ in range(num_envs)])
+        q_network = QNetwork(action_dim=envs.single_action_space.n, num_bins=num_bins)
+        q_state = make_q_state(q_network, envs.observation_space.sample(), args.seed)
+        rb = NStepReplayBuffer(
+            ReplayBuffer(total_steps * num_envs, envs.single_observation_space, envs.single_action_space, seed=args.seed),
+            n_step, 0.99, num_envs,
+        )
+        greedy_actions = jax.jit(lambda params, obs: q_network.apply(params, obs).argmax(axis=-1))
+        update = jax.jit(make_update(q_network, batch_size, 0.99 ** n_step))
+        rng = np.random.default_rng(args.seed)
+
+        obs, _ = envs.reset(seed=args.seed)
+        for global_step in range(total_steps):
+            if global_step == learning_starts:
+                start = time.perf_counter()
+
+            if rng.random() < 0.05:
+                actions = envs.action_space.sample()
+            else:
+                actions = np.asarray(jax.device_get(greedy_actions(q_state.params, obs)))
+            next_obs, rewards, terminated, truncated, infos = envs.step(actions)
+            real_next_obs = next_obs.copy()
+            for idx, d in enumerate(truncated):
+                if d:
+                    real_next_obs[idx] = infos["final_observation"][idx]
+            rb.add(obs, real_next_obs, actions, rewards, terminated, truncated)
+            obs = next_obs
+
+            if global_step >= learning_starts and global_step % train_frequency == 0:
+                # each sample is new arrays, so the next sample doesn't overwrite those that the asynchronous update reads
+                data = rb.sample(batch_size)
+                *_, q_state = update(q_state, data.observations, data.actions, data.next_observations, data.rewards, data.dones)
+        jax.block_until_ready(q_state)
+        envs.close()
+
+        sps = (total_steps - learning_starts) / (time.perf_counter() - start)
+        params = {"num_envs": num_envs, "num_bins": num_bins, "step_cost": step_cost, "train_frequency": train_frequency}
+        results.append(BenchmarkResult("sps", params, "sps", sps, "steps/s", higher_is_better=True))
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    results = []
+    for benchmark in args.benchmarks:
+        print(f"Running the {benchmark} benchmark")
+        benchmark_results = globals()[f"benchmark_{benchmark}"](args)
+        for result in benchmark_results:
+            print(f"  {result.params}: {result.metric} = {result.value:.6g} {result.unit}")
+        results.extend(benchmark_results)
+
+    save_results(results, args.output, {**benchmark_metadata(), "args": vars(args)})
+    print(f"Results saved to {args.output}")
+
+    if args.baseline is not None:
+        regressions = compare_results(results, load_results(args.baseline), args.regression_threshold)
+        for result, change in regressions:
+            print(f"Regression: {result.name} {result.params} {result.metric} is {change:.0%} worse than {args.baseline}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions from {args.baseline}")
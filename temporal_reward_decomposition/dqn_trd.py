@@ -15,10 +15,13 @@ import jax.numpy as jnp
 import numpy as np
 import optax
 from flax.training.train_state import TrainState
-from stable_baselines3.common.buffers import ReplayBuffer
-from torch.utils.tensorboard import SummaryWriter
 
+from temporal_reward_decomposition.utils.compilation import enable_compilation_cache
 from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.profiling import PhaseTimer, ProfilerWindow
+from temporal_reward_decomposition.utils.prioritized_replay_buffer import PrioritizedReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+from temporal_reward_decomposition.utils.scan_update import scan_update, stack_batches, target_network_syncs
 
 
 def parse_args():
@@ -28,6 +31,8 @@ def parse_args():
         help="the name of this experiment")
     parser.add_argument("--seed", type=int, default=1,
         help="seed of the experiment")
+    parser.add_argument("--num-seeds", type=int, default=1,
+        help="the number of seeds (from `seed`) trained together, with the train states stacked and the update vmapped over the seeds")
     parser.add_argument("--track", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
         help="if toggled, this experiment will be tracked with Weights and Biases")
     parser.add_argument("--wandb-project-name", type=str, default="cleanRL",
@@ -72,6 +77,24 @@ def parse_args():
         help="timestep to start learning")
     parser.add_argument("--train-frequency", type=int, default=10,
         help="the frequency of training")
+    parser.add_argument("--updates-per-dispatch", type=int, default=1,
+        help="the number of updates (with the target network updates) run in a single jitted `lax.scan`, every `train-frequency * updates-per-dispatch` steps")
+    parser.add_argument("--compilation-cache-dir", type=str, default="jax-cache",
+        help="the directory of the persistent XLA compilation cache shared between runs, if empty then the functions are compiled by every run")
+    parser.add_argument("--prioritized-replay", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, transitions are sampled proportional to their mean absolute TD error over the reward bins")
+    parser.add_argument("--priority-alpha", type=float, default=0.6,
+        help="the prioritization exponent of the TD errors")
+    parser.add_argument("--priority-beta", type=float, default=0.4,
+        help="the starting importance-sampling exponent, annealed to 1 by the end of training")
+    parser.add_argument("--phase-timers", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the phases of the training loop are timed and written to TensorBoard as histograms under `timers/`")
+    parser.add_argument("--phase-timers-sync", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the timed update waits for the device such that its phase includes the device time, slowing training")
+    parser.add_argument("--timers-period", type=int, default=10_000,
+        help="how often (in steps) the phase timings are written")
+    parser.add_argument("--profile-steps", type=int, nargs=2, default=None, metavar=("START", "STOP"),
+        help="if set, the steps traced with `jax.profiler` to `runs/{run_name}/profile`")
 
     # Temporal Reward Decomposition
     parser.add_argument("--num-bins", type=int, required=True,
@@ -81,9 +104,9 @@ def parse_args():
 
     args = parser.parse_args()
     # fmt: on
-    assert args.num_envs == 1, "vectorized envs are not supported at the moment"
 
-    assert args.num_bins > 1 and args.n_step >= 1
+    assert args.num_bins > 1 and args.n_step >= 1 and args.updates_per_dispatch >= 1
+    assert args.num_seeds >= 1 and not (args.track and args.num_seeds > 1), "each seed is logged as a separate run"
 
     return args
 
@@ -109,10 +132,10 @@ class QNetwork(nn.Module):
     num_bins: int
 
     def __call__(self, x: jnp.ndarray):
-        return jnp.sum(self.decomposed_q_values(x), axis=-1)
+        return jnp.sum(self.decomposed_q_value(x), axis=-1)
 
     @nn.compact
-    def decomposed_q_values(self, x: jnp.ndarray):
+    def decomposed_q_value(self, x: jnp.ndarray):
         x = nn.Dense(120)(x)
         x = nn.relu(x)
         x = nn.Dense(84)(x)
@@ -125,14 +148,65 @@ class TrainState(TrainState):
     target_params: flax.core.FrozenDict
 
 
+def make_update(q_network: nn.Module, batch_size: int, discount_factor: float):
+    """The TRD update of a batch, returning the loss, the actions' decomposed q-values, the TD errors (the priorities)
+    and the updated train state, where `discount_factor` is the n-step discount"""
+    num_actions, num_bins = q_network.action_dim, q_network.num_bins
+
+    def update(q_state, observations, actions, next_observations, rewards, terminated, weights=None):
+        # Temporal reward decomposition loss function
+        q_next_target = q_network.apply(q_state.target_params, next_observations, method="decomposed_q_value")
+        chex.assert_shape(q_next_target, (batch_size, num_actions, num_bins))
+
+        q_next_target_value = q_next_target[jnp.arange(batch_size), jnp.argmax(jnp.sum(q_next_target, axis=-1), axis=-1)]
+        chex.assert_shape(q_next_target_value, (batch_size, num_bins))
+
+        discounted_q_next_target = jnp.expand_dims(1 - terminated, axis=1) * discount_factor * q_next_target_value
+        chex.assert_shape(discounted_q_next_target, (batch_size, num_bins))
+        rolled_q_next_target = jnp.roll(discounted_q_next_target, shift=1, axis=1)
+        chex.assert_shape(rolled_q_next_target, (batch_size, num_bins))
+        next_q_value = rolled_q_next_target.at[:, -1].add(rolled_q_next_target[:, 0]).at[:, 0].set(rewards)
+        chex.assert_shape(next_q_value, (batch_size, num_bins))
+
+        def trd_mse_loss(params):
+            q_pred = q_network.apply(params, observations, method="decomposed_q_value")
+            chex.assert_shape(q_pred, (batch_size, num_actions, num_bins))
+            q_pred = q_pred[jnp.arange(batch_size), actions.squeeze()]
+            chex.assert_shape(q_pred, (batch_size, num_bins))
+
+            squared_errors = jnp.square(q_pred - next_q_value)
+            if weights is not None:  # importance-sampling weights of the prioritized samples
+                squared_errors = jnp.expand_dims(weights, axis=1) * squared_errors
+            loss = jnp.mean(squared_errors)
+            chex.assert_shape(loss, ())
+            return loss, q_pred
+
+        (loss_value, q_pred), grads = jax.value_and_grad(trd_mse_loss, has_aux=True)(q_state.params)
+        q_state = q_state.apply_gradients(grads=grads)
+
+        # the per-bin td errors are averaged for the priority of each transition
+        td_errors = jnp.mean(jnp.abs(q_pred - next_q_value), axis=-1)
+        chex.assert_shape(td_errors, (batch_size,))
+        return loss_value, q_pred, td_errors, q_state
+
+    return update
+
+
 def linear_schedule(start_e: float, end_e: float, duration: int, t: int):
     slope = (end_e - start_e) / duration
     return max(slope * t + start_e, end_e)
 
 
 if __name__ == "__main__":
+    # the training-only imports are deferred such that importing this module, e.g., for `QNetwork`, is lightweight
+    from torch.utils.tensorboard import SummaryWriter
+
     args = parse_args()
-    run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{int(time.time())}"
+    enable_compilation_cache(args.compilation_cache_dir)
+    # each seed is trained with the same hyperparameters as a run with `--seed` of that seed
+    seeds = [args.seed + seed_idx for seed_idx in range(args.num_seeds)]
+    start_timestamp = int(time.time())
+    run_names = [f"{args.env_id}__{args.exp_name}__{seed}__{start_timestamp}" for seed in seeds]
 
     if args.track:
         import wandb
@@ -142,176 +216,216 @@ if __name__ == "__main__":
             entity=args.wandb_entity,
             sync_tensorboard=True,
             config=vars(args),
-            name=run_name,
+            name=run_names[0],
             monitor_gym=True,
             save_code=True,
         )
-    writer = SummaryWriter(f"runs/{run_name}")
-    writer.add_text(
-        "hyperparameters",
-        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
-    )
+    writers = [SummaryWriter(f"runs/{run_name}") for run_name in run_names]
+    for seed, writer in zip(seeds, writers):
+        writer.add_text(
+            "hyperparameters",
+            "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in {**vars(args), "seed": seed}.items()])),
+        )
 
     # TRY NOT TO MODIFY: seeding
     random.seed(args.seed)
     np.random.seed(args.seed)
-    key = jax.random.PRNGKey(args.seed)
-    key, q_key = jax.random.split(key, 2)
-
-    # env setup
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(args.env_id, args.seed + i, i, args.capture_video, run_name) for i in range(args.num_envs)]
-    )
+    seed_randoms = [random.Random(seed) for seed in seeds]
+
+    # env setup, the envs of each seed are stepped together as a single vector env
+    envs = gym.vector.SyncVectorEnv([
+        make_env(args.env_id, seed + i, seed_idx * args.num_envs + i, args.capture_video, run_names[seed_idx])
+        for seed_idx, seed in enumerate(seeds)
+        for i in range(args.num_envs)
+    ])
     assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    env_seeds = [seed + i for seed in seeds for i in range(args.num_envs)]
 
-    obs, _ = envs.reset(seed=args.seed)
+    obs, _ = envs.reset(seed=env_seeds)
 
     q_network = QNetwork(action_dim=envs.single_action_space.n, num_bins=args.num_bins)
     q_network.apply = jax.jit(q_network.apply, static_argnames=("method",))  # added static_argnames for `method`
 
-    q_state = TrainState.create(
-        apply_fn=q_network.apply,
-        params=q_network.init(q_key, obs),
-        target_params=q_network.init(q_key, obs),
-        tx=optax.adam(learning_rate=args.learning_rate),
-    )
+    # the seeds' train states are stacked along a leading axis, with the same optimiser for each
+    tx = optax.adam(learning_rate=args.learning_rate)
+    q_states = []
+    for seed_idx, seed in enumerate(seeds):
+        key = jax.random.PRNGKey(seed)
+        key, q_key = jax.random.split(key, 2)
+        seed_obs = obs[seed_idx * args.num_envs:(seed_idx + 1) * args.num_envs]
+        q_states.append(TrainState.create(
+            apply_fn=q_network.apply,
+            params=q_network.init(q_key, seed_obs),
+            target_params=q_network.init(q_key, seed_obs),
+            tx=tx,
+        ))
+    q_state = jax.tree_util.tree_map(lambda *xs: jnp.stack(xs), *q_states)
 
     # This step is not necessary as init called on same observation and key will always lead to same initializations
     q_state = q_state.replace(target_params=optax.incremental_update(q_state.params, q_state.target_params, 1))
 
-    rb = ReplayBuffer(
-        args.buffer_size,
-        envs.single_observation_space,
-        envs.single_action_space,
-        "cpu",
-        handle_timeout_termination=False,
-    )
-    rb = NStepReplayBuffer(
-        rb,
-        n_step=args.n_step,
-        gamma=args.gamma
-    )
+    rbs = []
+    for seed in seeds:
+        if args.prioritized_replay:
+            rb = PrioritizedReplayBuffer(
+                args.buffer_size,
+                envs.single_observation_space,
+                envs.single_action_space,
+                seed=seed,
+                alpha=args.priority_alpha,
+                beta=args.priority_beta,
+            )
+        else:
+            rb = ReplayBuffer(
+                args.buffer_size,
+                envs.single_observation_space,
+                envs.single_action_space,
+                seed=seed,
+            )
+        rbs.append(NStepReplayBuffer(
+            rb,
+            n_step=args.n_step,
+            gamma=args.gamma,
+            num_envs=args.num_envs,
+        ))
 
     # Temporal Reward Decomposition variables
     discount_factor = jnp.power(args.gamma, args.n_step)
 
-    # Helper variables
-    batch_size = args.batch_size
-    num_actions = envs.single_action_space.n
-    num_bins = args.num_bins
+    update = jax.jit(make_update(q_network, args.batch_size, discount_factor))
 
     @jax.jit
-    def update(q_state, observations, actions, next_observations, rewards, terminated):
-        # Temporal reward decomposition loss function
-        q_next_target = q_network.apply(q_state.target_params, next_observations, method=QNetwork.decomposed_q_value)
-        chex.assert_shape(q_next_target, (batch_size, num_actions, num_bins))
-
-        q_next_target_value = q_next_target[jnp.arange(args.batch_size), jnp.argmax(jnp.sum(q_next_target, axis=-1), axis=-1)]
-        chex.assert_shape(q_next_target_value, (batch_size, num_bins))
-
-        discounted_q_next_target = jnp.expand_dims(1 - terminated, axis=1) * discount_factor * q_next_target_value
-        chex.assert_shape(discounted_q_next_target, (batch_size, num_bins))
-        rolled_q_next_target = jnp.roll(discounted_q_next_target, shift=1, axis=1)
-        chex.assert_shape(rolled_q_next_target, (batch_size, num_bins))
-        next_q_value = rolled_q_next_target.at[:, -1].add(rolled_q_next_target[:, 0]).at[:, 0].set(rewards)
-        chex.assert_shape(next_q_value, (batch_size, num_bins))
-
-        def trd_mse_loss(params):
-            q_pred = q_network.apply(params, observations, method=QNetwork.decomposed_q_value)
-            chex.assert_shape(q_pred, (batch_size, num_actions, num_bins))
-            q_pred = q_pred[jnp.arange(args.batch_size), actions.squeeze()]
-            chex.assert_shape(q_pred, (batch_size, num_bins))
+    @partial(jax.vmap, in_axes=(0, 0, None))  # over the seeds
+    def multi_update(q_state, batches, sync_target):
+        def batch_update(q_state, data):
+            return update(
+                q_state, data.observations, data.actions, data.next_observations, data.rewards, data.dones, data.weights
+            )
 
-            loss = jnp.mean(jnp.square(q_pred - next_q_value))
-            chex.assert_shape(loss, ())
-            return loss, q_pred
+        return scan_update(batch_update, q_state, batches, sync_target, args.tau)
 
-        (loss_value, q_pred), grads = jax.value_and_grad(trd_mse_loss, has_aux=True)(q_state.params)
-        q_state = q_state.apply_gradients(grads=grads)
-        return loss_value, q_pred, q_state
+    @jax.jit
+    def greedy_actions(params, observations):
+        return jax.vmap(q_network.apply)(params, observations).argmax(axis=-1)
 
+    timer = PhaseTimer(args.phase_timers, args.phase_timers_sync)
+    profiler = ProfilerWindow(args.profile_steps, f"runs/{run_names[0]}/profile")
     start_time = time.time()
 
     # TRY NOT TO MODIFY: start the game
-    obs, _ = envs.reset(seed=args.seed)
+    obs, _ = envs.reset(seed=env_seeds)
     for global_step in range(args.total_timesteps):
+        profiler.step(global_step)
+
         # ALGO LOGIC: put action logic here
-        epsilon = linear_schedule(args.start_e, args.end_e, args.exploration_fraction * args.total_timesteps, global_step)
-        if random.random() < epsilon:
-            actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
-        else:
-            q_values = q_network.apply(q_state.params, obs)
-            actions = q_values.argmax(axis=-1)
-            actions = jax.device_get(actions)
+        with timer.phase("action"):
+            epsilon = linear_schedule(args.start_e, args.end_e, args.exploration_fraction * args.total_timesteps, global_step)
+            explore = np.array([seed_random.random() < epsilon for seed_random in seed_randoms])
+            if np.all(explore):
+                actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
+            else:
+                actions = greedy_actions(q_state.params, obs.reshape((args.num_seeds, args.num_envs) + obs.shape[1:]))
+                actions = np.array(jax.device_get(actions)).reshape(-1)
+                for seed_idx in np.nonzero(explore)[0]:
+                    for i in range(seed_idx * args.num_envs, (seed_idx + 1) * args.num_envs):
+                        actions[i] = envs.single_action_space.sample()
 
         # TRY NOT TO MODIFY: execute the game and log data.
-        next_obs, rewards, terminated, truncated, infos = envs.step(actions)
+        with timer.phase("env_step"):
+            next_obs, rewards, terminated, truncated, infos = envs.step(actions)
 
         # TRY NOT TO MODIFY: record rewards for plotting purposes
         if "final_info" in infos:
-            for info in infos["final_info"]:
+            for idx, info in enumerate(infos["final_info"]):
                 # Skip the envs that are not done
-                if "episode" not in info:
+                if info is None or "episode" not in info:
                     continue
-                print(f"global_step={global_step}, episodic_return={info['episode']['r']}")
+                writer = writers[idx // args.num_envs]
+                print(f"seed={seeds[idx // args.num_envs]}, global_step={global_step}, episodic_return={info['episode']['r']}")
                 writer.add_scalar("charts/episodic_return", info["episode"]["r"], global_step)
                 writer.add_scalar("charts/episodic_length", info["episode"]["l"], global_step)
                 writer.add_scalar("charts/epsilon", epsilon, global_step)
 
         # TRY NOT TO MODIFY: save data to reply buffer; handle `final_observation`
-        real_next_obs = next_obs.copy()
-        for idx, d in enumerate(truncated):
-            if d:
-                real_next_obs[idx] = infos["final_observation"][idx]
-        rb.add(obs, real_next_obs, actions, rewards, terminated, truncated)
+        with timer.phase("rb_add"):
+            real_next_obs = next_obs.copy()
+            for idx, d in enumerate(truncated):
+                if d:
+                    real_next_obs[idx] = infos["final_observation"][idx]
+            for seed_idx, rb in enumerate(rbs):
+                envs_slice = slice(seed_idx * args.num_envs, (seed_idx + 1) * args.num_envs)
+                rb.add(
+                    obs[envs_slice],
+                    real_next_obs[envs_slice],
+                    actions[envs_slice],
+                    rewards[envs_slice],
+                    terminated[envs_slice],
+                    truncated[envs_slice],
+                )
 
         # TRY NOT TO MODIFY: CRUCIAL step easy to overlook
         obs = next_obs
 
         # ALGO LOGIC: training.
-        if global_step > args.learning_starts:
-            if global_step % args.train_frequency == 0:
-                data = rb.sample(args.batch_size)
-                # perform a gradient-descent step
-                loss, old_val, q_state = update(
-                    q_state,
-                    data.observations.numpy(),
-                    data.actions.numpy(),
-                    data.next_observations.numpy(),
-                    data.rewards.flatten().numpy(),
-                    data.dones.flatten().numpy(),
+        if global_step > args.learning_starts and global_step % (args.train_frequency * args.updates_per_dispatch) == 0:
+            # perform `updates_per_dispatch` gradient-descent steps, with the target network updates, in one dispatch
+            update_steps = global_step - args.train_frequency * np.arange(args.updates_per_dispatch)[::-1]
+            with timer.phase("rb_sample"):
+                if args.prioritized_replay:
+                    for rb in rbs:
+                        rb.buffer.beta = args.priority_beta + (1 - args.priority_beta) * global_step / args.total_timesteps
+                # the batches of each seed are stacked, shape (num_seeds, updates_per_dispatch, batch_size, ...)
+                batches = jax.tree_util.tree_map(
+                    lambda *xs: np.stack(xs),
+                    *[stack_batches(rb.sample(args.batch_size * args.updates_per_dispatch), args.updates_per_dispatch) for rb in rbs],
                 )
-
-                if global_step % 100 == 0:
-                    writer.add_scalar("losses/td_loss", jax.device_get(loss), global_step)
-                    writer.add_scalar("losses/q_values", jax.device_get(old_val).mean(), global_step)
+            with timer.phase("transfer"):
+                device_batches = timer.block(jax.device_put(batches))
+            with timer.phase("update"):
+                # the target network updates are within the update's scan
+                sync_target = target_network_syncs(update_steps, args.train_frequency, args.target_network_frequency)
+                (losses, old_vals, td_errors), q_state = timer.block(multi_update(q_state, device_batches, sync_target))
+            if args.prioritized_replay:
+                with timer.phase("rb_update_priorities"):
+                    td_errors = jax.device_get(td_errors)
+                    for seed_idx, rb in enumerate(rbs):
+                        rb.buffer.update_priorities(batches.indices[seed_idx].reshape(-1), td_errors[seed_idx].reshape(-1))
+
+            if np.any(update_steps % 100 == 0):
+                with timer.phase("logging"):
+                    losses, old_vals = jax.device_get((losses, old_vals))
                     print("SPS:", int(global_step / (time.time() - start_time)))
-                    writer.add_scalar("charts/SPS", int(global_step / (time.time() - start_time)), global_step)
+                    for idx in np.nonzero(update_steps % 100 == 0)[0]:
+                        for seed_idx, writer in enumerate(writers):
+                            writer.add_scalar("losses/td_loss", losses[seed_idx, idx], update_steps[idx])
+                            writer.add_scalar("losses/q_values", old_vals[seed_idx, idx].mean(), update_steps[idx])
+                            writer.add_scalar("charts/SPS", int(global_step / (time.time() - start_time)), update_steps[idx])
 
-            # update target network
-            if global_step % args.target_network_frequency == 0:
-                q_state = q_state.replace(
-                    target_params=optax.incremental_update(q_state.params, q_state.target_params, args.tau)
-                )
+        if args.phase_timers and global_step % args.timers_period == 0:
+            # the seeds are trained together, so the timings are written to the first seed's run
+            timer.write(writers[0], global_step, "timers")
+    profiler.close()
 
     if args.save_model:
-        model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
-        with open(model_path, "wb") as f:
-            f.write(flax.serialization.to_bytes(q_state.params))
-        print(f"model saved to {model_path}")
         from cleanrl_utils.evals.dqn_jax_eval import evaluate
 
-        episodic_returns = evaluate(
-            model_path,
-            make_env,
-            args.env_id,
-            eval_episodes=10,
-            run_name=f"{run_name}-eval",
-            Model=partial(QNetwork, num_bins=args.num_bins),
-            epsilon=args.end_e,
-        )
-        for idx, episodic_return in enumerate(episodic_returns):
-            writer.add_scalar("eval/episodic_return", episodic_return, idx)
+        for seed_idx, (run_name, writer) in enumerate(zip(run_names, writers)):
+            model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
+            with open(model_path, "wb") as f:
+                f.write(flax.serialization.to_bytes(jax.tree_util.tree_map(lambda x: x[seed_idx], q_state.params)))
+            print(f"model saved to {model_path}")
+
+            episodic_returns = evaluate(
+                model_path,
+                make_env,
+                args.env_id,
+                eval_episodes=10,
+                run_name=f"{run_name}-eval",
+                Model=partial(QNetwork, num_bins=args.num_bins),
+                epsilon=args.end_e,
+            )
+            for idx, episodic_return in enumerate(episodic_returns):
+                writer.add_scalar("eval/episodic_return", episodic_return, idx)
 
         # if args.upload_model:
         #     from cleanrl_utils.huggingface import push_to_hub
@@ -321,4 +435,5 @@ if __name__ == "__main__":
         #     push_to_hub(args, episodic_returns, repo_id, "trd-DQN", f"runs/{run_name}", f"videos/{run_name}-eval")
 
     envs.close()
-    writer.close()
+    for writer in writers:
+        writer.close()
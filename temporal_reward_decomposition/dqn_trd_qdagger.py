@@ -14,10 +14,6 @@ from collections import deque
 from distutils.util import strtobool
 from functools import partial
 
-os.environ[
-    "XLA_PYTHON_CLIENT_MEM_FRACTION"
-] = "0.7"  # see https://github.com/google/jax/discussions/6332#discussioncomment-1279991
-
 import chex
 import flax
 import flax.linen as nn
@@ -27,14 +23,24 @@ import jax.numpy as jnp
 import numpy as np
 import optax
 from flax.training.train_state import TrainState
-from rich.progress import track
-from stable_baselines3.common.buffers import ReplayBuffer
-from torch.utils.tensorboard import SummaryWriter
-
-from cleanrl.dqn_jax import QNetwork as TeacherModel
-from cleanrl_utils.evals.dqn_jax_eval import evaluate
 
+from temporal_reward_decomposition.utils.compilation import aot_compile, enable_compilation_cache
+from temporal_reward_decomposition.utils.device_replay_buffer import DeviceReplayBuffer
+from temporal_reward_decomposition.utils.evaluator import BackgroundEvaluator
+from temporal_reward_decomposition.utils.lazy_n_step_buffer import LazyNStepReplayBuffer
+from temporal_reward_decomposition.utils.metrics import MetricsFlusher, accumulate_metrics, init_metrics
 from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+from temporal_reward_decomposition.utils.prefetch_sampler import PrefetchSampler
+from temporal_reward_decomposition.utils.profiling import PhaseTimer, ProfilerWindow
+from temporal_reward_decomposition.utils.prioritized_replay_buffer import PrioritizedReplayBuffer
+from temporal_reward_decomposition.utils.replay_dataset import (
+    load_replay_dataset,
+    make_teacher_buffer_config,
+    replay_dataset_path,
+    save_replay_dataset,
+)
+from temporal_reward_decomposition.utils.scan_update import scan_update, stack_batches
 
 
 def parse_args():
@@ -44,6 +50,8 @@ def parse_args():
         help="the name of this experiment")
     parser.add_argument("--seed", type=int, default=1,
         help="seed of the experiment")
+    parser.add_argument("--num-seeds", type=int, default=1,
+        help="the number of seeds (from `seed`) trained together, with the train states stacked and the update vmapped over the seeds")
     parser.add_argument("--track", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
         help="if toggled, this experiment will be tracked with Weights and Biases")
     parser.add_argument("--wandb-project-name", type=str, default="cleanRL",
@@ -98,12 +106,48 @@ def parse_args():
         help="the number of steps to run the teacher policy to generate the replay buffer")
     parser.add_argument("--offline-steps", type=int, default=50_000,
         help="the number of steps to run the student policy with the teacher's replay buffer")
+    parser.add_argument("--updates-per-dispatch", type=int, default=1,
+        help="the number of offline updates (with the target network updates) run in a single jitted `lax.scan`")
+    parser.add_argument("--compilation-cache-dir", type=str, default="jax-cache",
+        help="the directory of the persistent XLA compilation cache shared between runs, if empty then the functions are compiled by every run")
+    parser.add_argument("--aot-compile", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the updates are lowered and compiled ahead-of-time, before the offline training, rather than on their first call")
+    parser.add_argument("--prefetch-batches", type=int, default=2,
+        help="the number of batches sampled ahead by a background thread while updating, if 0 then batches are sampled when needed")
+    parser.add_argument("--prioritized-replay", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, transitions are sampled proportional to their mean absolute TD error over the reward bins")
+    parser.add_argument("--priority-alpha", type=float, default=0.6,
+        help="the prioritization exponent of the TD errors")
+    parser.add_argument("--priority-beta", type=float, default=0.4,
+        help="the starting importance-sampling exponent, annealed to 1 by the end of training")
     parser.add_argument("--temperature", type=float, default=1.0,
         help="the temperature parameter for qdagger")
+    parser.add_argument("--eval-episodes", type=int, default=10,
+        help="the number of episodes of the student's periodic evaluations, run together in a vector env")
+    parser.add_argument("--async-eval", type=lambda x: bool(strtobool(x)), default=True, nargs="?", const=True,
+        help="if toggled, the student's periodic evaluations run in a background thread while training continues, otherwise training waits for them")
     parser.add_argument("--offline-eval-period", type=int, default=5_000,  # 10x
         help="how often the student will be evaluated within the offline training")
     parser.add_argument("--online-eval-period", type=int, default=25_000,  # 10x
         help="how often the student will be evaluated within the online training")
+    parser.add_argument("--device-replay-buffer", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the teacher's replay buffer is copied to the device and sampled within the jitted update for the offline training")
+    parser.add_argument("--teacher-buffer-dir", type=str, default=None,
+        help="if set, the directory to save the teacher's replay buffer to and reuse it from in later runs with the same env, seed and teacher")
+    parser.add_argument("--lazy-n-step", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the replay buffer stores single-step transitions and computes the n-step transitions when sampled, such that the teacher's replay buffer is shared between n-steps")
+    parser.add_argument("--metrics-flush-period", type=int, default=1_000,
+        help="how often (in steps) the losses, accumulated on the device, are fetched and written as their means since the last flush")
+    parser.add_argument("--phase-timers", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the phases of the training loops are timed and written to TensorBoard as histograms under `timers/`")
+    parser.add_argument("--phase-timers-sync", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the timed updates wait for the device such that their phase includes the device time, slowing training")
+    parser.add_argument("--timers-period", type=int, default=10_000,
+        help="how often (in steps) the phase timings are written")
+    parser.add_argument("--profile-phase", type=str, default="online", choices=["teacher", "offline", "online"],
+        help="the training loop of `profile-steps`")
+    parser.add_argument("--profile-steps", type=int, nargs=2, default=None, metavar=("START", "STOP"),
+        help="if set, the steps (counted from the start of `profile-phase`) traced with `jax.profiler` to `runs/{run_name}/profile`")
 
     # Temporal Reward Decomposition arguments
     parser.add_argument("--num-bins", type=int, required=True,
@@ -113,12 +157,16 @@ def parse_args():
 
     args = parser.parse_args()
     # fmt: on
-    assert args.num_envs == 1, "vectorized envs are not supported at the moment"
 
     # if args.teacher_policy_hf_repo is None:
     #     args.teacher_policy_hf_repo = f"cleanrl/{args.env_id}-dqn_atari_jax-seed1"
 
     assert args.num_bins > 1 and args.n_step >= 1
+    assert args.offline_steps % args.updates_per_dispatch == 0
+    assert args.num_seeds >= 1 and not (args.track and args.num_seeds > 1), "each seed is logged as a separate run"
+    assert not (args.lazy_n_step and args.device_replay_buffer), "the lazy n-step transitions are only computed on the host"
+    assert not (args.prioritized_replay and (args.lazy_n_step or args.device_replay_buffer)), \
+        "prioritized replay is only supported by the (host) n-step replay buffer"
 
     return args
 
@@ -158,6 +206,122 @@ class QNetwork(nn.Module):
 
 class TrainState(TrainState):
     target_params: flax.core.FrozenDict
+    metrics: dict
+
+
+def make_replay_buffer(args, envs, seed):
+    if args.lazy_n_step:
+        return LazyNStepReplayBuffer(
+            args.buffer_size,
+            envs.single_observation_space,
+            envs.single_action_space,
+            args.n_step,
+            args.gamma,
+            args.num_envs,
+            seed=seed,
+            store_teacher_q_values=True,
+        )
+
+    if args.prioritized_replay:
+        rb = PrioritizedReplayBuffer(
+            args.buffer_size,
+            envs.single_observation_space,
+            envs.single_action_space,
+            seed=seed,
+            store_teacher_q_values=True,
+            alpha=args.priority_alpha,
+            beta=args.priority_beta,
+        )
+    else:
+        rb = ReplayBuffer(
+            args.buffer_size,
+            envs.single_observation_space,
+            envs.single_action_space,
+            seed=seed,
+            store_teacher_q_values=True,
+        )
+    return NStepReplayBuffer(rb, args.n_step, args.gamma, args.num_envs)
+
+
+def update_priorities(args, sampler, step, indices, td_errors):
+    """Updates the sampled transitions' priorities and anneals the importance-sampling exponent over all the steps"""
+    with sampler.lock:
+        sampler.buffer.buffer.update_priorities(indices, td_errors)
+        sampler.buffer.buffer.beta = args.priority_beta + (1 - args.priority_beta) * step / (args.offline_steps + args.total_timesteps)
+
+
+@jax.vmap
+def kl_divergence_with_logits(target_logits, prediction_logits):
+    """Implementation of on-policy distillation loss."""
+    out = -nn.softmax(target_logits) * (nn.log_softmax(prediction_logits) - nn.log_softmax(target_logits))
+    return jnp.sum(out)
+
+
+def make_update(q_network: nn.Module, batch_size: int, discount_factor: float, temperature: float):
+    """The QDagger TRD update of a batch, the TD loss with the distillation loss of the teacher's q-values (weighted by
+    `distill_coeff`), returning the TD errors (the priorities) and the updated train state with the accumulated
+    metrics, where `discount_factor` is the n-step discount"""
+    num_actions, num_bins = q_network.action_dim, q_network.num_bins
+
+    def update(q_state, observations, actions, next_observations, rewards, terminated, teacher_q_values, distill_coeff, weights=None):
+        # Temporal reward decomposition loss function
+        q_next_target = q_network.apply(q_state.target_params, next_observations, method=QNetwork.decomposed_q_value)
+        chex.assert_shape(q_next_target, (batch_size, num_actions, num_bins))
+        q_next_target_value = q_next_target[jnp.arange(batch_size), jnp.argmax(jnp.sum(q_next_target, axis=-1), axis=-1)]
+        chex.assert_shape(q_next_target_value, (batch_size, num_bins))
+
+        discounted_q_next_target = jnp.expand_dims(1 - terminated, axis=1) * discount_factor * q_next_target_value
+        chex.assert_shape(discounted_q_next_target, (batch_size, num_bins))
+        rolled_q_next_target = jnp.roll(discounted_q_next_target, shift=1, axis=1)
+        chex.assert_shape(rolled_q_next_target, (batch_size, num_bins))
+        next_q_value = rolled_q_next_target.at[:, -1].add(rolled_q_next_target[:, 0]).at[:, 0].set(rewards)
+        chex.assert_shape(next_q_value, (batch_size, num_bins))
+
+        # the teacher's q-values are computed when the transitions are added to the replay buffer
+        chex.assert_shape(teacher_q_values, (batch_size, num_actions))
+
+        def qdagger_trd_loss(params, td_target, teacher_q_values):
+            student_q_values = q_network.apply(params, observations, method=QNetwork.decomposed_q_value)
+            chex.assert_shape(student_q_values, (batch_size, num_actions, num_bins))
+
+            # td loss
+            q_pred = student_q_values[jnp.arange(batch_size), actions.squeeze()]
+            chex.assert_shape(q_pred, (batch_size, num_bins))
+            squared_errors = jnp.square(q_pred - td_target)
+            if weights is not None:  # importance-sampling weights of the prioritized samples
+                squared_errors = jnp.expand_dims(weights, axis=1) * squared_errors
+            q_loss = jnp.mean(squared_errors)
+            chex.assert_shape(q_loss, ())
+
+            # distil loss
+            teacher_q_values = teacher_q_values / temperature
+            student_q_values = jnp.sum(student_q_values, axis=-1) / temperature
+            chex.assert_shape(teacher_q_values, (batch_size, num_actions))
+            chex.assert_shape(student_q_values, (batch_size, num_actions))
+            policy_divergence = kl_divergence_with_logits(teacher_q_values, student_q_values)
+            chex.assert_shape(policy_divergence, (batch_size,))
+            distill_loss = distill_coeff * jnp.mean(policy_divergence)
+            chex.assert_shape(distill_loss, ())
+
+            overall_loss = q_loss + distill_loss
+            chex.assert_shape(overall_loss, ())
+            return overall_loss, (q_loss, q_pred, distill_loss)
+
+        (loss_value, (q_loss, q_pred, distill_loss)), grads = jax.value_and_grad(qdagger_trd_loss, has_aux=True)(
+            q_state.params, next_q_value, teacher_q_values
+        )
+        q_state = q_state.apply_gradients(grads=grads)
+        # the metrics are accumulated on the device rather than fetched after each update
+        q_state = q_state.replace(metrics=accumulate_metrics(
+            q_state.metrics, loss=loss_value, td_loss=q_loss, distill_loss=distill_loss, q_values=jnp.mean(q_pred)
+        ))
+
+        # the per-bin td errors are averaged for the priority of each transition
+        td_errors = jnp.mean(jnp.abs(q_pred - next_q_value), axis=-1)
+        chex.assert_shape(td_errors, (batch_size,))
+        return td_errors, q_state
+
+    return update
 
 
 def linear_schedule(start_e: float, end_e: float, duration: int, t: int):
@@ -166,8 +330,21 @@ def linear_schedule(start_e: float, end_e: float, duration: int, t: int):
 
 
 if __name__ == "__main__":
+    # see https://github.com/google/jax/discussions/6332#discussioncomment-1279991
+    os.environ.setdefault("XLA_PYTHON_CLIENT_MEM_FRACTION", "0.7")
+
+    # the training-only imports are deferred such that importing this module, e.g., for `QNetwork`, is lightweight
+    from cleanrl.dqn_jax import QNetwork as TeacherModel
+    from cleanrl_utils.evals.dqn_jax_eval import evaluate
+    from rich.progress import track
+    from torch.utils.tensorboard import SummaryWriter
+
     args = parse_args()
-    run_name = f"{args.env_id}__{args.exp_name}__{args.seed}__{int(time.time())}"
+    enable_compilation_cache(args.compilation_cache_dir)
+    # each seed is trained with the same hyperparameters as a run with `--seed` of that seed
+    seeds = [args.seed + seed_idx for seed_idx in range(args.num_seeds)]
+    start_timestamp = int(time.time())
+    run_names = [f"{args.env_id}__{args.exp_name}__{seed}__{start_timestamp}" for seed in seeds]
 
     if args.track:
         import wandb
@@ -177,44 +354,55 @@ if __name__ == "__main__":
             entity=args.wandb_entity,
             sync_tensorboard=True,
             config=vars(args),
-            name=run_name,
+            name=run_names[0],
             monitor_gym=True,
             save_code=True,
         )
-    writer = SummaryWriter(f"runs/{run_name}")
-    writer.add_text(
-        "hyperparameters",
-        "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in vars(args).items()])),
-    )
+    writers = [SummaryWriter(f"runs/{run_name}") for run_name in run_names]
+    for seed, writer in zip(seeds, writers):
+        writer.add_text(
+            "hyperparameters",
+            "|param|value|\n|-|-|\n%s" % ("\n".join([f"|{key}|{value}|" for key, value in {**vars(args), "seed": seed}.items()])),
+        )
 
     # TRY NOT TO MODIFY: seeding
     random.seed(args.seed)
     np.random.seed(args.seed)
+    seed_randoms = [random.Random(seed) for seed in seeds]
     key = jax.random.PRNGKey(args.seed)
-    key, q_key = jax.random.split(key, 2)
 
-    # env setup
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(args.env_id, args.seed + i, i, args.capture_video, run_name) for i in range(args.num_envs)]
-    )
+    # env setup, the envs of each seed are stepped together as a single vector env
+    def make_seeds_envs():
+        return gym.vector.SyncVectorEnv([
+            make_env(args.env_id, seed + i, seed_idx * args.num_envs + i, args.capture_video, run_names[seed_idx])
+            for seed_idx, seed in enumerate(seeds)
+            for i in range(args.num_envs)
+        ])
+
+    envs = make_seeds_envs()
     assert isinstance(envs.single_action_space, gym.spaces.Discrete), "only discrete action space is supported"
+    env_seeds = [seed + i for seed in seeds for i in range(args.num_envs)]
+    seed_envs = [slice(seed_idx * args.num_envs, (seed_idx + 1) * args.num_envs) for seed_idx in range(args.num_seeds)]
 
     q_network = QNetwork(action_dim=envs.single_action_space.n, num_bins=args.num_bins)
     q_network.apply = jax.jit(q_network.apply, static_argnames=("method",))
 
-    q_state = TrainState.create(
-        apply_fn=q_network.apply,
-        params=q_network.init(q_key, envs.observation_space.sample()),
-        target_params=q_network.init(q_key, envs.observation_space.sample()),
-        tx=optax.adam(learning_rate=args.learning_rate),
-    )
+    # the seeds' train states are stacked along a leading axis, with the same optimiser for each
+    tx = optax.adam(learning_rate=args.learning_rate)
+    q_states = []
+    for seed in seeds:
+        _, q_key = jax.random.split(jax.random.PRNGKey(seed), 2)
+        q_states.append(TrainState.create(
+            apply_fn=q_network.apply,
+            params=q_network.init(q_key, envs.observation_space.sample()),
+            target_params=q_network.init(q_key, envs.observation_space.sample()),
+            tx=tx,
+            metrics=init_metrics(loss=(), td_loss=(), distill_loss=(), q_values=()),
+        ))
+    q_state = jax.tree_util.tree_map(lambda *xs: jnp.stack(xs), *q_states)
 
     # TRD logic
     discount_factor = jnp.power(args.gamma, args.n_step)
-    # Helper variables
-    batch_size = args.batch_size
-    num_actions = envs.single_action_space.n
-    num_bins = args.num_bins
 
     # QDAGGER LOGIC:
     # teacher_model_path = hf_hub_download(repo_id=args.teacher_policy_hf_repo, filename="dqn_atari_jax.cleanrl_model")
@@ -226,206 +414,346 @@ if __name__ == "__main__":
         teacher_params = flax.serialization.from_bytes(teacher_params, f.read())
     teacher_model.apply = jax.jit(teacher_model.apply)
 
-    # evaluate the teacher model
+    # evaluate the teacher model, shared by the seeds
     teacher_episodic_returns = evaluate(
         teacher_model_path,
         make_env,
         args.env_id,
         eval_episodes=args.teacher_eval_episodes,
-        run_name=f"{run_name}-teacher-eval",
+        run_name=f"{run_names[0]}-teacher-eval",
         Model=TeacherModel,
         epsilon=0.05,
         capture_video=False,
     )
-    for idx, episode_return in enumerate(teacher_episodic_returns):
-        writer.add_scalar(f"charts/teacher/episodic_return", episode_return, idx)
+    for writer in writers:
+        for idx, episode_return in enumerate(teacher_episodic_returns):
+            writer.add_scalar(f"charts/teacher/episodic_return", episode_return, idx)
 
     # collect teacher data for args.teacher_steps
     # we assume we don't have access to the teacher's replay buffer
     # see Fig. A.19 in Agarwal et al. 2022 for more detail
-    rb = ReplayBuffer(
-        args.buffer_size,
-        envs.single_observation_space,
-        envs.single_action_space,
-        "cpu",
-        optimize_memory_usage=True,
-        handle_timeout_termination=False,
-    )
-    rb = NStepReplayBuffer(
-        rb,
-        args.n_step,
-        args.gamma
-    )
+    rbs = [make_replay_buffer(args, envs, seed) for seed in seeds]
+
+    teacher_buffer_paths = None
+    if args.teacher_buffer_dir is not None:
+        teacher_buffer_config = make_teacher_buffer_config(
+            args, ("num_envs", "buffer_size", "teacher_steps", "start_e", "end_e", "lazy_n_step", "prioritized_replay")
+        )
+        teacher_buffer_paths = [
+            replay_dataset_path(args.teacher_buffer_dir, args.env_id, seed, teacher_model_path, **teacher_buffer_config)
+            for seed in seeds
+        ]
 
-    obs, _ = envs.reset(seed=args.seed)
+    timer = PhaseTimer(args.phase_timers, args.phase_timers_sync)
+    profiler = ProfilerWindow(args.profile_steps if args.profile_phase == "teacher" else None, f"runs/{run_names[0]}/profile")
     start_time = time.time()
     print(f'Started filling: {start_time}')
-    for global_step in track(range(args.teacher_steps), description="filling teacher's replay buffer"):
-        epsilon = linear_schedule(args.start_e, args.end_e, args.teacher_steps, global_step)
-        if random.random() < epsilon:
-            actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
-        else:
-            q_values = teacher_model.apply(teacher_params, obs)
-            actions = q_values.argmax(axis=-1)
-            actions = jax.device_get(actions)
-        next_obs, rewards, terminated, truncated, infos = envs.step(actions)
-        real_next_obs = next_obs.copy()
-        for idx, d in enumerate(truncated):
-            if d:
-                real_next_obs[idx] = infos["final_observation"][idx]
-        rb.add(obs, real_next_obs, actions, rewards, terminated, infos)
-        obs = next_obs
+    if teacher_buffer_paths is not None and all(load_replay_dataset(rb, path) for rb, path in zip(rbs, teacher_buffer_paths)):
+        print(f"Loaded the teacher's replay buffers from {', '.join(teacher_buffer_paths)}")
+    else:
+        # every seed's buffer is filled together, rather than only those of the missing datasets
+        rbs = [make_replay_buffer(args, envs, seed) for seed in seeds]
+        obs, _ = envs.reset(seed=env_seeds)
+        for global_step in track(range(args.teacher_steps // args.num_envs), description="filling teacher's replay buffer"):
+            profiler.step(global_step)
+            with timer.phase("action"):
+                epsilon = linear_schedule(args.start_e, args.end_e, args.teacher_steps, global_step)
+                explore = np.array([seed_random.random() < epsilon for seed_random in seed_randoms])
+                teacher_q_values = teacher_model.apply(teacher_params, obs)
+                if np.all(explore):
+                    actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
+                else:
+                    actions = np.array(jax.device_get(teacher_q_values.argmax(axis=-1)))
+                    for seed_idx in np.nonzero(explore)[0]:
+                        actions[seed_envs[seed_idx]] = [envs.single_action_space.sample() for _ in range(args.num_envs)]
+            with timer.phase("env_step"):
+                next_obs, rewards, terminated, truncated, infos = envs.step(actions)
+            with timer.phase("rb_add"):
+                real_next_obs = next_obs.copy()
+                for idx, d in enumerate(truncated):
+                    if d:
+                        real_next_obs[idx] = infos["final_observation"][idx]
+                teacher_q_values = jax.device_get(teacher_q_values)
+                for rb, envs_slice in zip(rbs, seed_envs):
+                    rb.add(
+                        obs[envs_slice],
+                        real_next_obs[envs_slice],
+                        actions[envs_slice],
+                        rewards[envs_slice],
+                        terminated[envs_slice],
+                        truncated[envs_slice],
+                        teacher_q_values[envs_slice],
+                    )
+            obs = next_obs
+
+            if args.phase_timers and global_step % args.timers_period == 0:
+                timer.write(writers[0], global_step, "timers/teacher")
+        profiler.close()
+        if args.phase_timers:
+            timer.write(writers[0], global_step, "timers/teacher")
+
+        if teacher_buffer_paths is not None:
+            for seed, rb, path in zip(seeds, rbs, teacher_buffer_paths):
+                save_replay_dataset(rb, path, env_id=args.env_id, seed=seed, **teacher_buffer_config)
     end_time = time.time()
     print(f'Stopped filling : {end_time}, diff: {end_time - start_time:.2f} seconds')
 
-    @jax.vmap
-    def kl_divergence_with_logits(target_logits, prediction_logits):
-        """Implementation of on-policy distillation loss."""
-        out = -nn.softmax(target_logits) * (nn.log_softmax(prediction_logits) - nn.log_softmax(target_logits))
-        return jnp.sum(out)
+    update = jax.jit(make_update(q_network, args.batch_size, discount_factor, args.temperature))
 
     @jax.jit
-    def update(q_state, observations, actions, next_observations, rewards, terminated, distill_coeff):
-        # Temporal reward decomposition loss function
-        q_next_target = q_network.apply(q_state.target_params, next_observations, method=QNetwork.decomposed_q_value)
-        chex.assert_shape(q_next_target, (batch_size, num_actions, num_bins))
-        q_next_target_value = q_next_target[jnp.arange(args.batch_size), jnp.argmax(jnp.sum(q_next_target, axis=-1), axis=-1)]
-        chex.assert_shape(q_next_target_value, (batch_size, num_bins))
-
-        discounted_q_next_target = jnp.expand_dims(1 - terminated, axis=1) * discount_factor * q_next_target_value
-        chex.assert_shape(discounted_q_next_target, (batch_size, num_bins))
-        rolled_q_next_target = jnp.roll(discounted_q_next_target, shift=1, axis=1)
-        chex.assert_shape(rolled_q_next_target, (batch_size, num_bins))
-        next_q_value = rolled_q_next_target.at[:, -1].add(rolled_q_next_target[:, 0]).at[:, 0].set(rewards)
-        chex.assert_shape(next_q_value, (batch_size, num_bins))
-
-        teacher_q_values = teacher_model.apply(teacher_params, observations)
-        chex.assert_shape(teacher_q_values, (batch_size, num_actions))
-
-        def qdagger_trd_loss(params, td_target, teacher_q_values):
-            student_q_values = q_network.apply(params, observations, method=QNetwork.decomposed_q_value)
-            chex.assert_shape(student_q_values, (batch_size, num_actions, num_bins))
-
-            # td loss
-            q_pred = student_q_values[jnp.arange(batch_size), actions.squeeze()]
-            chex.assert_shape(q_pred, (batch_size, num_bins))
-            q_loss = jnp.mean(jnp.square(q_pred - td_target))
-            chex.assert_shape(q_loss, ())
+    @partial(jax.vmap, in_axes=(0, 0, None, 0))  # over the seeds
+    def multi_update(q_state, batches, sync_target, distill_coeff):
+        def batch_update(q_state, data):
+            return update(
+                q_state,
+                data.observations,
+                data.actions,
+                data.next_observations,
+                data.rewards,
+                data.dones,
+                data.teacher_q_values,
+                distill_coeff,
+                data.weights,
+            )
 
-            # distil loss
-            teacher_q_values = teacher_q_values / args.temperature
-            student_q_values = jnp.sum(student_q_values, axis=-1) / args.temperature
-            chex.assert_shape(teacher_q_values, (batch_size, num_actions))
-            chex.assert_shape(student_q_values, (batch_size, num_actions))
-            policy_divergence = kl_divergence_with_logits(teacher_q_values, student_q_values)
-            chex.assert_shape(policy_divergence, (batch_size,))
-            distill_loss = distill_coeff * jnp.mean(policy_divergence)
-            chex.assert_shape(distill_loss, ())
+        return scan_update(batch_update, q_state, batches, sync_target, args.tau)
 
-            overall_loss = q_loss + distill_loss
-            chex.assert_shape(overall_loss, ())
-            return overall_loss, (q_loss, q_pred, distill_loss)
+    @jax.jit
+    @partial(jax.vmap, in_axes=(0, 0, 0, None, 0))  # over the seeds
+    def multi_sample_and_update(q_state, device_rb, sample_keys, sync_target, distill_coeff):
+        def sample_and_update(q_state, sample_key):
+            data = device_rb.sample(sample_key, args.batch_size)
+            return update(
+                q_state,
+                data.observations,
+                data.actions,
+                data.next_observations,
+                data.rewards,
+                data.dones,
+                data.teacher_q_values,
+                distill_coeff,
+            )
 
-        (loss_value, (q_loss, q_pred, distill_loss)), grads = jax.value_and_grad(qdagger_trd_loss, has_aux=True)(
-            q_state.params, next_q_value, teacher_q_values
-        )
-        q_state = q_state.apply_gradients(grads=grads)
-        return loss_value, q_loss, q_pred, distill_loss, q_state
+        return scan_update(sample_and_update, q_state, sample_keys, sync_target, args.tau)
 
-    # offline training phase: train the student model using the qdagger loss
-    for global_step in track(range(args.offline_steps), description="offline student training"):
-        data = rb.sample(args.batch_size)
-        # perform a gradient-descent step
-        loss, q_loss, old_val, distill_loss, q_state = update(
+    @jax.jit
+    @partial(jax.vmap, in_axes=(0, 0, 0))  # over the seeds
+    def online_update(q_state, data, distill_coeff):
+        return update(
             q_state,
-            data.observations.numpy(),
-            data.actions.numpy(),
-            data.next_observations.numpy(),
-            data.rewards.flatten().numpy(),
-            data.dones.flatten().numpy(),
-            1.0,
+            data.observations,
+            data.actions,
+            data.next_observations,
+            data.rewards,
+            data.dones,
+            data.teacher_q_values,
+            distill_coeff,
+            data.weights,
         )
 
-        # update the target network
-        if global_step % args.target_network_frequency == 0:
-            q_state = q_state.replace(target_params=optax.incremental_update(q_state.params, q_state.target_params, args.tau))
-
-        if global_step % 100 == 0:
-            writer.add_scalar("charts/offline/loss", jax.device_get(loss), global_step)
-            writer.add_scalar("charts/offline/q_loss", jax.device_get(q_loss), global_step)
-            writer.add_scalar("charts/offline/distill_loss", jax.device_get(distill_loss), global_step)
+    @jax.jit
+    def student_and_teacher_q_values(params, observations):
+        # the teacher's q-values are computed with the student's for the online transitions added to the replay buffer,
+        # where the observations are of each seed's envs, shape (num_seeds, num_envs, ...)
+        teacher_q_values = teacher_model.apply(teacher_params, observations.reshape((-1,) + observations.shape[2:]))
+        return jax.vmap(q_network.apply)(params, observations), teacher_q_values
 
-        if global_step % args.offline_eval_period == 0:
-            # evaluate the student model
-            model_path = f"runs/{run_name}/{args.exp_name}-offline-{global_step}.cleanrl_model"
-            with open(model_path, "wb") as f:
-                f.write(flax.serialization.to_bytes(q_state.params))
-            print(f"model saved to {model_path}")
+    @jax.jit
+    def greedy_actions(params, observations):
+        return q_network.apply(params, observations).argmax(axis=-1)
+
+    def make_eval_envs(seed, run_name):
+        return gym.vector.SyncVectorEnv([
+            make_env(args.env_id, seed + i, i, False, f"{run_name}-eval") for i in range(args.eval_episodes)
+        ])
+
+    # the student of each seed is periodically evaluated with its live parameters
+    evaluators = [
+        BackgroundEvaluator(partial(make_eval_envs, seed, run_name), greedy_actions, epsilon=0.05, seed=seed)
+        for seed, run_name in zip(seeds, run_names)
+    ]
+
+    def submit_evaluations(params, step, tag):
+        for seed_idx, evaluator in enumerate(evaluators):
+            evaluator.submit(jax.tree_util.tree_map(lambda x: x[seed_idx], params), step, tag)
+
+    def write_evaluations(seeds_results):
+        for writer, results in zip(writers, seeds_results):
+            for eval_step, eval_tag, eval_episodic_returns in results:
+                for idx, returns in enumerate(eval_episodic_returns):
+                    writer.add_scalar(f"{eval_tag}/episodic_return_{idx}", returns, eval_step)
+
+    def stack_seeds(samples):
+        # the samples of each seed are stacked, with a leading axis of the seeds
+        return jax.tree_util.tree_map(lambda *xs: np.stack(xs), *samples)
 
-            episodic_returns = evaluate(
-                model_path,
-                make_env,
-                args.env_id,
-                eval_episodes=10,
-                run_name=f"{run_name}-eval",
-                Model=partial(QNetwork, num_bins=args.num_bins),
-                epsilon=0.05,
-                capture_video=False
+    # offline training phase: train the student model using the qdagger loss
+    offline_distill_coeff = np.ones(args.num_seeds, dtype=np.float32)
+    if args.device_replay_buffer:
+        device_rb = jax.tree_util.tree_map(
+            lambda *xs: jnp.stack(xs), *[DeviceReplayBuffer.from_replay_buffer(rb.buffer) for rb in rbs]
+        )
+    if args.aot_compile:
+        # the updates are compiled for the types of a sample, before the samplers' threads start sampling the buffers
+        sync_target = np.zeros(args.updates_per_dispatch, dtype=np.bool_)
+        if args.device_replay_buffer:
+            sample_keys = jax.random.split(key, args.num_seeds * args.updates_per_dispatch).reshape(
+                (args.num_seeds, args.updates_per_dispatch, -1)
             )
-            for idx, returns in enumerate(episodic_returns):
-                writer.add_scalar(f"charts/offline/episodic_return_{idx}", returns, global_step)
-
-    rb = ReplayBuffer(
-        args.buffer_size,
-        envs.single_observation_space,
-        envs.single_action_space,
-        "cpu",
-        optimize_memory_usage=True,
-        handle_timeout_termination=False,
-    )
-    rb = NStepReplayBuffer(rb, args.n_step, args.gamma)
+            multi_sample_and_update, compile_time = aot_compile(
+                multi_sample_and_update, q_state, device_rb, sample_keys, sync_target, offline_distill_coeff
+            )
+        else:
+            batches = jax.device_put(stack_seeds([
+                stack_batches(rb.sample(args.batch_size * args.updates_per_dispatch), args.updates_per_dispatch) for rb in rbs
+            ]))
+            multi_update, compile_time = aot_compile(multi_update, q_state, batches, sync_target, offline_distill_coeff)
+        print(f"Offline update compile time: {compile_time:.2f} seconds")
+        for writer in writers:
+            writer.add_scalar("charts/offline/compile_time", compile_time, 0)
+
+        data = jax.device_put(stack_seeds([rb.sample(args.batch_size) for rb in rbs]))
+        online_update, compile_time = aot_compile(online_update, q_state, data, offline_distill_coeff)
+        print(f"Online update compile time: {compile_time:.2f} seconds")
+        for writer in writers:
+            writer.add_scalar("charts/online/compile_time", compile_time, 0)
+    if not args.device_replay_buffer:
+        samplers = [PrefetchSampler(rb, args.batch_size * args.updates_per_dispatch, args.prefetch_batches) for rb in rbs]
+    profiler = ProfilerWindow(args.profile_steps if args.profile_phase == "offline" else None, f"runs/{run_names[0]}/profile")
+    metrics_flusher = MetricsFlusher()
+    for offline_step in track(
+        range(0, args.offline_steps, args.updates_per_dispatch), description="offline student training"
+    ):
+        # perform `updates_per_dispatch` gradient-descent steps, with the target network updates, in one dispatch
+        profiler.step(offline_step)
+        update_steps = offline_step + np.arange(args.updates_per_dispatch)
+        sync_target = update_steps % args.target_network_frequency == 0
+        if args.device_replay_buffer:
+            with timer.phase("sample_update"):
+                key, update_key = jax.random.split(key)
+                sample_keys = jax.random.split(update_key, args.num_seeds * args.updates_per_dispatch).reshape(
+                    (args.num_seeds, args.updates_per_dispatch, -1)
+                )
+                _, q_state = timer.block(multi_sample_and_update(
+                    q_state, device_rb, sample_keys, sync_target, offline_distill_coeff
+                ))
+        else:
+            with timer.phase("rb_sample"):
+                # the batches of each seed are stacked, shape (num_seeds, updates_per_dispatch, batch_size, ...)
+                batches = stack_seeds([stack_batches(sampler.sample(), args.updates_per_dispatch) for sampler in samplers])
+            with timer.phase("transfer"):
+                device_batches = timer.block(jax.device_put(batches))
+            with timer.phase("update"):
+                # the target network updates are within the update's scan
+                (td_errors,), q_state = timer.block(multi_update(
+                    q_state, device_batches, sync_target, offline_distill_coeff
+                ))
+            if args.prioritized_replay:
+                with timer.phase("rb_update_priorities"):
+                    td_errors = jax.device_get(td_errors)
+                    for seed_idx, sampler in enumerate(samplers):
+                        update_priorities(
+                            args, sampler, update_steps[-1], batches.indices[seed_idx].reshape(-1), td_errors[seed_idx].reshape(-1)
+                        )
+
+        global_step = update_steps[-1]
+        with timer.phase("logging"):
+            if np.any(update_steps % args.metrics_flush_period == 0) or global_step == args.offline_steps - 1:
+                q_state = q_state.replace(metrics=metrics_flusher.flush(q_state.metrics, global_step))
+            for metrics_step, metrics in metrics_flusher.results(wait=global_step == args.offline_steps - 1):
+                for seed_idx, writer in enumerate(writers):
+                    writer.add_scalar("charts/offline/loss", metrics["loss"][seed_idx], metrics_step)
+                    writer.add_scalar("charts/offline/q_loss", metrics["td_loss"][seed_idx], metrics_step)
+                    writer.add_scalar("charts/offline/distill_loss", metrics["distill_loss"][seed_idx], metrics_step)
+
+        with timer.phase("eval"):
+            if np.any(update_steps % args.offline_eval_period == 0):
+                # evaluate the student model
+                submit_evaluations(q_state.params, global_step, "charts/offline")
+            write_evaluations([evaluator.results(wait=not args.async_eval) for evaluator in evaluators])
+
+        if args.phase_timers and np.any(update_steps % args.timers_period == 0):
+            timer.write(writers[0], global_step, "timers/offline")
+    profiler.close()
+    if args.phase_timers:
+        timer.write(writers[0], args.offline_steps, "timers/offline")
+
+    if args.device_replay_buffer:
+        del device_rb  # free the device memory, the online training samples from the host replay buffers
+    else:
+        for sampler in samplers:
+            sampler.close()
+
+    rbs = [make_replay_buffer(args, envs, seed) for seed in seeds]
+    samplers = [PrefetchSampler(rb, args.batch_size, args.prefetch_batches) for rb in rbs]
     start_time = time.time()
 
     # TRY NOT TO MODIFY: start the game
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(args.env_id, args.seed + i, i, args.capture_video, run_name) for i in range(args.num_envs)]
-    )
-    obs, _ = envs.reset(seed=args.seed)
-    episodic_returns = deque(maxlen=10)
+    envs = make_seeds_envs()
+    obs, _ = envs.reset(seed=env_seeds)
+    episodic_returns = [deque(maxlen=10) for _ in seeds]
+
+    def write_online_metrics(results):
+        for metrics_step, metrics in results:
+            for seed_idx, writer in enumerate(writers):
+                writer.add_scalar("losses/loss", metrics["loss"][seed_idx], metrics_step)
+                writer.add_scalar("losses/td_loss", metrics["td_loss"][seed_idx], metrics_step)
+                writer.add_scalar("losses/distill_loss", metrics["distill_loss"][seed_idx], metrics_step)
+                writer.add_scalar("losses/q_values", metrics["q_values"][seed_idx], metrics_step)
+
+    profiler = ProfilerWindow(args.profile_steps if args.profile_phase == "online" else None, f"runs/{run_names[0]}/profile")
     # online training phase
     for global_step in track(range(args.total_timesteps), description="online student training"):
+        profiler.step(global_step)
         global_step += args.offline_steps
         # ALGO LOGIC: put action logic here
-        epsilon = linear_schedule(args.start_e, args.end_e, args.exploration_fraction * args.total_timesteps, global_step)
-        if random.random() < epsilon:
-            actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
-        else:
-            q_values = q_network.apply(q_state.params, obs)
-            actions = q_values.argmax(axis=-1)
-            actions = jax.device_get(actions)
+        with timer.phase("action"):
+            epsilon = linear_schedule(args.start_e, args.end_e, args.exploration_fraction * args.total_timesteps, global_step)
+            explore = np.array([seed_random.random() < epsilon for seed_random in seed_randoms])
+            q_values, teacher_q_values = student_and_teacher_q_values(
+                q_state.params, obs.reshape((args.num_seeds, args.num_envs) + obs.shape[1:])
+            )
+            if np.all(explore):
+                actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
+            else:
+                actions = np.array(jax.device_get(q_values.argmax(axis=-1))).reshape(-1)
+                for seed_idx in np.nonzero(explore)[0]:
+                    actions[seed_envs[seed_idx]] = [envs.single_action_space.sample() for _ in range(args.num_envs)]
 
         # TRY NOT TO MODIFY: execute the game and log data.
-        next_obs, rewards, terminated, truncated, infos = envs.step(actions)
+        with timer.phase("env_step"):
+            next_obs, rewards, terminated, truncated, infos = envs.step(actions)
 
         # TRY NOT TO MODIFY: record rewards for plotting purposes
         if "final_info" in infos:
-            for info in infos["final_info"]:
+            for idx, info in enumerate(infos["final_info"]):
                 # Skip the envs that are not done
-                if "episode" not in info:
+                if info is None or "episode" not in info:
                     continue
-                print(f"global_step={global_step}, episodic_return={info['episode']['r']}")
+                writer = writers[idx // args.num_envs]
+                print(f"seed={seeds[idx // args.num_envs]}, global_step={global_step}, episodic_return={info['episode']['r']}")
                 writer.add_scalar("charts/episodic_return", info["episode"]["r"], global_step)
                 writer.add_scalar("charts/episodic_length", info["episode"]["l"], global_step)
                 writer.add_scalar("charts/epsilon", epsilon, global_step)
-                episodic_returns.append(info["episode"]["r"])
-                break
+                episodic_returns[idx // args.num_envs].append(info["episode"]["r"])
 
         # TRY NOT TO MODIFY: save data to reply buffer; handle `final_observation`
-        real_next_obs = next_obs.copy()
-        for idx, d in enumerate(truncated):
-            if d:
-                real_next_obs[idx] = infos["final_observation"][idx]
-        rb.add(obs, real_next_obs, actions, rewards, terminated, truncated)
+        with timer.phase("rb_add"):
+            real_next_obs = next_obs.copy()
+            for idx, d in enumerate(truncated):
+                if d:
+                    real_next_obs[idx] = infos["final_observation"][idx]
+            teacher_q_values = jax.device_get(teacher_q_values)
+            for sampler, envs_slice in zip(samplers, seed_envs):
+                sampler.add(
+                    obs[envs_slice],
+                    real_next_obs[envs_slice],
+                    actions[envs_slice],
+                    rewards[envs_slice],
+                    terminated[envs_slice],
+                    truncated[envs_slice],
+                    teacher_q_values[envs_slice],
+                )
 
         # TRY NOT TO MODIFY: CRUCIAL step easy to overlook
         obs = next_obs
@@ -433,75 +761,78 @@ if __name__ == "__main__":
         # ALGO LOGIC: training.
         if global_step > args.offline_steps + args.batch_size:  # args.learning_starts
             if global_step % args.train_frequency == 0:
-                data = rb.sample(args.batch_size)
-                # perform a gradient-descent step
-                if len(episodic_returns) < 10:
-                    distill_coeff = 1.0
-                else:
-                    distill_coeff = max(1 - np.mean(episodic_returns) / np.mean(teacher_episodic_returns), 0)
-                loss, q_loss, old_val, distill_loss, q_state = update(
-                    q_state,
-                    data.observations.numpy(),
-                    data.actions.numpy(),
-                    data.next_observations.numpy(),
-                    data.rewards.flatten().numpy(),
-                    data.dones.flatten().numpy(),
-                    distill_coeff,
-                )
-
-                if global_step % 100 == 0:
-                    writer.add_scalar("losses/loss", jax.device_get(loss), global_step)
-                    writer.add_scalar("losses/td_loss", jax.device_get(q_loss), global_step)
-                    writer.add_scalar("losses/distill_loss", jax.device_get(distill_loss), global_step)
-                    writer.add_scalar("losses/q_values", jax.device_get(old_val).mean(), global_step)
-                    writer.add_scalar("charts/distill_coeff", distill_coeff, global_step)
-                    # print("SPS:", int(global_step / (time.time() - start_time)))
-                    writer.add_scalar("charts/SPS", int(global_step / (time.time() - start_time)), global_step)
+                with timer.phase("rb_sample"):
+                    # the batches of each seed are stacked, shape (num_seeds, batch_size, ...)
+                    data = stack_seeds([sampler.sample() for sampler in samplers])
+                with timer.phase("transfer"):
+                    device_data = timer.block(jax.device_put(data))
+                # perform a gradient-descent step, with each seed's distillation coefficient of its own returns
+                distill_coeff = np.array([
+                    1.0 if len(seed_returns) < 10 else max(1 - np.mean(seed_returns) / np.mean(teacher_episodic_returns), 0.0)
+                    for seed_returns in episodic_returns
+                ], dtype=np.float32)
+                with timer.phase("update"):
+                    td_errors, q_state = timer.block(online_update(q_state, device_data, distill_coeff))
+                if args.prioritized_replay:
+                    with timer.phase("rb_update_priorities"):
+                        td_errors = jax.device_get(td_errors)
+                        for seed_idx, sampler in enumerate(samplers):
+                            update_priorities(args, sampler, global_step, data.indices[seed_idx], td_errors[seed_idx])
+
+                if global_step % args.metrics_flush_period == 0:
+                    with timer.phase("logging"):
+                        q_state = q_state.replace(metrics=metrics_flusher.flush(q_state.metrics, global_step))
+                        for seed_idx, writer in enumerate(writers):
+                            writer.add_scalar("charts/distill_coeff", distill_coeff[seed_idx], global_step)
+                            # print("SPS:", int(global_step / (time.time() - start_time)))
+                            writer.add_scalar("charts/SPS", int(global_step / (time.time() - start_time)), global_step)
 
             # update the target network
             if global_step % args.target_network_frequency == 0:
-                q_state = q_state.replace(
-                    target_params=optax.incremental_update(q_state.params, q_state.target_params, args.tau)
-                )
+                with timer.phase("target_sync"):
+                    q_state = q_state.replace(
+                        target_params=optax.incremental_update(q_state.params, q_state.target_params, args.tau)
+                    )
 
             if global_step % args.online_eval_period == 0:
                 # evaluate the student model
-                model_path = f"runs/{run_name}/{args.exp_name}-online-{global_step}.cleanrl_model"
-                with open(model_path, "wb") as f:
-                    f.write(flax.serialization.to_bytes(q_state.params))
-                print(f"model saved to {model_path}")
-
-                episodic_returns = evaluate(
-                    model_path,
-                    make_env,
-                    args.env_id,
-                    eval_episodes=10,
-                    run_name=f"{run_name}-eval",
-                    Model=partial(QNetwork, num_bins=args.num_bins),
-                    epsilon=0.05,
-                    capture_video=False
-                )
-                for idx, returns in enumerate(episodic_returns):
-                    writer.add_scalar(f"charts/online/episodic_return_{idx}", returns, global_step)
+                with timer.phase("eval"):
+                    submit_evaluations(q_state.params, global_step, "charts/online")
+        with timer.phase("eval"):
+            write_evaluations([evaluator.results(wait=not args.async_eval) for evaluator in evaluators])
+        with timer.phase("logging"):
+            write_online_metrics(metrics_flusher.results())
+
+        if args.phase_timers and global_step % args.timers_period == 0:
+            timer.write(writers[0], global_step, "timers/online")
+    profiler.close()
+    if args.phase_timers:
+        timer.write(writers[0], args.offline_steps + args.total_timesteps, "timers/online")
+    q_state = q_state.replace(metrics=metrics_flusher.flush(q_state.metrics, global_step))
+    write_online_metrics(metrics_flusher.results(wait=True))
+
+    for sampler in samplers:
+        sampler.close()
+    write_evaluations([evaluator.close() for evaluator in evaluators])
 
     if args.save_model:
-        model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
-        with open(model_path, "wb") as f:
-            f.write(flax.serialization.to_bytes(q_state.params))
-        print(f"model saved to {model_path}")
-        from cleanrl_utils.evals.dqn_jax_eval import evaluate
-
-        episodic_returns = evaluate(
-            model_path,
-            make_env,
-            args.env_id,
-            eval_episodes=10,
-            run_name=f"{run_name}-eval",
-            Model=partial(QNetwork, num_bins=args.num_bins),
-            epsilon=args.end_e,
-        )
-        for idx, episodic_return in enumerate(episodic_returns):
-            writer.add_scalar("eval/episodic_return", episodic_return, idx)
+        for seed_idx, (run_name, writer) in enumerate(zip(run_names, writers)):
+            model_path = f"runs/{run_name}/{args.exp_name}.cleanrl_model"
+            with open(model_path, "wb") as f:
+                f.write(flax.serialization.to_bytes(jax.tree_util.tree_map(lambda x: x[seed_idx], q_state.params)))
+            print(f"model saved to {model_path}")
+
+            episodic_returns = evaluate(
+                model_path,
+                make_env,
+                args.env_id,
+                eval_episodes=10,
+                run_name=f"{run_name}-eval",
+                Model=partial(QNetwork, num_bins=args.num_bins),
+                epsilon=args.end_e,
+            )
+            for idx, episodic_return in enumerate(episodic_returns):
+                writer.add_scalar("eval/episodic_return", episodic_return, idx)
 
         # if args.upload_model:
         #     from cleanrl_utils.huggingface import push_to_hub
@@ -511,4 +842,5 @@ if __name__ == "__main__":
         #     push_to_hub(args, episodic_returns, repo_id, "trd-Qdagger", f"runs/{run_name}", f"videos/{run_name}-eval")
 
     envs.close()
-    writer.close()
+    for writer in writers:
+        writer.close()
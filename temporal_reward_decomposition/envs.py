@@ -0,0 +1,40 @@
+"""The Atari env factory of `dqn_atari_trd_qdagger.py`, importable without the training dependencies, where the
+stable-baselines3 Atari wrappers (which import torch) are only imported once an env is created"""
+
+import gymnasium as gym
+
+
+def make_env(env_id, seed, idx, capture_video, run_name, episode_trigger=None, disable_noop=False):
+    def thunk():
+        from gymnasium.experimental.wrappers import RecordVideoV0
+        from stable_baselines3.common.atari_wrappers import (
+            ClipRewardEnv,
+            EpisodicLifeEnv,
+            FireResetEnv,
+            MaxAndSkipEnv,
+            NoopResetEnv,
+        )
+
+        if capture_video and idx == 0:
+            env = gym.make(env_id, render_mode="rgb_array")
+            env = RecordVideoV0(env, f"runs/{run_name}", episode_trigger=episode_trigger, disable_logger=True)
+        else:
+            env = gym.make(env_id)
+        env = gym.wrappers.RecordEpisodeStatistics(env)
+
+        if not disable_noop:
+            env = NoopResetEnv(env, noop_max=30)
+        env = MaxAndSkipEnv(env, skip=4)
+        env = EpisodicLifeEnv(env)
+        if "FIRE" in env.unwrapped.get_action_meanings():
+            env = FireResetEnv(env)
+
+        env = ClipRewardEnv(env)
+        env = gym.wrappers.ResizeObservation(env, (84, 84))
+        env = gym.wrappers.GrayScaleObservation(env)
+        env = gym.wrappers.FrameStack(env, 4)
+        env.action_space.seed(seed)
+
+        return env
+
+    return thunk
@@ -0,0 +1,235 @@
+"""Records episodes of a trained TRD model (see `trd-models/readme.md`) and extracts the expected rewards of every
+step, `QNetwork.decomposed_q_value` with shape `(actions, num_bins)`, to an on-disk episode store (see
+`utils/episode_store.py`), such that the expected reward plots and videos are regenerated without the network, e.g.,
+`python -m temporal_reward_decomposition.explain_trd --env-id Breakout --model-path trd-models/Breakout-seed-1-n-40-w-1.cleanrl_model --num-bins 40`
+
+The episodes are recorded first, with the observations, actions and (clipped) rewards, then the expected rewards are
+extracted in large jitted batches. The recorded episodes are reused if the store exists, such that the expected
+rewards of another model are extracted for the same episodes with `--output-field`. A reused store must have been
+recorded with the same env, seed and epsilon, and if it has fewer than `--num-episodes`, the missing episodes are
+recorded with the store's model. With `--saliency-method`, the per-bin saliency maps of every step (see
+`utils/saliency.py`) are also extracted, e.g., for saliency videos, and with `--top-contrasts`, the most informative
+contrastive explanations of the episodes (see `utils/contrastive.py`) are saved to `{output}/contrasts.json`.
+"""
+
+import argparse
+import json
+import os
+import random
+import time
+from distutils.util import strtobool
+from functools import partial
+
+import flax
+import gymnasium as gym
+import jax
+import numpy as np
+
+from temporal_reward_decomposition.envs import make_env
+from temporal_reward_decomposition.models import QNetwork
+from temporal_reward_decomposition.utils.compilation import enable_compilation_cache
+from temporal_reward_decomposition.utils.contrastive import CONTRAST_SCORES, mine_contrasts
+from temporal_reward_decomposition.utils.episode_store import EpisodeStore, map_episode_store
+from temporal_reward_decomposition.utils.saliency import SALIENCY_METHODS, saliency_maps
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", type=int, default=1,
+        help="seed of the recorded episodes")
+    parser.add_argument("--capture-video", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="whether to capture videos of the recorded episodes (check out `runs/videos`)")
+    parser.add_argument("--env-id", type=str, default="Breakout",
+        help="the id of the environment, without `NoFrameskip-v4`")
+    parser.add_argument("--model-path", type=str, required=True,
+        help="the path of the TRD model, a `.cleanrl_model` of `QNetwork`")
+    parser.add_argument("--num-bins", type=int, required=True,
+        help="the number of reward bins of the model")
+    parser.add_argument("--num-episodes", type=int, default=1,
+        help="the number of episodes to record")
+    parser.add_argument("--num-envs", type=int, default=1,
+        help="the number of parallel game environments that the episodes are recorded with")
+    parser.add_argument("--epsilon", type=float, default=0.01,
+        help="the probability of a random action when recording")
+    parser.add_argument("--output", type=str, default=None,
+        help="the directory of the episode store, by default `explanations/{model filename}`")
+    parser.add_argument("--output-field", type=str, default="expected_rewards",
+        help="the store's field of the expected rewards")
+    parser.add_argument("--batch-size", type=int, default=1024,
+        help="the number of observations of each jitted `decomposed_q_value` call")
+    parser.add_argument("--chunk-size", type=int, default=1024,
+        help="the number of steps of each of the store's on-disk chunks")
+    parser.add_argument("--saliency-method", type=str, default=None, choices=SALIENCY_METHODS,
+        help="if set, the per-bin saliency maps of the greedy actions are extracted to the store's `{method}_saliency` field")
+    parser.add_argument("--saliency-bins", type=int, nargs="+", default=None,
+        help="the bins of the saliency maps, by default every bin")
+    parser.add_argument("--saliency-batch-size", type=int, default=32,
+        help="the number of observations of each jitted saliency call, smaller than `batch-size` as every bin is differentiated")
+    parser.add_argument("--top-contrasts", type=int, default=0,
+        help="if positive, the number of highest scoring contrasts of action pairs saved to `{output}/contrasts.json`")
+    parser.add_argument("--contrast-score", type=str, default="timing", choices=CONTRAST_SCORES,
+        help="the score of the contrasts, where `timing` is the difference in the expected rewards that the q-values don't show")
+    parser.add_argument("--contrast-agent-actions", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, the recorded actions are contrasted with every other action, otherwise every action pair is contrasted")
+    parser.add_argument("--max-q-value-difference", type=float, default=None,
+        help="if set, only the contrasts of actions with at most this difference in q-value")
+    parser.add_argument("--compilation-cache-dir", type=str, default="jax-cache",
+        help="the directory of the persistent XLA compilation cache shared between runs, if empty then the functions are compiled by every run")
+    args = parser.parse_args()
+    # fmt: on
+
+    if args.output is None:
+        args.output = os.path.join("explanations", os.path.splitext(os.path.basename(args.model_path))[0])
+    return args
+
+
+def record_episodes(
+    envs: gym.vector.VectorEnv, policy, store: EpisodeStore, num_episodes: int, epsilon: float, seed: int
+):
+    """Records the policy's episodes to the store, where each env's steps are kept until its episode ends
+
+    :param envs: The vector env
+    :param policy: The greedy actions of a batch of observations
+    :param store: The episode store with `observations`, `actions` and `rewards` fields
+    :param num_episodes: The number of episodes to record
+    :param epsilon: The probability of a random action
+    :param seed: The envs' seed
+    """
+    steps = [{"observations": [], "actions": [], "rewards": []} for _ in range(envs.num_envs)]
+    obs, _ = envs.reset(seed=seed)
+    while store.num_episodes < num_episodes:
+        if random.random() < epsilon:
+            actions = np.array([envs.single_action_space.sample() for _ in range(envs.num_envs)])
+        else:
+            actions = np.asarray(policy(obs))
+
+        next_obs, rewards, _, _, infos = envs.step(actions)
+        for i in range(envs.num_envs):
+            steps[i]["observations"].append(obs[i])
+            steps[i]["actions"].append(actions[i])
+            steps[i]["rewards"].append(rewards[i])
+
+        # the episodes end with the game (rather than a life), as recorded by `RecordEpisodeStatistics`
+        for i, info in enumerate(infos.get("final_info", [])):
+            if info is None or "episode" not in info or store.num_episodes >= num_episodes:
+                continue
+            episodic_return = info["episode"]["r"].item()
+            index = store.add_episode(
+                **{name: np.stack(values) for name, values in steps[i].items()}, episodic_return=episodic_return
+            )
+            steps[i] = {"observations": [], "actions": [], "rewards": []}
+            print(f"episode={index}, episodic_return={episodic_return}, length={store.episodes[index]['length']}")
+        obs = next_obs
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    enable_compilation_cache(args.compilation_cache_dir)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    envs = gym.vector.SyncVectorEnv([
+        make_env(f"{args.env_id}NoFrameskip-v4", args.seed + i, i, args.capture_video, "videos", disable_noop=True)
+        for i in range(args.num_envs)
+    ])
+    q_network = QNetwork(action_dim=envs.single_action_space.n, num_bins=args.num_bins)
+    with open(args.model_path, "rb") as file:
+        params = flax.serialization.from_bytes(
+            q_network.init(jax.random.PRNGKey(args.seed), envs.observation_space.sample()), file.read()
+        )
+
+    if os.path.exists(os.path.join(args.output, "metadata.json")):
+        store = EpisodeStore(args.output)
+        recorded = {name: store.metadata.get(name) for name in ("env_id", "seed", "epsilon")}
+        requested = {"env_id": args.env_id, "seed": args.seed, "epsilon": args.epsilon}
+        if recorded != requested:
+            raise ValueError(
+                f"The episodes of {args.output} were recorded with {recorded} rather than {requested}, set another `--output`"
+            )
+        if store.num_episodes < args.num_episodes and store.metadata.get("model_path") != args.model_path:
+            raise ValueError(
+                f"{args.output} has {store.num_episodes} of the {args.num_episodes} episodes, the missing episodes are only "
+                f"recorded with its model {store.metadata.get('model_path')}"
+            )
+        print(f"Reusing the {store.num_episodes} recorded episodes of {args.output}")
+    else:
+        store = EpisodeStore.create(
+            args.output,
+            fields={
+                "observations": (envs.single_observation_space.shape, envs.single_observation_space.dtype),
+                "actions": ((), np.int64),
+                "rewards": ((), np.float32),
+            },
+            chunk_size=args.chunk_size,
+            env_id=args.env_id,
+            model_path=args.model_path,
+            num_bins=args.num_bins,
+            seed=args.seed,
+            epsilon=args.epsilon,
+        )
+
+    if store.num_episodes < args.num_episodes:
+        start_time, start_steps = time.time(), store.num_steps
+        # the seed is offset by the recorded episodes, such that the missing episodes aren't repeats of the recorded
+        seed = args.seed + store.num_episodes
+        random.seed(seed)
+        policy = partial(jax.jit(lambda params, obs: q_network.apply(params, obs).argmax(axis=-1)), params)
+        record_episodes(envs, policy, store, args.num_episodes, args.epsilon, seed)
+        print(f"Recorded {store.num_steps - start_steps} steps in {time.time() - start_time:.1f}s")
+    envs.close()
+
+    start_time = time.time()
+    decomposed_fn = partial(q_network.apply, method=QNetwork.decomposed_q_value)
+    map_episode_store(
+        store,
+        decomposed_fn,
+        params,
+        input_field="observations",
+        output_field=args.output_field,
+        batch_size=args.batch_size,
+    )
+    print(f"Extracted the expected rewards of {store.num_steps} steps in {time.time() - start_time:.1f}s to {args.output}")
+
+    if args.saliency_method is not None:
+        start_time = time.time()
+        map_episode_store(
+            store,
+            partial(saliency_maps, args.saliency_method, decomposed_fn, bins=args.saliency_bins),
+            params,
+            input_field="observations",
+            output_field=f"{args.saliency_method}_saliency",
+            batch_size=args.saliency_batch_size,
+        )
+        print(f"Extracted the {args.saliency_method} saliency maps of {store.num_steps} steps in {time.time() - start_time:.1f}s")
+
+    if args.top_contrasts > 0:
+        start_time = time.time()
+        contrasts = mine_contrasts(
+            store.read(args.output_field),
+            args.top_contrasts,
+            actions=store.read("actions") if args.contrast_agent_actions else None,
+            batch_size=args.batch_size,
+            score=args.contrast_score,
+            max_q_value_difference=args.max_q_value_difference,
+        )
+        episodes, steps = store.locate(contrasts.states)
+        with open(os.path.join(args.output, "contrasts.json"), "w") as file:
+            json.dump(
+                [
+                    {
+                        "episode": int(episode),
+                        "step": int(step),
+                        "action": int(action),
+                        "contrast_action": int(contrast_action),
+                        "score": float(score),
+                        "differences": difference.tolist(),
+                    }
+                    for episode, step, action, contrast_action, score, difference in zip(
+                        episodes, steps, contrasts.actions, contrasts.contrast_actions, contrasts.scores, contrasts.differences
+                    )
+                ],
+                file,
+                indent=2,
+            )
+        print(f"Mined the top {len(contrasts.scores)} contrasts of {store.num_steps} steps in {time.time() - start_time:.1f}s")
@@ -0,0 +1,65 @@
+"""The TRD Q-networks of `dqn_atari_trd_qdagger.py`, importable without the training dependencies (torch, cleanrl,
+etc.), e.g., to load the `trd-models` for explanations"""
+
+from typing import Tuple
+
+import flax.linen as nn
+import jax.numpy as jnp
+
+
+class QNetwork(nn.Module):
+    action_dim: int
+    num_bins: int
+
+    def __call__(self, x: jnp.ndarray):
+        return jnp.sum(self.decomposed_q_value(x), axis=-1)
+
+    @nn.compact
+    def decomposed_q_value(self, x: jnp.ndarray):
+        x = jnp.transpose(x, (0, 2, 3, 1))
+        x = x / 255.0
+        x = nn.Conv(32, kernel_size=(8, 8), strides=(4, 4), padding="VALID")(x)
+        x = nn.relu(x)
+        x = nn.Conv(64, kernel_size=(4, 4), strides=(2, 2), padding="VALID")(x)
+        x = nn.relu(x)
+        x = nn.Conv(64, kernel_size=(3, 3), strides=(1, 1), padding="VALID")(x)
+        x = nn.relu(x)
+        x = x.reshape((x.shape[0], -1))
+        x = nn.Dense(512)(x)
+        x = nn.relu(x)
+        x = nn.Dense(self.action_dim * self.num_bins)(x)
+        return jnp.reshape(x, (-1, self.action_dim, self.num_bins))
+
+
+class MultiHeadQNetwork(nn.Module):
+    """QNetwork with a shared torso and a head for each number of bins, where the first head is the agent's policy"""
+    action_dim: int
+    num_bins: Tuple[int, ...]
+
+    def __call__(self, x: jnp.ndarray):
+        return jnp.sum(self.decomposed_q_value(x)[0], axis=-1)
+
+    @nn.compact
+    def decomposed_q_value(self, x: jnp.ndarray):
+        # the torso's layers are named as `QNetwork`'s, see `head_params`
+        x = jnp.transpose(x, (0, 2, 3, 1))
+        x = x / 255.0
+        x = nn.Conv(32, kernel_size=(8, 8), strides=(4, 4), padding="VALID")(x)
+        x = nn.relu(x)
+        x = nn.Conv(64, kernel_size=(4, 4), strides=(2, 2), padding="VALID")(x)
+        x = nn.relu(x)
+        x = nn.Conv(64, kernel_size=(3, 3), strides=(1, 1), padding="VALID")(x)
+        x = nn.relu(x)
+        x = x.reshape((x.shape[0], -1))
+        x = nn.Dense(512)(x)
+        x = nn.relu(x)
+        return tuple(
+            jnp.reshape(nn.Dense(self.action_dim * num_bins, name=f"head_{head}")(x), (-1, self.action_dim, num_bins))
+            for head, num_bins in enumerate(self.num_bins)
+        )
+
+
+def head_params(params, head: int):
+    """The parameters of a `MultiHeadQNetwork` head as the parameters of a `QNetwork`, e.g., to save as a `.cleanrl_model`"""
+    torso = {name: layer for name, layer in params["params"].items() if not name.startswith("head_")}
+    return {"params": {**torso, "Dense_1": params["params"][f"head_{head}"]}}
@@ -0,0 +1,68 @@
+"""Renders the expected reward videos, each step's game frame with a bar chart of the agent's expected rewards, of the
+episodes in an episode store extracted by `explain_trd.py`, e.g.,
+`python -m temporal_reward_decomposition.render_trd_video --store explanations/Breakout-seed-1-n-40-w-1`
+
+The frames are composited with NumPy (see `utils/rendering.py`) by a pool of processes and streamed to `ffmpeg`,
+which must be installed.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from temporal_reward_decomposition.utils.episode_store import EpisodeStore
+from temporal_reward_decomposition.utils.rendering import render_video
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", type=str, required=True,
+        help="the directory of the episode store")
+    parser.add_argument("--episodes", type=int, nargs="+", default=None,
+        help="the episodes to render, by default every episode")
+    parser.add_argument("--expected-rewards-field", type=str, default="expected_rewards",
+        help="the store's field of the expected rewards")
+    parser.add_argument("--output-dir", type=str, default=None,
+        help="the directory of the videos, by default `{store}/videos`")
+    parser.add_argument("--fps", type=int, default=30,
+        help="the frames per second of the videos")
+    parser.add_argument("--scale", type=int, default=4,
+        help="the integer scale of the game frames")
+    parser.add_argument("--chunk-size", type=int, default=128,
+        help="the number of steps rendered together by a process")
+    parser.add_argument("--num-workers", type=int, default=os.cpu_count(),
+        help="the number of rendering processes, if 0 then the frames are rendered by the main process")
+    args = parser.parse_args()
+    # fmt: on
+
+    if args.output_dir is None:
+        args.output_dir = os.path.join(args.store, "videos")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = EpisodeStore(args.store, mmap_mode="r")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    for episode in range(store.num_episodes) if args.episodes is None else args.episodes:
+        start_time = time.time()
+        # the last frame of each observation's frame stack, and the expected rewards of the agent's action
+        frames = store.episode(episode, "observations")[:, -1]
+        actions = store.episode(episode, "actions")
+        expected_rewards = store.episode(episode, args.expected_rewards_field)[np.arange(len(actions)), actions]
+
+        path = os.path.join(args.output_dir, f"episode-{episode}.mp4")
+        render_video(
+            path,
+            frames,
+            expected_rewards,
+            fps=args.fps,
+            chunk_size=args.chunk_size,
+            num_workers=args.num_workers,
+            scale=args.scale,
+        )
+        print(f"Rendered the {len(frames)} steps of episode {episode} in {time.time() - start_time:.1f}s to {path}")
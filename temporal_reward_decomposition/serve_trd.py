@@ -0,0 +1,185 @@
+"""A local inference server of TRD models (see `trd-models/readme.md`) that keeps the models loaded and compiled, and
+batches the concurrent requests of single observations (see `utils/micro_batcher.py`) into a jitted
+`QNetwork.decomposed_q_value` call, e.g.,
+`python -m temporal_reward_decomposition.serve_trd --models trd-models/Breakout-seed-1-n-40-w-1.cleanrl_model`
+
+The server is HTTP, on a TCP port or with `--unix-socket` a Unix socket, with the endpoints
+- `GET /models`, each model's name (its filename), action dim, number of bins and observation shape
+- `POST /models/{name}`, the decomposed q-values `(actions, num_bins)` of an observation `(4, 84, 84)`, where the
+  observation is JSON, `{"observation": [...]}`, or a `.npy` with the content type `application/x-npy`. The response
+  is JSON, `{"decomposed_q_value": [...]}`, or a `.npy` if the request accepts `application/x-npy`.
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import socketserver
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import flax
+import jax
+import numpy as np
+
+from temporal_reward_decomposition.models import QNetwork
+from temporal_reward_decomposition.utils.compilation import enable_compilation_cache
+from temporal_reward_decomposition.utils.micro_batcher import MicroBatcher
+
+OBSERVATION_SHAPE = (4, 84, 84)
+NPY_CONTENT_TYPE = "application/x-npy"
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=str, nargs="+", required=True,
+        help="the paths of the TRD models, `.cleanrl_model`s of `QNetwork`")
+    parser.add_argument("--num-bins", type=int, default=None,
+        help="the number of reward bins of every model, by default from the `-n-{num_bins}-` of each model's filename")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+        help="the host of the server")
+    parser.add_argument("--port", type=int, default=8000,
+        help="the port of the server")
+    parser.add_argument("--unix-socket", type=str, default=None,
+        help="if set, the path of a Unix socket that the server listens on rather than `host` and `port`")
+    parser.add_argument("--max-batch-size", type=int, default=64,
+        help="the maximum number of observations of a model's batch")
+    parser.add_argument("--max-latency-ms", type=float, default=5.0,
+        help="the maximum milliseconds that an observation waits for others before its batch is run")
+    parser.add_argument("--compilation-cache-dir", type=str, default="jax-cache",
+        help="the directory of the persistent XLA compilation cache shared between runs, if empty then the functions are compiled by every run")
+    args = parser.parse_args()
+    # fmt: on
+    return args
+
+
+def load_model(model_path: str, num_bins: Optional[int] = None):
+    """Loads a TRD model without its env, where the action dim is inferred from the parameters' shapes
+
+    :param model_path: The path of the `.cleanrl_model`
+    :param num_bins: The number of reward bins, by default from the `-n-{num_bins}-` of the model's filename
+    :return: The network and parameters
+    """
+    if num_bins is None:
+        match = re.search(r"-n-(\d+)-", os.path.basename(model_path))
+        assert match is not None, f"the number of bins isn't in the filename of {model_path}, set `--num-bins`"
+        num_bins = int(match.group(1))
+
+    with open(model_path, "rb") as file:
+        params = flax.serialization.msgpack_restore(file.read())
+    action_dim, remainder = divmod(params["params"]["Dense_1"]["kernel"].shape[-1], num_bins)
+    assert remainder == 0, f"the output of {model_path} isn't a multiple of {num_bins} bins"
+    return QNetwork(action_dim=action_dim, num_bins=num_bins), jax.device_put(params)
+
+
+class TRDRequestHandler(BaseHTTPRequestHandler):
+    """Handles the requests of `serve_trd.py`, where the server has the models' `batchers` and `metadata`"""
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/models":
+            return self.send_json({"error": f"unknown path {self.path}"}, status=404)
+        self.send_json(self.server.metadata)
+
+    def do_POST(self):
+        name = self.path[len("/models/") :] if self.path.startswith("/models/") else None
+        if name not in self.server.batchers:
+            return self.send_json({"error": f"unknown model {name}"}, status=404)
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if self.headers.get("Content-Type") == NPY_CONTENT_TYPE:
+                observation = np.load(io.BytesIO(body), allow_pickle=False)
+            else:
+                observation = np.asarray(json.loads(body)["observation"])
+            future = self.server.batchers[name].submit(observation)
+        except (ValueError, KeyError, TypeError) as error:
+            return self.send_json({"error": f"invalid observation, {error}"}, status=400)
+
+        try:
+            decomposed_q_value = future.result()
+        except Exception as error:  # the model's batch failed, the other batches and the server continue
+            return self.send_json({"error": f"the model failed, {error!r}"}, status=500)
+
+        if NPY_CONTENT_TYPE in self.headers.get("Accept", ""):
+            buffer = io.BytesIO()
+            np.save(buffer, decomposed_q_value)
+            self.send_body(buffer.getvalue(), NPY_CONTENT_TYPE)
+        else:
+            self.send_json({"decomposed_q_value": decomposed_q_value.tolist()})
+
+    def send_json(self, content, status: int = 200):
+        self.send_body(json.dumps(content).encode(), "application/json", status)
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # the client address of a Unix socket is its (often empty) path rather than a host and port
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix-socket"
+
+    def log_message(self, format, *args):
+        pass  # a line for each request would flood the console
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batchers: Dict[str, MicroBatcher], metadata: Dict, address, unix_socket: bool = False):
+    """The threaded HTTP server of the models' batchers, on a `(host, port)` or a Unix socket path"""
+    if unix_socket and os.path.exists(address):
+        os.remove(address)
+    server = (ThreadingUnixHTTPServer if unix_socket else ThreadingHTTPServer)(address, TRDRequestHandler)
+    server.batchers = batchers
+    server.metadata = metadata
+    return server
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    enable_compilation_cache(args.compilation_cache_dir)
+
+    batchers, metadata = {}, {}
+    for model_path in args.models:
+        start_time = time.time()
+        name = os.path.splitext(os.path.basename(model_path))[0]
+        q_network, params = load_model(model_path, args.num_bins)
+        decomposed_q_value = jax.jit(partial(q_network.apply, method=QNetwork.decomposed_q_value))
+
+        batchers[name] = MicroBatcher(
+            partial(decomposed_q_value, params),
+            OBSERVATION_SHAPE,
+            np.uint8,
+            max_batch_size=args.max_batch_size,
+            max_latency=args.max_latency_ms / 1000,
+        )
+        batchers[name].warmup()
+        metadata[name] = {
+            "action_dim": q_network.action_dim,
+            "num_bins": q_network.num_bins,
+            "observation_shape": list(OBSERVATION_SHAPE),
+        }
+        print(f"Loaded and compiled {name} in {time.time() - start_time:.1f}s")
+
+    address = args.unix_socket if args.unix_socket is not None else (args.host, args.port)
+    server = make_server(batchers, metadata, address, unix_socket=args.unix_socket is not None)
+    print(f"Serving {len(batchers)} models on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket is not None:
+            os.remove(args.unix_socket)
+        for name, batcher in batchers.items():
+            batcher.close()
+            print(f"{name}: {batcher.num_inputs} observations in {batcher.num_batches} batches")
@@ -0,0 +1,141 @@
+"""Runs a sweep of `dqn_atari_trd_qdagger` over envs, seeds, number of bins and bin widths, as used for `trd-models`.
+
+The teacher of each env and seed is evaluated and its replay buffer collected once, then shared by the students of
+every number of bins and bin width (or of every number of bins for each bin width, without `--lazy-n-step`).
+With `--multi-head`, a single student run trains a head for every number of bins rather than a run for each.
+The runs are subprocesses with at most `--max-workers` running at once, with any unknown arguments passed to every
+run, e.g., `python -m temporal_reward_decomposition.sweep_trd_qdagger --num-bins 2 4 8 --bin-widths 1 3 --save-model`
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from distutils.util import strtobool
+from typing import List
+
+import numpy as np
+
+from temporal_reward_decomposition.utils.sweep import SweepJob, run_jobs
+
+
+def parse_args():
+    # fmt: off
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env-ids", type=str, nargs="+", default=["BreakoutNoFrameskip-v4"],
+        help="the ids of the environments")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1],
+        help="the seeds of the runs")
+    parser.add_argument("--num-bins", type=int, nargs="+", required=True,
+        help="the numbers of reward bins")
+    parser.add_argument("--bin-widths", type=int, nargs="+", default=[1],
+        help="the widths of the reward bins")
+    parser.add_argument("--multi-head", type=lambda x: bool(strtobool(x)), default=False, nargs="?", const=True,
+        help="if toggled, a run trains a head for every number of bins with a shared torso, rather than a run for each")
+    parser.add_argument("--max-workers", type=int, default=2,
+        help="the maximum number of runs at once")
+    parser.add_argument("--mem-fraction", type=float, default=None,
+        help="the fraction of the device memory preallocated by each run, by default 0.7 shared between the workers")
+    parser.add_argument("--lazy-n-step", type=lambda x: bool(strtobool(x)), default=True, nargs="?", const=True,
+        help="if toggled, the runs compute the n-step transitions when sampled such that a teacher's replay buffer is shared between bin widths")
+    parser.add_argument("--teacher-buffer-dir", type=str, default="teacher-buffers",
+        help="the directory of the teachers' replay buffers and evaluations")
+    parser.add_argument("--sweep-dir", type=str, default=f"sweeps/{int(time.time())}",
+        help="the directory of the runs' logs and results, the summary and the saved models")
+    args, run_args = parser.parse_known_args()
+    # fmt: on
+
+    return args, run_args
+
+
+def run_command(env_id: str, seed: int, num_bins: List[int], bin_width: int, *run_args: str):
+    return [
+        sys.executable, "-m", "temporal_reward_decomposition.dqn_atari_trd_qdagger",
+        "--env-id", env_id,
+        "--seed", str(seed),
+        "--num-bins", *map(str, num_bins),
+        "--bin-width", str(bin_width),
+        *run_args,
+    ]
+
+
+if __name__ == "__main__":
+    args, run_args = parse_args()
+    run_args = [*run_args, "--teacher-buffer-dir", args.teacher_buffer_dir, "--lazy-n-step", str(args.lazy_n_step)]
+    env = {
+        **os.environ,
+        "XLA_PYTHON_CLIENT_MEM_FRACTION": str(0.7 / args.max_workers if args.mem_fraction is None else args.mem_fraction),
+    }
+
+    # the teacher jobs are first such that they are started before the students
+    teacher_jobs, student_jobs, results_paths = {}, [], {}
+    for env_id in args.env_ids:
+        for seed in args.seeds:
+            for bin_width in args.bin_widths:
+                teacher_name = f"{env_id}-seed-{seed}-teacher" + ("" if args.lazy_n_step else f"-w-{bin_width}")
+                if teacher_name not in teacher_jobs:
+                    teacher_jobs[teacher_name] = SweepJob(
+                        teacher_name,
+                        run_command(env_id, seed, [min(args.num_bins)], bin_width, *run_args, "--teacher-only"),
+                        os.path.join(args.sweep_dir, "logs", f"{teacher_name}.log"),
+                    )
+
+                for num_bins in [args.num_bins] if args.multi_head else [[num_bins] for num_bins in args.num_bins]:
+                    name = f"{env_id}-seed-{seed}-n-{'-'.join(map(str, num_bins))}-w-{bin_width}"
+                    results_paths[name] = os.path.join(args.sweep_dir, "results", f"{name}.json")
+                    student_jobs.append(SweepJob(
+                        name,
+                        run_command(env_id, seed, num_bins, bin_width, *run_args, "--results-path", results_paths[name]),
+                        os.path.join(args.sweep_dir, "logs", f"{name}.log"),
+                        depends_on=teacher_name,
+                    ))
+
+    os.makedirs(os.path.join(args.sweep_dir, "results"), exist_ok=True)
+    start_time = time.time()
+    return_codes = run_jobs([*teacher_jobs.values(), *student_jobs], args.max_workers, env=env)
+    print(f"Sweep time: {time.time() - start_time:.0f} seconds")
+
+    # a summary for each trained head, i.e., each number of bins
+    summary = []
+    for job in student_jobs:
+        if return_codes[job.name] is None:
+            print(f"{job.name}: skipped as {job.depends_on} failed, see {teacher_jobs[job.depends_on].log_path}")
+            summary.append({"name": job.name, "return_code": None, "log_path": job.log_path})
+            continue
+        elif return_codes[job.name] != 0 or not os.path.exists(results_paths[job.name]):
+            print(f"{job.name}: failed, see {job.log_path}")
+            summary.append({"name": job.name, "return_code": return_codes[job.name], "log_path": job.log_path})
+            continue
+
+        with open(results_paths[job.name]) as f:
+            results = json.load(f)
+        for head_results in results["heads"]:
+            run_summary = {
+                "name": job.name,
+                "return_code": return_codes[job.name],
+                "log_path": job.log_path,
+                **{key: value for key, value in results.items() if key != "heads"},
+                **head_results,
+                "mean_teacher_episodic_return": float(np.mean(results["teacher_episodic_returns"])),
+            }
+            if head_results["episodic_returns"] is not None:
+                run_summary["mean_episodic_return"] = float(np.mean(head_results["episodic_returns"]))
+                print(f"{job.name} (n={head_results['num_bins']}): mean episodic return {run_summary['mean_episodic_return']:.2f} "
+                      f"(teacher {run_summary['mean_teacher_episodic_return']:.2f})")
+
+            # saved with the naming of `trd-models`
+            if head_results["model_path"] is not None:
+                model_path = os.path.join(
+                    args.sweep_dir, "models",
+                    f"{results['env_id'].replace('NoFrameskip-v4', '')}-seed-{results['seed']}-n-{head_results['num_bins']}-w-{results['bin_width']}.cleanrl_model",
+                )
+                os.makedirs(os.path.dirname(model_path), exist_ok=True)
+                shutil.copyfile(head_results["model_path"], model_path)
+                run_summary["model_path"] = model_path
+            summary.append(run_summary)
+
+    with open(os.path.join(args.sweep_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"Summary saved to {os.path.join(args.sweep_dir, 'summary.json')}")
@@ -0,0 +1,116 @@
+import multiprocessing as mp
+import os
+import queue
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import jax
+
+
+class ActorPool:
+    """Runs actors in separate processes that push their transitions to the learner through a local queue.
+
+    Each actor is run as `actor_fn(actor_id, params_queue, transition_queue, stop_event, *actor_args)`, where the actor
+    gets the latest parameters with `latest_params` and puts `(actor_id, transitions)` to the transition queue.
+    The processes are spawned (rather than forked as JAX is multithreaded), so `actor_fn` must be importable, and
+    are run on the CPU by default such that they don't reserve the learner's accelerator memory.
+    """
+
+    def __init__(
+        self,
+        actor_fn: Callable,
+        num_actors: int,
+        actor_args: Tuple = (),
+        queue_size: int = 64,
+        env: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param actor_fn: The actor's loop, a top-level function of an importable module
+        :param num_actors: The number of actor processes
+        :param actor_args: The additional (picklable) arguments of `actor_fn`
+        :param queue_size: The maximum number of transition batches waiting for the learner, blocking the actors
+        :param env: The environment variables of the actor processes, by default `JAX_PLATFORMS=cpu`
+        """
+        context = mp.get_context("spawn")
+        self.num_actors = num_actors
+        self.transition_queue = context.Queue(maxsize=queue_size)
+        self.params_queues = [context.Queue(maxsize=1) for _ in range(num_actors)]
+        self.stop_event = context.Event()
+
+        env = {"JAX_PLATFORMS": "cpu"} if env is None else env
+        previous_env = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)  # the spawned processes inherit the environment variables when started
+        try:
+            self.processes = [
+                context.Process(
+                    target=actor_fn,
+                    args=(actor_id, self.params_queues[actor_id], self.transition_queue, self.stop_event, *actor_args),
+                    daemon=True,
+                )
+                for actor_id in range(num_actors)
+            ]
+            for process in self.processes:
+                process.start()
+        finally:
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name)
+                else:
+                    os.environ[name] = value
+
+    def update_params(self, params):
+        """Sends the parameters to each actor, replacing any parameters that an actor hasn't received yet"""
+        params = jax.device_get(params)
+        for params_queue in self.params_queues:
+            try:
+                params_queue.get_nowait()
+            except queue.Empty:
+                pass
+            params_queue.put(params)
+
+    def get(self, timeout: Optional[float] = None) -> Tuple[int, Any]:
+        """Gets the next `(actor_id, transitions)`, raising `queue.Empty` if none arrive within `timeout` seconds"""
+        try:
+            return self.transition_queue.get(timeout=timeout)
+        except queue.Empty:
+            for actor_id, process in enumerate(self.processes):
+                if not process.is_alive() and process.exitcode != 0:
+                    raise RuntimeError(f"actor {actor_id} exited with code {process.exitcode}")
+            raise
+
+    def get_nowait(self) -> Optional[Tuple[int, Any]]:
+        """Gets the next `(actor_id, transitions)` if one is waiting, otherwise None"""
+        try:
+            return self.transition_queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self, timeout: float = 10.0):
+        """Stops the actors, draining the transition queue so that no actor is blocked putting transitions"""
+        self.stop_event.set()
+        for process in self.processes:
+            while process.is_alive():
+                while self.get_nowait() is not None:
+                    pass
+                process.join(timeout=0.1)
+                timeout -= 0.1
+                if timeout <= 0:
+                    process.terminate()
+                    process.join()
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def latest_params(params_queue, params=None):
+    """The latest parameters sent to the actor, waiting for the first parameters if `params` is None"""
+    if params is None:
+        params = params_queue.get()
+    try:
+        while True:
+            params = params_queue.get_nowait()
+    except queue.Empty:
+        return params
@@ -0,0 +1,96 @@
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import jax
+import numpy as np
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    params: Dict[str, Any]
+    metric: str
+    value: float
+    unit: str
+    higher_is_better: bool = False
+
+    @property
+    def key(self) -> Tuple[str, str, str]:
+        """Identifies the result between runs, i.e., to compare with a baseline"""
+        return self.name, json.dumps(self.params, sort_keys=True), self.metric
+
+
+def time_calls(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> np.ndarray:
+    """The seconds of each of `repeats` calls of `fn` after `warmup` calls, where `fn` must wait for any
+    asynchronously dispatched work, e.g., with `jax.block_until_ready`"""
+    for _ in range(warmup):
+        fn()
+
+    durations = np.zeros(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations[i] = time.perf_counter() - start
+    return durations
+
+
+def benchmark_metadata() -> Dict[str, Any]:
+    """The machine, library versions and git commit of a benchmark run, such that runs are only compared when comparable"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "time": time.time(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "numpy": np.__version__,
+        "jax": jax.__version__,
+        "backend": jax.default_backend(),
+        "devices": [str(device) for device in jax.devices()],
+    }
+
+
+def save_results(results: Sequence[BenchmarkResult], path: str, metadata: Optional[Dict[str, Any]] = None):
+    """Saves the results as JSON, `{"metadata": ..., "results": [{"name": ..., "params": ..., ...}, ...]}`"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"metadata": metadata or {}, "results": [result._asdict() for result in results]}, f, indent=2)
+
+
+def load_results(path: str) -> List[BenchmarkResult]:
+    with open(path) as f:
+        return [BenchmarkResult(**result) for result in json.load(f)["results"]]
+
+
+def compare_results(
+    results: Sequence[BenchmarkResult], baseline: Sequence[BenchmarkResult], threshold: float
+) -> List[Tuple[BenchmarkResult, float]]:
+    """The results that regressed from the baseline by more than `threshold`, with their relative change
+
+    :param results: The new results
+    :param baseline: The baseline results, where results without a baseline are ignored
+    :param threshold: The relative change considered a regression, e.g., 0.2 for 20% slower
+    :return: The regressed results and their relative change, positive if worse
+    """
+    baseline = {result.key: result for result in baseline}
+    regressions = []
+    for result in results:
+        if result.key not in baseline or baseline[result.key].value == 0:
+            continue
+
+        change = (result.value - baseline[result.key].value) / abs(baseline[result.key].value)
+        if result.higher_is_better:
+            change = -change
+        if change > threshold:
+            regressions.append((result, change))
+    return regressions
@@ -0,0 +1,41 @@
+import time
+from typing import Any, Callable, Optional, Tuple
+
+import jax
+
+
+def enable_compilation_cache(cache_dir: Optional[str], min_compile_time: float = 0.5):
+    """Persists the compiled XLA executables to `cache_dir`, such that later runs with the same computations, e.g., the
+    runs of a sweep, load the executables rather than compiling them.
+
+    An executable is keyed by its computation (so the shapes, dtypes and any config traced into it, e.g., the number
+    of bins), the compile options, the JAX version and the devices, such that runs of different configs share the
+    cache directory. Must be called before the first compilation.
+
+    :param cache_dir: The cache directory, if None or empty then no cache is used
+    :param min_compile_time: The minimum seconds of a compilation to be cached, such that tiny executables aren't
+        cached (as loading them is no faster than compiling them)
+    """
+    if not cache_dir:
+        return
+
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", min_compile_time)
+    jax.config.update("jax_persistent_cache_min_entry_size_bytes", 0)
+
+
+def aot_compile(fn: Callable, *args: Any, **kwargs: Any) -> Tuple[Any, float]:
+    """Lowers and compiles a jitted function ahead-of-time for the types of the arguments, e.g., a sample batch, rather
+    than on its first call.
+
+    The compiled function only accepts arguments of the same shapes, dtypes and pytree structure (raising a
+    `TypeError` otherwise), so never silently recompiles, e.g., for a Python int rather than float argument.
+
+    :param fn: The jitted function
+    :param args: The (example) positional arguments
+    :param kwargs: The (example) keyword arguments
+    :return: The compiled function and the seconds to lower and compile it
+    """
+    start = time.perf_counter()
+    compiled = fn.lower(*args, **kwargs).compile()
+    return compiled, time.perf_counter() - start
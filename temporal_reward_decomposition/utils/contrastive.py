@@ -0,0 +1,165 @@
+from typing import Any, Callable, NamedTuple, Optional
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+CONTRAST_SCORES = ("l1", "q_value", "timing")
+
+
+class Contrasts(NamedTuple):
+    """Contrasts of an action with another action (`contrast_actions`) in a state, by descending score"""
+
+    states: jnp.ndarray
+    actions: jnp.ndarray
+    contrast_actions: jnp.ndarray
+    scores: jnp.ndarray
+    # the expected rewards of `actions` minus those of `contrast_actions`, `(k, num_bins)`
+    differences: jnp.ndarray
+
+
+def action_pair_differences(decomposed_q_values: jnp.ndarray) -> jnp.ndarray:
+    """The per-bin expected reward differences of every action pair, `(batch, actions, actions, num_bins)`, where
+    `[i, a, b]` is action `a`'s expected rewards minus action `b`'s in state `i`"""
+    return decomposed_q_values[:, :, None, :] - decomposed_q_values[:, None, :, :]
+
+
+def contrast_scores(differences: jnp.ndarray, score: str = "l1") -> jnp.ndarray:
+    """How informative the contrasts of per-bin differences are, where every score is symmetric in the actions
+
+    - "l1": the sum of the absolute differences, the total change in the expected rewards
+    - "q_value": the absolute difference of the q-values, that a scalar q-value would already explain
+    - "timing": "l1" minus "q_value", the differences in when rewards are expected that cancel out in the q-values
+
+    :param differences: The per-bin differences, `(..., num_bins)`
+    :param score: The score
+    :return: The scores, `(...)`
+    """
+    if score == "l1":
+        return jnp.sum(jnp.abs(differences), axis=-1)
+    elif score == "q_value":
+        return jnp.abs(jnp.sum(differences, axis=-1))
+    elif score == "timing":
+        return jnp.sum(jnp.abs(differences), axis=-1) - jnp.abs(jnp.sum(differences, axis=-1))
+    raise ValueError(f"Unknown contrast score {score}, expected one of {CONTRAST_SCORES}")
+
+
+def top_contrasts(
+    decomposed_q_values: jnp.ndarray,
+    k: int,
+    score: str = "l1",
+    actions: Optional[jnp.ndarray] = None,
+    max_q_value_difference: Optional[float] = None,
+    valid: Optional[jnp.ndarray] = None,
+    state_offset: int = 0,
+) -> Contrasts:
+    """The `k` highest scoring contrasts of a batch of states, computed, filtered and sorted in a single (jittable)
+    vectorised pass, where the contrasts are every unordered action pair or, given `actions`, each state's action
+    with every other action.
+
+    Filtered contrasts have a score of `-inf` and are only returned if fewer than `k` contrasts remain.
+
+    :param decomposed_q_values: The decomposed q-values of the states, `(batch, actions, num_bins)`
+    :param k: The number of contrasts, at most the number of contrasts of the batch
+    :param score: The contrast score, see `contrast_scores`
+    :param actions: If set, the action of each state contrasted with every other action, e.g., the agent's actions
+    :param max_q_value_difference: If set, only the contrasts of actions with at most this difference in q-value
+    :param valid: If set, the states that are contrasted, e.g., to mask a padded batch
+    :param state_offset: Added to the returned states, e.g., the index of the batch's first state in an episode
+    :return: The contrasts
+    """
+    batch_size, num_actions, _ = decomposed_q_values.shape
+    differences = action_pair_differences(decomposed_q_values)
+    scores = contrast_scores(differences, score)
+
+    if actions is None:
+        mask = jnp.broadcast_to(jnp.triu(jnp.ones((num_actions, num_actions), dtype=bool), k=1), scores.shape)
+    else:
+        mask = (jnp.arange(num_actions)[None, :, None] == actions[:, None, None]) & ~jnp.eye(num_actions, dtype=bool)
+    if max_q_value_difference is not None:
+        mask &= jnp.abs(jnp.sum(differences, axis=-1)) <= max_q_value_difference
+    if valid is not None:
+        mask &= valid[:, None, None]
+
+    top_scores, indices = jax.lax.top_k(jnp.where(mask, scores, -jnp.inf).reshape(-1), k)
+    states, first_actions, second_actions = jnp.unravel_index(indices, (batch_size, num_actions, num_actions))
+    return Contrasts(
+        states=states + state_offset,
+        actions=first_actions,
+        contrast_actions=second_actions,
+        scores=top_scores,
+        differences=differences[states, first_actions, second_actions],
+    )
+
+
+def merge_contrasts(contrasts: Contrasts, other: Contrasts, k: int) -> Contrasts:
+    """The `k` highest scoring of two sets of contrasts, e.g., a running top-k and a batch's"""
+    merged = jax.tree_util.tree_map(lambda x, y: jnp.concatenate([x, y]), contrasts, other)
+    _, indices = jax.lax.top_k(merged.scores, k)
+    return jax.tree_util.tree_map(lambda x: x[indices], merged)
+
+
+def contrastive_explanations(
+    decomposed_fn: Callable[[Any, jnp.ndarray], jnp.ndarray],
+    params: Any,
+    observations: jnp.ndarray,
+    k: int,
+    **kwargs,
+) -> Contrasts:
+    """The `k` highest scoring contrasts of a batch of observations, see `top_contrasts`
+
+    :param decomposed_fn: The decomposed q-values of the parameters and observations, e.g., `QNetwork.decomposed_q_value`
+    :param params: The network parameters
+    :param observations: The batch of observations
+    :param k: The number of contrasts
+    :param kwargs: The keyword arguments of `top_contrasts`
+    """
+    return top_contrasts(decomposed_fn(params, observations), k, **kwargs)
+
+
+def mine_contrasts(
+    decomposed_q_values: np.ndarray,
+    k: int,
+    actions: Optional[np.ndarray] = None,
+    batch_size: int = 4096,
+    **kwargs,
+) -> Contrasts:
+    """The `k` highest scoring contrasts of any number of states, e.g., the expected rewards of an episode store, in
+    padded batches of `batch_size` states where the running top-k contrasts are kept on the device.
+
+    :param decomposed_q_values: The decomposed q-values, `(states, actions, num_bins)`, e.g., a memory-mapped field
+    :param k: The number of contrasts
+    :param actions: If set, the action of each state contrasted with every other action
+    :param batch_size: The number of states of each batch
+    :param kwargs: The keyword arguments of `top_contrasts`, i.e., `score` and `max_q_value_difference`
+    :return: The contrasts as numpy arrays, without any filtered contrasts
+    """
+    num_states, num_actions, num_bins = decomposed_q_values.shape
+    batch_k = min(k, batch_size * num_actions * num_actions)
+
+    @jax.jit
+    def mine_batch(running, batch, batch_actions, length, offset):
+        contrasts = top_contrasts(
+            batch, batch_k, actions=batch_actions, valid=jnp.arange(batch_size) < length, state_offset=offset, **kwargs
+        )
+        return merge_contrasts(running, contrasts, k)
+
+    running = Contrasts(
+        states=jnp.zeros(k, dtype=jnp.int32),
+        actions=jnp.zeros(k, dtype=jnp.int32),
+        contrast_actions=jnp.zeros(k, dtype=jnp.int32),
+        scores=jnp.full(k, -jnp.inf),
+        differences=jnp.zeros((k, num_bins), dtype=decomposed_q_values.dtype),
+    )
+    for start in range(0, num_states, batch_size):
+        batch = np.asarray(decomposed_q_values[start : start + batch_size])
+        length = len(batch)
+        batch = np.concatenate([batch, np.zeros((batch_size - length, num_actions, num_bins), dtype=batch.dtype)])
+        batch_actions = None
+        if actions is not None:
+            batch_actions = np.zeros(batch_size, dtype=np.int32)
+            batch_actions[:length] = actions[start : start + batch_size]
+        running = mine_batch(running, batch, batch_actions, length, start)
+
+    contrasts = jax.device_get(running)
+    return jax.tree_util.tree_map(lambda x: x[np.isfinite(contrasts.scores)], contrasts)
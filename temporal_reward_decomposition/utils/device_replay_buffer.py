@@ -0,0 +1,104 @@
+from typing import Optional
+
+import flax
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from temporal_reward_decomposition.utils.frame_stack_buffer import FrameStackReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer, ReplayBufferSamples
+
+
+@flax.struct.dataclass
+class DeviceReplayBuffer:
+    """Replay buffer stored as JAX arrays such that sampling can be done within a jitted function.
+
+    This avoids the host to device transfer and Python sampling cost of each gradient step,
+    but requires the whole buffer to fit within device memory.
+    """
+
+    observations: jnp.ndarray
+    actions: jnp.ndarray
+    next_observations: jnp.ndarray
+    rewards: jnp.ndarray
+    dones: jnp.ndarray
+    teacher_q_values: Optional[jnp.ndarray] = None
+
+    @classmethod
+    def from_replay_buffer(cls, buffer: ReplayBuffer, device=None) -> "DeviceReplayBuffer":
+        """Copies the filled transitions of a (host) replay buffer to the device"""
+        size = buffer.size()
+        return cls(
+            observations=jax.device_put(buffer.observations[:size], device),
+            actions=jax.device_put(buffer.actions[:size], device),
+            next_observations=jax.device_put(buffer.next_observations[:size], device),
+            rewards=jax.device_put(buffer.rewards[:size], device),
+            dones=jax.device_put(buffer.dones[:size], device),
+            teacher_q_values=None if buffer.teacher_q_values is None else jax.device_put(buffer.teacher_q_values[:size], device),
+        )
+
+    def size(self) -> int:
+        return self.rewards.shape[0]
+
+    def sample(self, key: jax.random.PRNGKey, batch_size: int) -> ReplayBufferSamples:
+        """Uniformly samples a batch of transitions, `batch_size` must be static if jitted"""
+        indices = jax.random.randint(key, (batch_size,), 0, self.size())
+        return ReplayBufferSamples(
+            observations=self.observations[indices],
+            actions=self.actions[indices],
+            next_observations=self.next_observations[indices],
+            dones=self.dones[indices],
+            rewards=self.rewards[indices],
+            teacher_q_values=None if self.teacher_q_values is None else self.teacher_q_values[indices],
+        )
+
+
+@flax.struct.dataclass
+class DeviceFrameStackReplayBuffer:
+    """Device copy of a `FrameStackReplayBuffer`, the frame stacked observations are rebuilt when sampled."""
+
+    frames: jnp.ndarray
+    observation_frames: jnp.ndarray
+    actions: jnp.ndarray
+    next_observation_frames: jnp.ndarray
+    rewards: jnp.ndarray
+    dones: jnp.ndarray
+    teacher_q_values: Optional[jnp.ndarray] = None
+
+    @classmethod
+    def from_frame_stack_buffer(cls, buffer: FrameStackReplayBuffer, device=None) -> "DeviceFrameStackReplayBuffer":
+        """Copies the filled transitions and their frames of a (host) frame stack replay buffer to the device, without
+        the stale transitions whose frames have been overwritten (see `FrameStackReplayBuffer`)"""
+        assert buffer.buffer is not None, "the n-step transitions of a lazy n-step buffer are only computed on the host"
+        transitions = buffer.buffer
+        valid = np.nonzero(transitions.observations[:buffer.size(), 0] >= buffer.frames_added - buffer.frame_buffer_size)[0]
+        assert len(valid) > 0, "every transition's frames have been overwritten, increase `frame_buffer_slack`"
+
+        return cls(
+            frames=jax.device_put(buffer.frames, device),
+            observation_frames=jax.device_put((transitions.observations[valid] % buffer.frame_buffer_size).astype(np.int32), device),
+            actions=jax.device_put(transitions.actions[valid], device),
+            next_observation_frames=jax.device_put(
+                (transitions.next_observations[valid] % buffer.frame_buffer_size).astype(np.int32), device
+            ),
+            rewards=jax.device_put(transitions.rewards[valid], device),
+            dones=jax.device_put(transitions.dones[valid], device),
+            teacher_q_values=None if transitions.teacher_q_values is None else jax.device_put(
+                transitions.teacher_q_values[valid], device
+            ),
+        )
+
+    def size(self) -> int:
+        return self.rewards.shape[0]
+
+    def sample(self, key: jax.random.PRNGKey, batch_size: int) -> ReplayBufferSamples:
+        """Uniformly samples a batch of transitions, `batch_size` must be static if jitted"""
+        indices = jax.random.randint(key, (batch_size,), 0, self.size())
+        return ReplayBufferSamples(
+            observations=self.frames[self.observation_frames[indices]],
+            actions=self.actions[indices],
+            next_observations=self.frames[self.next_observation_frames[indices]],
+            dones=self.dones[indices],
+            rewards=self.rewards[indices],
+            teacher_q_values=None if self.teacher_q_values is None else self.teacher_q_values[indices],
+        )
@@ -0,0 +1,228 @@
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+
+class EpisodeStore:
+    """A chunked, memory-mapped on-disk store of the per-step arrays of recorded episodes, e.g., the observations and
+    expected rewards, with an index of each episode's steps.
+
+    Each field is saved as `.npy` chunks of `chunk_size` steps, `{path}/{field}/{chunk}.npy`, such that an episode is
+    read without loading the whole store and the store grows without rewriting it. The index and fields are saved
+    in `{path}/metadata.json` after each episode, so an interrupted recording keeps its complete episodes.
+    """
+
+    def __init__(self, path: str, mmap_mode: str = "r+"):
+        """Opens an existing store, see `EpisodeStore.create` for a new store
+
+        :param path: The store's directory
+        :param mmap_mode: The chunks' memory-map mode, "r" for a read-only store
+        """
+        with open(os.path.join(path, "metadata.json")) as file:
+            metadata = json.load(file)
+
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.chunk_size: int = metadata["chunk_size"]
+        self.num_steps: int = metadata["num_steps"]
+        self.fields: Dict[str, Tuple[Tuple[int, ...], np.dtype]] = {
+            name: (tuple(field["shape"]), np.dtype(field["dtype"])) for name, field in metadata["fields"].items()
+        }
+        self.episodes: List[Dict[str, Any]] = metadata["episodes"]
+        self.metadata: Dict[str, Any] = metadata["metadata"]
+
+        self._chunks: Dict[Tuple[str, int], np.memmap] = {}
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        fields: Dict[str, Tuple[Tuple[int, ...], Any]],
+        chunk_size: int = 1024,
+        **metadata,
+    ) -> "EpisodeStore":
+        """Creates an empty store
+
+        :param path: The store's directory, that must not contain a store
+        :param fields: The name, step shape and dtype of the fields, more can be added with `add_field`
+        :param chunk_size: The number of steps of each chunk
+        :param metadata: Any metadata of the store, e.g., the env and model
+        :return: The store
+        """
+        if os.path.exists(os.path.join(path, "metadata.json")):
+            raise FileExistsError(f"An episode store already exists at {path}")
+        os.makedirs(path, exist_ok=True)
+
+        store = cls.__new__(cls)
+        store.path = path
+        store.mmap_mode = "r+"
+        store.chunk_size = chunk_size
+        store.num_steps = 0
+        store.fields = {}
+        store.episodes = []
+        store.metadata = metadata
+        store._chunks = {}
+        for name, (shape, dtype) in fields.items():
+            store.add_field(name, shape, dtype)
+        store.flush()
+        return store
+
+    @property
+    def num_episodes(self) -> int:
+        return len(self.episodes)
+
+    def add_field(self, name: str, shape: Tuple[int, ...], dtype: Any):
+        """Adds a field for every step, e.g., the expected rewards of the recorded observations, initially zeros"""
+        if name in self.fields:
+            raise ValueError(f"The field {name} already exists")
+        self.fields[name] = (tuple(shape), np.dtype(dtype))
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+
+    def add_episode(self, **arrays: np.ndarray) -> int:
+        """Appends an episode's steps, where fields without an array are zeros
+
+        :param arrays: The episode's steps of each field (`(length, *shape)`), and any scalar info, e.g., the return
+        :return: The episode's index
+        """
+        steps = {name: array for name, array in arrays.items() if name in self.fields}
+        info = {name: value for name, value in arrays.items() if name not in self.fields}
+        lengths = {len(array) for array in steps.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"The episode's fields must have the same number of steps, {lengths}")
+        (length,) = lengths
+
+        start = self.num_steps
+        self.num_steps += length
+        for name, array in steps.items():
+            self.write(name, start, array)
+        self.episodes.append({"start": start, "length": length, **info})
+
+        self.flush()
+        return len(self.episodes) - 1
+
+    def write(self, name: str, start: int, values: np.ndarray):
+        """Writes the steps `start` to `start + len(values)` of a field"""
+        if start + len(values) > self.num_steps:
+            raise IndexError(f"Steps {start} to {start + len(values)} are out of the store's {self.num_steps} steps")
+
+        for chunk, chunk_start, chunk_stop, offset in self._chunk_slices(start, start + len(values)):
+            self._chunk(name, chunk)[chunk_start:chunk_stop] = values[offset : offset + chunk_stop - chunk_start]
+
+    def read(self, name: str, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Reads the steps `start` to `stop` of a field, as a memory-mapped view if the steps are in a single chunk"""
+        stop = self.num_steps if stop is None else stop
+        if not 0 <= start <= stop <= self.num_steps:
+            raise IndexError(f"Steps {start} to {stop} are out of the store's {self.num_steps} steps")
+
+        slices = [
+            self._chunk(name, chunk)[chunk_start:chunk_stop]
+            for chunk, chunk_start, chunk_stop, _ in self._chunk_slices(start, stop)
+        ]
+        if len(slices) == 1:
+            return slices[0]
+        shape, dtype = self.fields[name]
+        return np.concatenate(slices) if slices else np.zeros((0, *shape), dtype=dtype)
+
+    def episode(self, index: int, name: str) -> np.ndarray:
+        """Reads an episode's steps of a field"""
+        episode = self.episodes[index]
+        return self.read(name, episode["start"], episode["start"] + episode["length"])
+
+    def locate(self, steps: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """The episode and the step within the episode of each of the store's steps"""
+        steps = np.asarray(steps)
+        starts = np.array([episode["start"] for episode in self.episodes], dtype=np.int64)
+        episodes = np.searchsorted(starts, steps, side="right") - 1
+        return episodes, steps - starts[episodes]
+
+    def flush(self):
+        """Flushes the written chunks then saves the metadata (atomically) such that it only indexes written steps"""
+        for chunk in self._chunks.values():
+            chunk.flush()
+
+        metadata = {
+            "chunk_size": self.chunk_size,
+            "num_steps": self.num_steps,
+            "fields": {name: {"shape": list(shape), "dtype": dtype.str} for name, (shape, dtype) in self.fields.items()},
+            "episodes": self.episodes,
+            "metadata": self.metadata,
+        }
+        tmp_path = os.path.join(self.path, f"metadata.json.tmp-{os.getpid()}")
+        with open(tmp_path, "w") as file:
+            json.dump(metadata, file, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, "metadata.json"))
+
+    def _chunk_slices(self, start: int, stop: int):
+        """The chunk, the start and stop within the chunk, and the offset from `start` of the steps `start` to `stop`"""
+        offset = start
+        while offset < stop:
+            chunk, chunk_start = divmod(offset, self.chunk_size)
+            chunk_stop = min(self.chunk_size, chunk_start + stop - offset)
+            yield chunk, chunk_start, chunk_stop, offset - start
+            offset += chunk_stop - chunk_start
+
+    def _chunk(self, name: str, chunk: int) -> np.memmap:
+        if (name, chunk) not in self._chunks:
+            shape, dtype = self.fields[name]
+            filename = os.path.join(self.path, name, f"{chunk:06d}.npy")
+            if os.path.exists(filename):
+                self._chunks[name, chunk] = np.load(filename, mmap_mode=self.mmap_mode)
+            elif self.mmap_mode == "r":
+                # a field added after the steps were written (and never written) is zeros
+                return np.zeros((self.chunk_size, *shape), dtype=dtype)
+            else:
+                self._chunks[name, chunk] = np.lib.format.open_memmap(
+                    filename, mode="w+", dtype=dtype, shape=(self.chunk_size, *shape)
+                )
+        return self._chunks[name, chunk]
+
+
+def map_episode_store(
+    store: EpisodeStore,
+    fn: Callable[[Any, jnp.ndarray], jnp.ndarray],
+    params: Any,
+    input_field: str,
+    output_field: str,
+    batch_size: int = 1024,
+):
+    """Applies a batched function to every step of a field, e.g., `QNetwork.decomposed_q_value` to the observations,
+    writing its outputs to another field.
+
+    Every batch is padded to `batch_size` so `fn` is compiled once, and the next batch is dispatched before the
+    previous outputs are copied to the host and written, overlapping the reads, compute and writes.
+
+    :param store: The episode store
+    :param fn: The function of the parameters and a batch of inputs, e.g., `partial(network.apply, method=...)`
+    :param params: The function's parameters
+    :param input_field: The inputs' field
+    :param output_field: The outputs' field, added to the store if it doesn't exist
+    :param batch_size: The steps of each function call
+    """
+    input_shape, input_dtype = store.fields[input_field]
+    fn = jax.jit(fn)
+    output = jax.eval_shape(fn, params, jax.ShapeDtypeStruct((batch_size, *input_shape), input_dtype))
+    if output_field not in store.fields:
+        store.add_field(output_field, output.shape[1:], output.dtype)
+    elif store.fields[output_field] != (output.shape[1:], output.dtype):
+        raise ValueError(f"The field {output_field} is {store.fields[output_field]} rather than the outputs' {output}")
+
+    pending = None
+    for start in range(0, store.num_steps, batch_size):
+        inputs = store.read(input_field, start, min(start + batch_size, store.num_steps))
+        length = len(inputs)
+        if length < batch_size:
+            inputs = np.concatenate([inputs, np.zeros((batch_size - length, *input_shape), dtype=input_dtype)])
+
+        outputs = fn(params, inputs)
+        outputs.copy_to_host_async()
+        if pending is not None:
+            store.write(output_field, pending[0], np.asarray(pending[2])[: pending[1]])
+        pending = (start, length, outputs)
+
+    if pending is not None:
+        store.write(output_field, pending[0], np.asarray(pending[2])[: pending[1]])
+    store.flush()
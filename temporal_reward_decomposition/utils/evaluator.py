@@ -0,0 +1,133 @@
+import queue
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+import gymnasium as gym
+import numpy as np
+
+
+def evaluate_episodes(
+    envs: gym.vector.VectorEnv,
+    policy: Callable,
+    params,
+    epsilon: float = 0.0,
+    seed: Optional[int] = None,
+    rng: Optional[np.random.Generator] = None,
+) -> np.ndarray:
+    """Runs an episode in each of the vector env's envs together, with the actions of every env selected in a batch.
+
+    The envs must be wrapped with `RecordEpisodeStatistics` (before any wrapper that ends episodes early, e.g.,
+    `EpisodicLifeEnv`) as an env's episode is complete once its episode statistics are reported.
+
+    :param envs: The vector env, with an env for each episode
+    :param policy: The (jitted) greedy policy, `policy(params, observations) -> actions`
+    :param params: The policy's parameters
+    :param epsilon: The probability of an env taking a random action each step
+    :param seed: The seed of the envs' reset
+    :param rng: The random number generator of the epsilon-greedy actions
+    :return: The episodic return of each env
+    """
+    rng = np.random.default_rng(seed) if rng is None else rng
+    episodic_returns = np.full(envs.num_envs, np.nan)
+
+    obs, _ = envs.reset(seed=seed)
+    while np.any(np.isnan(episodic_returns)):
+        actions = np.array(policy(params, obs))
+        explore = rng.random(envs.num_envs) < epsilon
+        if np.any(explore):
+            actions[explore] = [envs.single_action_space.sample() for _ in range(np.sum(explore))]
+
+        obs, _, _, _, infos = envs.step(actions)
+        if "final_info" in infos:
+            for idx, info in enumerate(infos["final_info"]):
+                # only the first episode of each env is used
+                if info is not None and "episode" in info and np.isnan(episodic_returns[idx]):
+                    episodic_returns[idx] = np.squeeze(info["episode"]["r"])
+
+    return episodic_returns
+
+
+class BackgroundEvaluator:
+    """Evaluates the in-memory parameters with `evaluate_episodes` in a background thread while training continues.
+
+    The parameters are submitted with a step and tag, and the results are collected with `results` as
+    `(step, tag, episodic_returns)` in the order submitted. The vector env is created once by the thread and reset for
+    each evaluation, with the seed offset by the evaluation's index such that successive evaluations are of fresh
+    episodes (rather than the same initial states), and as JAX arrays are immutable, the submitted parameters aren't
+    copied.
+    """
+
+    def __init__(self, make_envs: Callable[[], gym.vector.VectorEnv], policy: Callable, epsilon: float = 0.0, seed: Optional[int] = None):
+        """
+        :param make_envs: Creates the vector env, with an env for each episode of an evaluation
+        :param policy: The (jitted) greedy policy, `policy(params, observations) -> actions`
+        :param epsilon: The probability of an env taking a random action each step
+        :param seed: The seed of the envs' reset for the first evaluation and the epsilon-greedy actions
+        """
+        self.make_envs = make_envs
+        self.policy = policy
+        self.epsilon = epsilon
+        self.seed = seed
+
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._pending = 0
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _worker(self):
+        envs, rng = None, np.random.default_rng(self.seed)
+        evaluation = 0
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            params, step, tag = job
+            try:
+                if envs is None:
+                    envs = self.make_envs()
+                # the vector env seeds its envs `seed + i`, so the evaluations' seeds are `num_envs` apart
+                seed = None if self.seed is None else self.seed + evaluation * envs.num_envs
+                evaluation += 1
+                self._results.put((step, tag, evaluate_episodes(envs, self.policy, params, self.epsilon, seed, rng)))
+            except Exception as error:  # raised by `results` in the training thread
+                self._results.put(error)
+
+        if envs is not None:
+            envs.close()
+
+    def submit(self, params, step: int, tag: str = ""):
+        """Queues an evaluation of the parameters, returning immediately"""
+        assert self._thread.is_alive(), "the evaluator is closed"
+        self._pending += 1
+        self._jobs.put((params, step, tag))
+
+    def results(self, wait: bool = False) -> List[Tuple[int, str, np.ndarray]]:
+        """The completed evaluations since the last call, waiting for every submitted evaluation if `wait`"""
+        completed = []
+        while self._pending > 0:
+            try:
+                result = self._results.get(block=wait)
+            except queue.Empty:
+                break
+
+            self._pending -= 1
+            if isinstance(result, Exception):
+                raise result
+            completed.append(result)
+        return completed
+
+    def close(self) -> List[Tuple[int, str, np.ndarray]]:
+        """Waits for the submitted evaluations and stops the thread, returning the evaluations not yet collected"""
+        try:
+            return self.results(wait=True)
+        finally:
+            self._jobs.put(None)
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
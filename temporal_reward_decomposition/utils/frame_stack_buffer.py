@@ -0,0 +1,173 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+from gymnasium import spaces
+
+from temporal_reward_decomposition.utils.lazy_n_step_buffer import LazyNStepReplayBuffer
+from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer, ReplayBufferSamples
+
+# the rounds of resampling the transitions whose frames have been overwritten before `sample` raises
+MAX_STALE_RESAMPLES = 8
+
+
+class FrameStackReplayBuffer:
+    """N-step replay buffer for frame stacked observations (i.e., `gym.wrappers.FrameStack`) that stores each frame once.
+
+    Each transition stores the indices of its observation's frames in a ring of single frames, with the stacked
+    observations rebuilt from the indices when sampled. Frames are only shared between the observations of the same
+    episode, and the repeated frames of a reset observation are stored once, so each transition costs roughly one frame
+    rather than the two full stacks of a `ReplayBuffer`.
+
+    The frame ring is `frame_buffer_size` frames, by default `frame_buffer_slack` (12.5%) larger than `buffer_size` plus
+    the frames of each env's stack and pending n-step transitions, to fit the extra frames of the reset observations. A
+    lazy n-step buffer has no pending transitions, so its frame ring doesn't depend on `n_step` and its saved frames load
+    for any `n_step`. If short episodes' reset observations use more than the slack, the frames of the oldest
+    transitions are overwritten, and these stale transitions are resampled rather than returned.
+
+    With `lazy_n_step`, the transitions are stored in a `LazyNStepReplayBuffer` such that the n-step transitions
+    are computed when sampled, otherwise the n-step transitions are stored in a `ReplayBuffer` as `buffer`.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Box,
+        action_space: spaces.Space,
+        n_step: int,
+        gamma: float,
+        num_envs: int = 1,
+        frame_buffer_size: Optional[int] = None,
+        frame_buffer_slack: float = 0.125,
+        seed: Optional[int] = None,
+        store_teacher_q_values: bool = False,
+        lazy_n_step: bool = False,
+    ):
+        self.stack_size = observation_space.shape[0]
+        self.num_envs = num_envs
+
+        pending_steps = 0 if lazy_n_step else n_step
+        self.frame_buffer_size = frame_buffer_size or (
+            buffer_size + int(buffer_size * frame_buffer_slack) + num_envs * (self.stack_size + pending_steps)
+        )
+        self.frames = np.zeros((self.frame_buffer_size,) + observation_space.shape[1:], dtype=observation_space.dtype)
+        self.frames_added = 0
+
+        # the (absolute) frame indices of each env's current observation
+        self.env_frame_indices = np.zeros((num_envs, self.stack_size), dtype=np.int64)
+        self.env_episode_start = np.ones(num_envs, dtype=np.bool_)
+
+        frame_indices_space = spaces.Box(0, np.iinfo(np.int64).max, (self.stack_size,), dtype=np.int64)
+        if lazy_n_step:
+            self.buffer = None
+            self.n_step_buffer = LazyNStepReplayBuffer(
+                buffer_size, frame_indices_space, action_space, n_step, gamma, num_envs,
+                seed=seed, store_teacher_q_values=store_teacher_q_values,
+            )
+        else:
+            self.buffer = ReplayBuffer(
+                buffer_size, frame_indices_space, action_space, seed=seed, store_teacher_q_values=store_teacher_q_values
+            )
+            self.n_step_buffer = NStepReplayBuffer(self.buffer, n_step, gamma, num_envs)
+
+    def size(self) -> int:
+        return self.n_step_buffer.size()
+
+    def _add_frames(self, frames: np.ndarray) -> np.ndarray:
+        indices = self.frames_added + np.arange(len(frames))
+        self.frames[indices % self.frame_buffer_size] = frames
+        self.frames_added += len(frames)
+        return indices
+
+    def _add_stack(self, observation: np.ndarray) -> np.ndarray:
+        """Adds the frames of an episode's first observation, consecutive identical frames are only stored once"""
+        is_new_frame = np.ones(self.stack_size, dtype=np.bool_)
+        is_new_frame[1:] = np.any(observation[1:] != observation[:-1], axis=tuple(range(1, observation.ndim)))
+
+        new_frame_indices = self._add_frames(observation[is_new_frame])
+        return new_frame_indices[np.cumsum(is_new_frame) - 1]
+
+    def add(self, observation, next_observation, action, reward, terminated, truncated, teacher_q_values=None, env_ids=None):
+        """Adds a batch of (observation, action, reward, terminated and next_observation) for each env to the replay buffer
+
+        :param observation: The frame stacked observations that the agent acted on, shape (num_envs, stack_size, ...)
+        :param next_observation: The next frame stacked observations resulting in the actions being taken
+        :param action: The actions that the agent took, shape (num_envs, ...)
+        :param reward: The rewards for the actions given the observations, shape (num_envs,)
+        :param terminated: If the actions resulted in the environments terminating, shape (num_envs,)
+        :param truncated: If the environments truncated after the actions, shape (num_envs,)
+        :param teacher_q_values: The teacher's q-values of the observations if stored, shape (num_envs, num_actions)
+        :param env_ids: The envs of the batch if only a subset of the envs stepped, i.e., an actor's envs
+        """
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        for idx in np.nonzero(self.env_episode_start[env_ids])[0]:
+            self.env_frame_indices[env_ids[idx]] = self._add_stack(observation[idx])
+
+        # within an episode, the next observation only differs from the observation by its newest frame
+        observation_frame_indices = self.env_frame_indices[env_ids]
+        next_observation_frame_indices = np.concatenate(
+            [observation_frame_indices[:, 1:], self._add_frames(next_observation[:, -1])[:, None]], axis=1
+        )
+        self.n_step_buffer.add(
+            observation_frame_indices, next_observation_frame_indices, action, reward, terminated, truncated,
+            teacher_q_values, env_ids=None if len(env_ids) == self.num_envs else env_ids,
+        )
+
+        self.env_frame_indices[env_ids] = next_observation_frame_indices
+        self.env_episode_start[env_ids] = np.logical_or(terminated, truncated)
+
+    def reset(self, num_envs: Optional[int] = None):
+        """Drops the pending transitions of each env, i.e., when the environments are recreated
+
+        :param num_envs: If the number of envs changes, i.e., for the envs of several actors
+        """
+        if num_envs is not None and num_envs != self.num_envs:
+            self.num_envs = num_envs
+            self.env_frame_indices = np.zeros((num_envs, self.stack_size), dtype=np.int64)
+            self.env_episode_start = np.ones(num_envs, dtype=np.bool_)
+        self.env_episode_start[:] = True
+        self.n_step_buffer.reset(num_envs)
+
+    def save(self, path: str):
+        """Saves the frames and transitions within the `path` directory, the pending transitions are not saved"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "frames.npy"), self.frames)
+        with open(os.path.join(path, "frame_stack_buffer.json"), "w") as file:
+            json.dump({"frames_added": self.frames_added}, file)
+        self.n_step_buffer.save(os.path.join(path, "transitions"))
+
+    def load(self, path: str, mmap_mode: Optional[str] = "c"):
+        """Loads the frames and transitions saved within the `path` directory, see `ReplayBuffer.load`"""
+        frames = np.load(os.path.join(path, "frames.npy"), mmap_mode=mmap_mode)
+        assert frames.shape == self.frames.shape and frames.dtype == self.frames.dtype, \
+            f"the saved frames {frames.shape} don't match the frame buffer's {self.frames.shape}"
+        self.frames = frames
+        with open(os.path.join(path, "frame_stack_buffer.json")) as file:
+            self.frames_added = json.load(file)["frames_added"]
+        self.n_step_buffer.load(os.path.join(path, "transitions"), mmap_mode)
+        self.env_episode_start[:] = True
+
+    def sample(self, batch_size: int) -> ReplayBufferSamples:
+        """Uniformly samples a batch of transitions, rebuilding the frame stacked observations"""
+        samples = self.n_step_buffer.sample(batch_size)
+        # the first frame of an observation is the oldest frame of its transition
+        oldest_frame = self.frames_added - self.frame_buffer_size
+        stale = np.nonzero(samples.observations[:, 0] < oldest_frame)[0]
+        for _ in range(MAX_STALE_RESAMPLES):
+            if len(stale) == 0:
+                break
+            for array, resampled_array in zip(samples, self.n_step_buffer.sample(len(stale))):
+                if array is not None:
+                    array[stale] = resampled_array
+            stale = stale[samples.observations[stale, 0] < oldest_frame]
+        if len(stale) > 0:
+            raise ValueError(
+                "The sampled transitions' frames have been overwritten, increase `frame_buffer_slack` or `frame_buffer_size`"
+            )
+
+        return samples._replace(
+            observations=np.take(self.frames, samples.observations % self.frame_buffer_size, axis=0),
+            next_observations=np.take(self.frames, samples.next_observations % self.frame_buffer_size, axis=0),
+        )
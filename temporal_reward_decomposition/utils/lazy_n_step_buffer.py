@@ -0,0 +1,187 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+from gymnasium import spaces
+
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBufferSamples
+
+# the rounds of rejection sampling before the remaining samples are drawn from every complete n-step window
+MAX_REJECTION_ROUNDS = 8
+
+
+class LazyNStepReplayBuffer:
+    """Replay buffer of single-step transitions that computes the n-step transitions when sampled.
+
+    Unlike `NStepReplayBuffer`, the n-step reward, bootstrap observation and done flag are not baked into the stored
+    transitions, so the same collected data can be sampled for any `n_step` and `gamma`. The transitions are stored in
+    a ring of (step, env) such that each env's consecutive steps are found by index. Samples whose n-step window is
+    incomplete (not yet collected or cut by a truncation) are rejected and resampled, matching the transitions that
+    an `NStepReplayBuffer` would contain. If the complete windows are rare, the samples still incomplete after
+    `MAX_REJECTION_ROUNDS` are drawn from every complete window instead, and without any complete window `sample` raises.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Discrete,
+        n_step: int,
+        gamma: float,
+        num_envs: int = 1,
+        seed: Optional[int] = None,
+        store_teacher_q_values: bool = False,
+    ):
+        self.n_step = n_step
+        self.gamma = gamma
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+
+        self.buffer_steps = buffer_size // num_envs
+        self.steps_added = 0
+
+        # arrays are indexed by `step * num_envs + env`
+        capacity = self.buffer_steps * num_envs
+        self.observations = np.zeros((capacity,) + observation_space.shape, dtype=observation_space.dtype)
+        self.next_observations = np.zeros((capacity,) + observation_space.shape, dtype=observation_space.dtype)
+        self.actions = np.zeros((capacity,) + action_space.shape, dtype=action_space.dtype)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.terminated = np.zeros(capacity, dtype=np.bool_)
+        self.truncated = np.zeros(capacity, dtype=np.bool_)
+        self.teacher_q_values = np.zeros((capacity, action_space.n), dtype=np.float32) if store_teacher_q_values else None
+
+    def size(self) -> int:
+        """The number of stored single-step transitions, including those without a complete n-step window"""
+        return min(self.steps_added, self.buffer_steps) * self.num_envs
+
+    def _array_names(self):
+        names = ["observations", "next_observations", "actions", "rewards", "terminated", "truncated"]
+        if self.teacher_q_values is not None:
+            names.append("teacher_q_values")
+        return names
+
+    def add(self, observation, next_observation, action, reward, terminated, truncated, teacher_q_values=None, env_ids=None):
+        """Adds a batch of (observation, action, reward, terminated and next_observation) for each env to the replay buffer
+
+        :param observation: The observations that the agent acted on, shape (num_envs, ...)
+        :param next_observation: The next observations resulting in the actions being taken, shape (num_envs, ...)
+        :param action: The actions that the agent took, shape (num_envs, ...)
+        :param reward: The rewards for the actions given the observations, shape (num_envs,)
+        :param terminated: If the actions resulted in the environments terminating, shape (num_envs,)
+        :param truncated: If the environments truncated after the actions, shape (num_envs,)
+        :param teacher_q_values: The teacher's q-values of the observations if stored, shape (num_envs, num_actions)
+        :param env_ids: Unsupported, as each step of the envs are stored together
+        """
+        assert env_ids is None, "the lazy n-step buffer requires every env to step together"
+        assert isinstance(reward, np.ndarray) and reward.shape == (self.num_envs,)
+
+        indices = slice(
+            (self.steps_added % self.buffer_steps) * self.num_envs,
+            (self.steps_added % self.buffer_steps + 1) * self.num_envs,
+        )
+        self.observations[indices] = observation
+        self.next_observations[indices] = next_observation
+        self.actions[indices] = np.reshape(action, (self.num_envs,) + self.actions.shape[1:])
+        self.rewards[indices] = reward
+        self.terminated[indices] = terminated
+        self.truncated[indices] = truncated
+        if self.teacher_q_values is not None:
+            self.teacher_q_values[indices] = teacher_q_values
+        self.steps_added += 1
+
+    def reset(self, num_envs: Optional[int] = None):
+        """Ends the episode of each env, i.e., when the environments are recreated"""
+        assert num_envs is None or num_envs == self.num_envs, "the lazy n-step buffer's number of envs is fixed"
+        if self.steps_added > 0:
+            last_step = (self.steps_added - 1) % self.buffer_steps
+            self.truncated[last_step * self.num_envs:(last_step + 1) * self.num_envs] = True
+
+    def _n_step_transitions(self, steps: np.ndarray, envs: np.ndarray, n_step: int, gamma: float):
+        """Computes the n-step reward, done flag and bootstrap index of each (absolute) step and env,
+        and if the n-step window is complete."""
+        window_steps = steps[:, None] + np.arange(n_step)[None, :]
+        window_indices = (window_steps % self.buffer_steps) * self.num_envs + envs[:, None]
+        is_collected = window_steps < self.steps_added
+
+        terminated = self.terminated[window_indices] & is_collected
+        ended = (terminated | self.truncated[window_indices]) & is_collected
+        # the window is cut at the first end of the episode or the last collected step
+        window_ends = np.where(np.any(ended, axis=1), np.argmax(ended, axis=1), n_step - 1)
+        window_ends = np.minimum(window_ends, np.sum(is_collected, axis=1) - 1)
+
+        rows = np.arange(len(steps))
+        dones = terminated[rows, window_ends]
+        is_complete = dones | ((window_ends == n_step - 1) & is_collected[:, -1])
+
+        discounts = np.where(np.arange(n_step)[None, :] <= window_ends[:, None], np.power(gamma, np.arange(n_step)), 0.0)
+        n_step_rewards = np.sum(self.rewards[window_indices] * discounts, axis=1)
+        return n_step_rewards, dones, window_indices[rows, window_ends], is_complete
+
+    def sample(self, batch_size: int, n_step: Optional[int] = None, gamma: Optional[float] = None) -> ReplayBufferSamples:
+        """Uniformly samples a batch of n-step transitions
+
+        :param batch_size: The number of transitions
+        :param n_step: The number of steps for the transitions' reward and bootstrap observation, defaults to `n_step`
+        :param gamma: The discount factor for the n-step reward, defaults to `gamma`
+        """
+        n_step = self.n_step if n_step is None else n_step
+        gamma = self.gamma if gamma is None else gamma
+
+        oldest_step = max(self.steps_added - self.buffer_steps, 0)
+        steps = np.zeros(batch_size, dtype=np.int64)
+        envs = np.zeros(batch_size, dtype=np.int64)
+        rewards = np.zeros(batch_size, dtype=np.float32)
+        dones = np.zeros(batch_size, dtype=np.bool_)
+        bootstrap_indices = np.zeros(batch_size, dtype=np.int64)
+
+        resample = np.arange(batch_size)
+        for _ in range(MAX_REJECTION_ROUNDS):
+            steps[resample] = self.rng.integers(oldest_step, self.steps_added, size=len(resample))
+            envs[resample] = self.rng.integers(0, self.num_envs, size=len(resample))
+            (
+                rewards[resample], dones[resample], bootstrap_indices[resample], is_complete
+            ) = self._n_step_transitions(steps[resample], envs[resample], n_step, gamma)
+            resample = resample[~is_complete]
+            if len(resample) == 0:
+                break
+        else:
+            # uniformly samples the remaining transitions from every complete window, as rejection sampling would
+            all_steps = np.repeat(np.arange(oldest_step, self.steps_added), self.num_envs)
+            all_envs = np.tile(np.arange(self.num_envs), self.steps_added - oldest_step)
+            *_, is_complete = self._n_step_transitions(all_steps, all_envs, n_step, gamma)
+            if not np.any(is_complete):
+                raise ValueError(f"The buffer has no complete {n_step}-step transitions to sample")
+            choices = self.rng.choice(np.nonzero(is_complete)[0], size=len(resample))
+            steps[resample], envs[resample] = all_steps[choices], all_envs[choices]
+            (
+                rewards[resample], dones[resample], bootstrap_indices[resample], _
+            ) = self._n_step_transitions(steps[resample], envs[resample], n_step, gamma)
+
+        indices = (steps % self.buffer_steps) * self.num_envs + envs
+        return ReplayBufferSamples(
+            observations=self.observations[indices],
+            actions=self.actions[indices],
+            next_observations=self.next_observations[bootstrap_indices],
+            dones=dones.astype(np.float32),
+            rewards=rewards,
+            teacher_q_values=None if self.teacher_q_values is None else self.teacher_q_values[indices],
+        )
+
+    def save(self, path: str):
+        """Saves the buffer's arrays as `.npy` files within the `path` directory"""
+        os.makedirs(path, exist_ok=True)
+        for name in self._array_names():
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "lazy_n_step_buffer.json"), "w") as file:
+            json.dump({"steps_added": self.steps_added}, file)
+
+    def load(self, path: str, mmap_mode: Optional[str] = "c"):
+        """Loads the buffer's arrays saved within the `path` directory, see `ReplayBuffer.load`"""
+        for name in self._array_names():
+            array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            assert array.shape == getattr(self, name).shape and array.dtype == getattr(self, name).dtype, name
+            setattr(self, name, array)
+        with open(os.path.join(path, "lazy_n_step_buffer.json")) as file:
+            self.steps_added = json.load(file)["steps_added"]
+        self.reset()
@@ -0,0 +1,64 @@
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+
+def init_metrics(**shapes: Sequence[int]) -> Dict[str, jnp.ndarray]:
+    """The running sums of each metric, with the metric's shape, and the number of updates accumulated, `count`,
+    stored in the train state such that `update` accumulates the metrics on the device without a host sync
+
+    :param shapes: The shape of each metric, e.g., `init_metrics(loss=(), td_loss=(num_heads,))`
+    """
+    return {
+        **{name: jnp.zeros(shape, dtype=jnp.float32) for name, shape in shapes.items()},
+        "count": jnp.zeros((), dtype=jnp.int32),
+    }
+
+
+def accumulate_metrics(metrics: Dict[str, jnp.ndarray], **values: jnp.ndarray) -> Dict[str, jnp.ndarray]:
+    """Adds an update's metrics to the running sums (within a jitted function)"""
+    assert set(values) == set(metrics) - {"count"}, f"expected the metrics {set(metrics) - {'count'}}, got {set(values)}"
+    return {
+        **{name: metrics[name] + jnp.asarray(value, dtype=metrics[name].dtype) for name, value in values.items()},
+        "count": metrics["count"] + 1,
+    }
+
+
+class MetricsFlusher:
+    """Fetches the on-device running sums of `accumulate_metrics` asynchronously, such that the training loop is never
+    blocked by the metrics.
+
+    The sums are flushed with `flush` at a coarse interval, starting their copy to the host and returning the reset
+    sums for the train state. The means of the flushed metrics are collected with `results` once their copy is
+    complete, in the order flushed, as `(step, means)`.
+    """
+
+    def __init__(self):
+        self._pending = deque()
+
+    def flush(self, metrics: Dict[str, jnp.ndarray], step: int) -> Dict[str, jnp.ndarray]:
+        """Starts the copy of the running sums to the host, returning the reset sums"""
+        for value in jax.tree_util.tree_leaves(metrics):
+            value.copy_to_host_async()
+        self._pending.append((step, metrics))
+        return jax.tree_util.tree_map(jnp.zeros_like, metrics)
+
+    def results(self, wait: bool = False) -> List[Tuple[int, Dict[str, np.ndarray]]]:
+        """The means of the flushed metrics copied to the host since the last call, waiting for every flush if `wait`.
+        Flushes without any accumulated updates are skipped. The metrics of stacked train states (e.g., of several
+        seeds) are averaged by their own counts, with the leading axis of the stack."""
+        completed = []
+        while self._pending and (wait or all(value.is_ready() for value in jax.tree_util.tree_leaves(self._pending[0][1]))):
+            step, metrics = self._pending.popleft()
+            metrics = jax.device_get(metrics)
+            count = metrics.pop("count")
+            if np.all(count > 0):
+                # a stack's counts are broadcast over the trailing axes of each metric's shape
+                completed.append((step, {
+                    name: value / np.reshape(count, np.shape(count) + (1,) * (np.ndim(value) - np.ndim(count)))
+                    for name, value in metrics.items()
+                }))
+        return completed
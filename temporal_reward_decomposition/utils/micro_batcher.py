@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Batches the concurrently submitted single inputs, e.g., the observations of many clients, into a call of a
+    batched function, e.g., a jitted `QNetwork.decomposed_q_value`, in a background thread.
+
+    A batch is run once `max_batch_size` inputs are waiting or `max_latency` seconds after its first input, and
+    padded to the smallest of `batch_sizes` such that a jitted function is only compiled for those sizes (see
+    `warmup`). Each input's output is returned through a `Future`, with the batch's exception if the function raised.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[np.ndarray], Any],
+        input_shape: Tuple[int, ...],
+        input_dtype: Any,
+        max_batch_size: int = 64,
+        max_latency: float = 0.005,
+        batch_sizes: Optional[Sequence[int]] = None,
+    ):
+        """
+        :param fn: The batched function, `fn(inputs) -> outputs` with an output for each input (and padded input)
+        :param input_shape: The shape of each input
+        :param input_dtype: The dtype of the inputs, that the submitted inputs are cast to
+        :param max_batch_size: The maximum number of inputs of a batch
+        :param max_latency: The maximum seconds that an input waits for other inputs before its batch is run
+        :param batch_sizes: The padded batch sizes, by default the powers of two up to `max_batch_size`
+        """
+        self.fn = fn
+        self.input_shape = tuple(input_shape)
+        self.input_dtype = np.dtype(input_dtype)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        if batch_sizes is None:
+            batch_sizes = [2**i for i in range(max_batch_size.bit_length()) if 2**i < max_batch_size] + [max_batch_size]
+        self.batch_sizes = sorted(batch_sizes)
+        assert self.batch_sizes[-1] >= max_batch_size, "the largest batch size must fit `max_batch_size` inputs"
+
+        # the number of batches and inputs run, e.g., for the mean batch size
+        self.num_batches = 0
+        self.num_inputs = 0
+
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def warmup(self):
+        """Runs the function with each batch size, e.g., such that a jitted function is compiled before any request"""
+        for batch_size in self.batch_sizes:
+            np.asarray(self.fn(np.zeros((batch_size, *self.input_shape), dtype=self.input_dtype)))
+
+    def submit(self, x: np.ndarray) -> Future:
+        """Queues an input, returning the future of its output"""
+        assert self._thread.is_alive(), "the micro batcher is closed"
+        x = np.asarray(x, dtype=self.input_dtype)
+        if x.shape != self.input_shape:
+            raise ValueError(f"The input's shape is {x.shape} rather than {self.input_shape}")
+
+        future = Future()
+        self._requests.put((x, future))
+        return future
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """The output of a single input, waiting for its batch"""
+        return self.submit(x).result()
+
+    def _worker(self):
+        stop = False
+        while not stop:
+            request = self._requests.get()
+            if request is None:
+                break
+
+            requests = [request]
+            deadline = time.monotonic() + self.max_latency
+            while len(requests) < self.max_batch_size:
+                try:
+                    request = self._requests.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if request is None:  # run the waiting inputs before stopping
+                    stop = True
+                    break
+                requests.append(request)
+
+            batch_size = next(size for size in self.batch_sizes if size >= len(requests))
+            inputs = np.zeros((batch_size, *self.input_shape), dtype=self.input_dtype)
+            for i, (x, _) in enumerate(requests):
+                inputs[i] = x
+
+            try:
+                outputs = np.asarray(self.fn(inputs))
+            except Exception as error:  # raised by each request's `result`
+                for _, future in requests:
+                    future.set_exception(error)
+                continue
+
+            self.num_batches += 1
+            self.num_inputs += len(requests)
+            for i, (_, future) in enumerate(requests):
+                future.set_result(outputs[i])
+
+    def close(self):
+        """Runs the waiting inputs and stops the thread"""
+        self._requests.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
@@ -1,98 +1,126 @@
-from collections import deque
+from typing import Optional
 
 import numpy as np
-from stable_baselines3.common.buffers import ReplayBuffer
+
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
 
 
 class NStepReplayBuffer:
 
-    def __init__(self, buffer: ReplayBuffer, n_step: int, gamma: float):
+    def __init__(self, buffer: ReplayBuffer, n_step: int, gamma: float, num_envs: int = 1):
         self.n_step = n_step
         self.gamma = gamma
+        self.num_envs = num_envs
         self.buffer = buffer
 
         self.n_step_gamma = np.power(gamma, np.arange(n_step))  # [1, gamma, gamma^2, ..., gamma^n_step
-        # print(f'{self.gamma=}, {self.n_step=}, {self.n_step_gamma=}')
-
-        self.pre_buffer_observation_buffer = deque(maxlen=n_step)
-        self.pre_buffer_action_buffer = deque(maxlen=n_step)
-        self.pre_buffer_reward_buffer = np.zeros(self.n_step)
-        self.pre_buffer_next_observation_buffer = deque(maxlen=n_step)
-
-    def add(self, observation, next_observation, action, reward, terminated, truncated):
-        """Adds (observation, action, reward, terminated and next_observation) to the replay buffer
-
-        :param observation: The observation that the agent acted on
-        :param next_observation: The next observation resulting in the action being taken
-        :param action: The action that the agent took
-        :param reward: The reward for the action given the observation
-        :param truncated: If the environment truncated after action
-        :param terminated: If the action resulted in the environment terminating
+        # n_step_discount[p, k] = gamma^(k-p) for k >= p, such that `rewards @ n_step_discount.T` is the
+        #   discounted sum of rewards from window position p to the end of the window
+        offsets = np.arange(n_step)[None, :] - np.arange(n_step)[:, None]
+        self.n_step_discount = np.where(offsets >= 0, np.power(gamma, np.maximum(offsets, 0)), 0.0)
+
+        # per-env ring of the last n-step observations, actions and rewards, allocated on the first `add`
+        self.pre_buffer_observations = None
+        self.pre_buffer_actions = None
+        self.pre_buffer_teacher_q_values = None
+        self.pre_buffer_rewards = np.zeros((num_envs, n_step))
+        self.pre_buffer_lengths = np.zeros(num_envs, dtype=np.int64)
+        self.pre_buffer_steps = np.zeros(num_envs, dtype=np.int64)
+
+    def add(self, observation, next_observation, action, reward, terminated, truncated, teacher_q_values=None, env_ids=None):
+        """Adds a batch of (observation, action, reward, terminated and next_observation) for each env to the replay buffer
+
+        :param observation: The observations that the agent acted on, shape (num_envs, ...)
+        :param next_observation: The next observations resulting in the actions being taken, shape (num_envs, ...)
+        :param action: The actions that the agent took, shape (num_envs, ...)
+        :param reward: The rewards for the actions given the observations, shape (num_envs,)
+        :param terminated: If the actions resulted in the environments terminating, shape (num_envs,)
+        :param truncated: If the environments truncated after the actions, shape (num_envs,)
+        :param teacher_q_values: The teacher's q-values of the observations if stored, shape (num_envs, num_actions)
+        :param env_ids: The envs of the batch if only a subset of the envs stepped, i.e., an actor's envs
         """
-        assert isinstance(observation, np.ndarray)
-        assert isinstance(next_observation, np.ndarray)
-        assert isinstance(action, np.ndarray)
-        assert isinstance(reward, np.ndarray) and reward.shape == (1,)
-        assert isinstance(terminated, np.ndarray) and terminated.shape == (1,)
-        assert isinstance(truncated, np.ndarray) and truncated.shape == (1,)
-
-        index = len(self.pre_buffer_observation_buffer)
-        # print(f'{observation=}, {index=}, {terminated=}, {truncated=}')
-        if index == 0:
-            self.pre_buffer_reward_buffer[0] = reward
-        elif index == self.n_step:
-            self.pre_buffer_reward_buffer = np.roll(self.pre_buffer_reward_buffer, shift=-1)
-            self.pre_buffer_reward_buffer[-1] = reward
-        else:
-            self.pre_buffer_reward_buffer[index] = reward
-
-        # print(f'{self.pre_buffer_reward_buffer=}, {index=}')
-
-        self.pre_buffer_observation_buffer.append(observation)
-        self.pre_buffer_action_buffer.append(action)
-        self.pre_buffer_next_observation_buffer.append(next_observation)
-
-        if terminated:
-            index = len(self.pre_buffer_observation_buffer)
-            # print(f'reward buffer: {self.pre_buffer_reward_buffer}')
-            # print(f'obs buffer: {self.pre_buffer_observation_buffer}, '
-            #       f'next obs: {self.pre_buffer_next_observation_buffer}')
-            for i in range(index):
-                n_step_reward = np.sum(self.pre_buffer_reward_buffer * self.n_step_gamma)
-                # print(f'reward buffer: {self.pre_buffer_reward_buffer}, n-step: {n_step_reward}')
-                self.pre_buffer_reward_buffer[0] = 0
-                self.pre_buffer_reward_buffer = np.roll(self.pre_buffer_reward_buffer, shift=-1)
-                # print(f'updated reward buffer: {self.pre_buffer_reward_buffer}')
-                self.buffer.add(
-                    self.pre_buffer_observation_buffer[i],
-                    next_observation,
-                    self.pre_buffer_action_buffer[i],
-                    n_step_reward,
-                    True,
-                    [{}]
-                )
-
-            self.pre_buffer_observation_buffer.clear()
-            self.pre_buffer_action_buffer.clear()
-            self.pre_buffer_reward_buffer = np.zeros(self.n_step)
-            self.pre_buffer_next_observation_buffer.clear()
-        elif len(self.pre_buffer_observation_buffer) == self.n_step:
-            n_step_reward = np.sum(self.pre_buffer_reward_buffer * self.n_step_gamma)
-            # print(f'rewards: {self.pre_buffer_reward_buffer}, n-step rewards: {self.pre_buffer_reward_buffer * self.n_step_gamma}, sum: {n_step_reward}')
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids)
+        num_envs = len(env_ids)
+        assert isinstance(observation, np.ndarray) and observation.shape[0] == num_envs
+        assert isinstance(next_observation, np.ndarray) and next_observation.shape[0] == num_envs
+        assert isinstance(action, np.ndarray) and action.shape[0] == num_envs
+        assert isinstance(reward, np.ndarray) and reward.shape == (num_envs,)
+        assert isinstance(terminated, np.ndarray) and terminated.shape == (num_envs,)
+        assert isinstance(truncated, np.ndarray) and truncated.shape == (num_envs,)
+
+        if self.pre_buffer_observations is None:
+            self.pre_buffer_observations = np.zeros(
+                (self.num_envs, self.n_step) + observation.shape[1:], dtype=observation.dtype
+            )
+            self.pre_buffer_actions = np.zeros((self.num_envs, self.n_step) + action.shape[1:], dtype=action.dtype)
+        if teacher_q_values is not None and self.pre_buffer_teacher_q_values is None:
+            self.pre_buffer_teacher_q_values = np.zeros(
+                (self.num_envs, self.n_step) + teacher_q_values.shape[1:], dtype=np.float32
+            )
+
+        slots = self.pre_buffer_steps[env_ids] % self.n_step
+        self.pre_buffer_observations[env_ids, slots] = observation
+        self.pre_buffer_actions[env_ids, slots] = action
+        self.pre_buffer_rewards[env_ids, slots] = reward
+        if teacher_q_values is not None:
+            self.pre_buffer_teacher_q_values[env_ids, slots] = teacher_q_values
+        self.pre_buffer_lengths[env_ids] += 1
+        self.pre_buffer_steps[env_ids] += 1
+
+        # The ring slots ordered from oldest to newest, each env's pending transitions are the last `length` of these
+        window_slots = (self.pre_buffer_steps[env_ids, None] + np.arange(self.n_step)[None, :]) % self.n_step
+        window_positions = np.arange(self.n_step)[None, :]
+        lengths = self.pre_buffer_lengths[env_ids]
+        is_pending = window_positions >= (self.n_step - lengths)[:, None]
+
+        window_rewards = np.where(is_pending, self.pre_buffer_rewards[env_ids[:, None], window_slots], 0.0)
+        n_step_rewards = window_rewards @ self.n_step_discount.T
+
+        terminated = terminated.astype(np.bool_)
+        truncated = truncated.astype(np.bool_)
+        is_full = lengths == self.n_step
+        # terminated envs flush every pending transition, otherwise only the full n-step transition is added
+        emit = np.where(
+            terminated[:, None], is_pending, is_full[:, None] & (window_positions == 0)
+        )
+
+        batch_indices, window_indices = np.nonzero(emit)
+        if len(batch_indices) > 0:
+            envs, slots = env_ids[batch_indices], window_slots[batch_indices, window_indices]
             self.buffer.add(
-                self.pre_buffer_observation_buffer[0],
-                next_observation,
-                self.pre_buffer_action_buffer[0],
-                n_step_reward,
-                False,
-                [{}]
+                self.pre_buffer_observations[envs, slots],
+                next_observation[batch_indices],
+                self.pre_buffer_actions[envs, slots],
+                n_step_rewards[batch_indices, window_indices],
+                terminated[batch_indices],
+                None if teacher_q_values is None else self.pre_buffer_teacher_q_values[envs, slots],
             )
 
-            if truncated:
-                self.pre_buffer_observation_buffer.clear()
-                self.pre_buffer_action_buffer.clear()
-                self.pre_buffer_reward_buffer = np.zeros(self.n_step)
-                self.pre_buffer_next_observation_buffer.clear()
+        self.pre_buffer_lengths[env_ids[is_full]] = self.n_step - 1
+        self.pre_buffer_lengths[env_ids[terminated | truncated]] = 0
+
+    def size(self) -> int:
+        return self.buffer.size()
+
+    def reset(self, num_envs: Optional[int] = None):
+        """Drops the pending transitions of each env, i.e., when the environments are recreated
+
+        :param num_envs: If the number of envs changes, i.e., for the envs of several actors
+        """
+        if num_envs is not None and num_envs != self.num_envs:
+            self.num_envs = num_envs
+            self.pre_buffer_observations = self.pre_buffer_actions = self.pre_buffer_teacher_q_values = None
+            self.pre_buffer_rewards = np.zeros((num_envs, self.n_step))
+            self.pre_buffer_steps = np.zeros(num_envs, dtype=np.int64)
+        self.pre_buffer_lengths = np.zeros(self.num_envs, dtype=np.int64)
+
+    def save(self, path: str):
+        """Saves the replay buffer, the pending transitions are not saved"""
+        self.buffer.save(path)
+
+    def load(self, path: str, mmap_mode: Optional[str] = "c"):
+        self.buffer.load(path, mmap_mode)
+        self.reset()
 
     def sample(self, batch_size):
         return self.buffer.sample(batch_size)
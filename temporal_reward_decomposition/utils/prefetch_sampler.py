@@ -0,0 +1,85 @@
+import queue
+import threading
+from typing import Optional
+
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBufferSamples
+
+
+class PrefetchSampler:
+    """Samples batches from a replay buffer with a background thread, such that the next batches are assembled while
+    the current batch is being updated on.
+
+    As the buffer is sampled under the same lock as `add`, several threads couldn't sample in parallel, so a single
+    worker thread overlaps the sampling with the learner's env steps and updates (NumPy's gathers release the GIL).
+    The worker queues the buffer's own samples rather than copying them into a pool of reused arrays, such that a
+    returned batch is never written to again, e.g., while an asynchronous `jax.device_put` or update still reads it.
+    Any replay buffer with `sample(batch_size)` returning new arrays can be wrapped, with the buffer's `add` and
+    `reset` called through the sampler such that the worker doesn't sample while the buffer is modified.
+    As the batches are sampled ahead, they can miss up to the `prefetch` most recently added transitions.
+
+    With `prefetch=0`, no thread is started and `sample` samples from the buffer directly.
+    """
+
+    def __init__(self, buffer, batch_size: int, prefetch: int = 2):
+        """
+        :param buffer: The replay buffer to sample from
+        :param batch_size: The number of transitions of each batch
+        :param prefetch: The maximum number of sampled batches waiting to be used
+        """
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker_thread: Optional[threading.Thread] = None
+        self._ready_batches = queue.Queue(maxsize=max(prefetch, 1))
+
+    def add(self, *args, **kwargs):
+        with self.lock:
+            self.buffer.add(*args, **kwargs)
+
+    def reset(self, *args, **kwargs):
+        with self.lock:
+            self.buffer.reset(*args, **kwargs)
+
+    def _worker(self):
+        try:
+            while not self._stop.is_set():
+                with self.lock:
+                    samples = self.buffer.sample(self.batch_size)
+
+                while not self._stop.is_set():
+                    try:
+                        self._ready_batches.put(samples, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as error:  # raised by `sample` in the learner's thread
+            self._ready_batches.put(error)
+
+    def sample(self) -> ReplayBufferSamples:
+        """Returns the next sampled batch, waiting for the worker if no batch is ready"""
+        if self.prefetch == 0:
+            with self.lock:
+                return self.buffer.sample(self.batch_size)
+
+        if self._worker_thread is None:
+            self._worker_thread = threading.Thread(target=self._worker, daemon=True)
+            self._worker_thread.start()
+        samples = self._ready_batches.get()
+        if isinstance(samples, Exception):
+            raise samples
+        return samples
+
+    def close(self):
+        """Stops and joins the worker thread"""
+        self._stop.set()
+        if self._worker_thread is not None:
+            self._worker_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,114 @@
+import os
+from typing import Optional
+
+import numpy as np
+from gymnasium import spaces
+
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer, ReplayBufferSamples
+
+
+class SumTree:
+    """Array-backed binary tree where each node is the sum of its children, with batched updates and prefix-sum
+    searches of O(log N) that are vectorised over the batch rather than looped in Python.
+
+    The leaves are stored at `tree[capacity:2 * capacity]` with the capacity rounded up to a power of two and the
+    root at `tree[1]`.
+    """
+
+    def __init__(self, size: int):
+        self.depth = int(np.ceil(np.log2(max(size, 2))))
+        self.capacity = 2 ** self.depth
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def total(self) -> float:
+        return self.tree[1]
+
+    def __getitem__(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree[self.capacity + indices]
+
+    def update(self, indices: np.ndarray, values: np.ndarray):
+        """Sets the leaves' values, where if an index is repeated, its last value is used"""
+        nodes = self.capacity + np.asarray(indices)
+        self.tree[nodes] = values
+
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """Finds the leaf indices whose prefix sums contain the values, i.e., sum(leaves[:i]) <= value < sum(leaves[:i+1])"""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left_sums = self.tree[2 * nodes]
+            go_right = values >= left_sums
+            values = np.where(go_right, values - left_sums, values)
+            nodes = 2 * nodes + go_right
+        return nodes - self.capacity
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Replay buffer that samples transitions proportional to their priority (Schaul et al., 2016) using a `SumTree`.
+
+    New transitions are given the maximum priority seen so far, and `update_priorities` sets a transition's priority
+    from its TD error, `(|td error| + epsilon) ** alpha`. The samples include their `indices` for updating the
+    priorities and importance-sampling `weights`, `(N * P(i)) ** -beta`, normalised by the batch's maximum weight.
+    `beta` is an attribute such that it can be annealed when wrapped, e.g., by a `NStepReplayBuffer`.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Discrete,
+        seed: Optional[int] = None,
+        store_teacher_q_values: bool = False,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        epsilon: float = 1e-6,
+    ):
+        super().__init__(buffer_size, observation_space, action_space, seed, store_teacher_q_values)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+
+        self.sum_tree = SumTree(buffer_size)
+        self.max_priority = 1.0
+
+    def add(self, observations, next_observations, actions, rewards, dones, teacher_q_values=None):
+        indices = (self.pos + np.arange(len(observations))) % self.buffer_size
+        super().add(observations, next_observations, actions, rewards, dones, teacher_q_values)
+        self.sum_tree.update(indices, np.full(len(indices), self.max_priority ** self.alpha))
+
+    def sample(self, batch_size: int) -> ReplayBufferSamples:
+        """Samples a batch of transitions proportional to their priorities, stratified over the priorities' total"""
+        segment = self.sum_tree.total() / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        # floating point error can find the unfilled (zero priority) leaves past the last transition
+        indices = np.minimum(self.sum_tree.find(values), self.size() - 1)
+
+        probabilities = self.sum_tree[indices] / self.sum_tree.total()
+        weights = np.power(self.size() * probabilities, -self.beta)
+        weights = (weights / weights.max()).astype(np.float32)
+        return self._get_samples(indices)._replace(indices=indices, weights=weights)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray):
+        """Updates the priorities of sampled transitions
+
+        :param indices: The buffer indices of the transitions, i.e., the samples' `indices`
+        :param td_errors: The TD error of each transition, shape (batch,)
+        """
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.sum_tree.update(indices, np.power(priorities, self.alpha))
+
+    def save(self, path: str):
+        super().save(path)
+        np.save(os.path.join(path, "sum_tree.npy"), self.sum_tree.tree)
+
+    def load(self, path: str, mmap_mode: Optional[str] = "c"):
+        super().load(path, mmap_mode)
+        # the priorities are updated for every sampled batch, so always loaded in memory
+        self.sum_tree.tree = np.load(os.path.join(path, "sum_tree.npy"))
+        if self.size() > 0:  # otherwise, the new transitions' priority is the initial `max_priority`
+            self.max_priority = self.sum_tree[np.arange(self.size())].max() ** (1 / self.alpha)
@@ -0,0 +1,90 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+import jax
+import numpy as np
+
+
+class PhaseTimer:
+    """Times the phases of a training loop, e.g., env step, buffer add, sample and update, with the durations
+    accumulated in lists on the host and written to TensorBoard as histograms with `write`.
+
+    Each phase is also annotated for `jax.profiler` traces. As JAX dispatches asynchronously, a jitted function's
+    phase only includes its dispatch unless the phase calls `block` on its outputs with `sync` enabled, otherwise the
+    device's time is included by the next phase that waits for the outputs, e.g., a `jax.device_get`.
+    """
+
+    def __init__(self, enabled: bool = True, sync: bool = False):
+        """
+        :param enabled: If False, the phases aren't timed
+        :param sync: If `block` waits for the device, such that the phases include their device time
+        """
+        self.enabled = enabled
+        self.sync = sync
+        self.durations = defaultdict(list)
+        self.last_write = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        with jax.profiler.TraceAnnotation(name):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.durations[name].append(time.perf_counter() - start)
+
+    def block(self, outputs):
+        """Waits for the outputs to be computed if `sync`, returning the outputs"""
+        if self.enabled and self.sync:
+            jax.block_until_ready(outputs)
+        return outputs
+
+    def write(self, writer, step: int, prefix: str = "timers"):
+        """Writes each phase's durations (in milliseconds) since the last write as a histogram, and the fraction of
+        the time since the last write spent in each phase, then clears the durations"""
+        elapsed = time.perf_counter() - self.last_write
+        for name, durations in self.durations.items():
+            durations = np.array(durations)
+            writer.add_histogram(f"{prefix}/{name}_ms", 1000 * durations, step)
+            writer.add_scalar(f"{prefix}/{name}_fraction", durations.sum() / elapsed, step)
+
+        self.durations.clear()
+        self.last_write = time.perf_counter()
+
+
+class ProfilerWindow:
+    """Traces the steps within `[start, stop)` with `jax.profiler`, viewable with TensorBoard's profile plugin or Perfetto"""
+
+    def __init__(self, steps: Optional[Sequence[int]], log_dir: str):
+        """
+        :param steps: The first traced step and the step the trace is stopped at, if None then nothing is traced
+        :param log_dir: The directory the trace is written to
+        """
+        self.start, self.stop = (None, None) if steps is None else steps
+        assert self.start is None or self.start < self.stop
+        self.log_dir = log_dir
+        self.active = False
+
+    def step(self, step: int):
+        """Starts or stops the trace for the loop's step, where the loop can skip steps"""
+        if self.start is None:
+            return
+
+        if not self.active and self.start <= step < self.stop:
+            jax.profiler.start_trace(self.log_dir)
+            self.active = True
+        elif self.active and step >= self.stop:
+            self.close()
+
+    def close(self):
+        """Stops the trace if it is active, such that only a single window is traced"""
+        if self.active:
+            jax.profiler.stop_trace()
+            self.active = False
+        self.start = None
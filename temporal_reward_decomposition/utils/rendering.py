@@ -0,0 +1,175 @@
+import multiprocessing as mp
+import shutil
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+# matplotlib's default blue and red, for the positive and negative expected rewards
+POSITIVE_COLOUR = np.array([31, 119, 180], dtype=np.uint8)
+NEGATIVE_COLOUR = np.array([214, 39, 40], dtype=np.uint8)
+AXIS_COLOUR = np.array([128, 128, 128], dtype=np.uint8)
+BACKGROUND_COLOUR = np.array([255, 255, 255], dtype=np.uint8)
+# the colours of the charts' pixel indices, see `render_bar_charts`
+PALETTE = np.stack([BACKGROUND_COLOUR, POSITIVE_COLOUR, NEGATIVE_COLOUR, AXIS_COLOUR])
+
+
+def expected_reward_range(expected_rewards: np.ndarray, margin: float = 0.05) -> Tuple[float, float]:
+    """The y-axis range of the bar charts, including zero and the expected rewards, such that an episode's charts
+    share their scale"""
+    low, high = min(float(np.min(expected_rewards)), 0.0), max(float(np.max(expected_rewards)), 0.0)
+    padding = max(high - low, 1e-6) * margin
+    return low - padding if low < 0 else low, high + padding
+
+
+def render_bar_charts(
+    expected_rewards: np.ndarray, height: int, width: int, y_range: Tuple[float, float], gap: int = 1
+) -> np.ndarray:
+    """Rasterises a bar chart of each step's expected rewards, with a bar for each bin from the zero axis.
+
+    The charts of every step are drawn together with NumPy broadcasting, comparing each pixel row's value with
+    each bar's, rather than a plotting library per frame. The pixels are drawn for a single column of each bar, then
+    the columns are gathered to the chart's width.
+
+    :param expected_rewards: The expected rewards of each step, `(steps, num_bins)`
+    :param height: The height of the charts in pixels
+    :param width: The width of the charts in pixels, at least the number of bins
+    :param y_range: The expected rewards of the bottom and top pixel rows
+    :param gap: The pixels between the bars, if the bars are wider than the gap
+    :return: The RGB charts, `(steps, height, width, 3)`
+    """
+    num_bins = expected_rewards.shape[1]
+    low, high = y_range
+    # the value of each pixel row's centre and the bin (or `num_bins` for a gap) of each pixel column
+    row_values = high - (np.arange(height) + 0.5) / height * (high - low)
+    column_bins = np.arange(width) * num_bins // width
+    bar_width = width / num_bins
+    if bar_width > 2 * gap:
+        column_bins[np.arange(width) - np.floor(column_bins * bar_width).astype(int) >= bar_width - gap] = num_bins
+
+    values = expected_rewards[:, None, :]  # (steps, 1, num_bins)
+    rows = row_values[None, :, None]
+    filled = ((rows >= 0) & (rows <= values)) | ((rows < 0) & (rows >= values))  # (steps, height, num_bins)
+    pixels = np.zeros((len(expected_rewards), height, num_bins + 1), dtype=np.uint8)
+    pixels[:, :, :num_bins] = np.where(filled, np.where(values >= 0, 1, 2), 0)
+    zero_row = int(np.clip((high / (high - low)) * height, 0, height - 1))
+    pixels[:, zero_row] = np.where(pixels[:, zero_row] == 0, 3, pixels[:, zero_row])
+
+    return np.take(PALETTE[pixels], column_bins, axis=2)
+
+
+def render_frames(
+    frames: np.ndarray,
+    expected_rewards: np.ndarray,
+    y_range: Tuple[float, float],
+    scale: int = 4,
+    chart_width: Optional[int] = None,
+) -> np.ndarray:
+    """Composites each step's game frame, scaled by `scale`, and a bar chart of its expected rewards side by side
+
+    :param frames: The game frames, grayscale `(steps, height, width)` or RGB `(steps, height, width, 3)`, e.g., the
+        last frame of each observation's frame stack
+    :param expected_rewards: The expected rewards of each step, `(steps, num_bins)`
+    :param y_range: The charts' y-axis range, see `expected_reward_range`
+    :param scale: The integer scale of the frames
+    :param chart_width: The width of the charts, by default the scaled frames' height
+    :return: The RGB video frames, `(steps, height * scale, width * scale + chart_width, 3)`
+    """
+    frames = np.asarray(frames, dtype=np.uint8)
+    if frames.ndim == 3:
+        frames = frames[..., None]
+    frames = np.repeat(np.repeat(frames, scale, axis=1), scale, axis=2)
+    height, width = frames.shape[1:3]
+    chart_width = height if chart_width is None else chart_width
+
+    video_frames = np.empty((len(frames), height, width + chart_width, 3), dtype=np.uint8)
+    video_frames[:, :, :width] = frames  # grayscale frames are broadcast to RGB
+    video_frames[:, :, width:] = render_bar_charts(np.asarray(expected_rewards), height, chart_width, y_range)
+    return video_frames
+
+
+class VideoEncoder:
+    """Streams RGB frames to an `ffmpeg` process encoding an H.264 video, such that the video is never in memory"""
+
+    def __init__(self, path: str, width: int, height: int, fps: int = 30):
+        if shutil.which("ffmpeg") is None:
+            raise RuntimeError("Encoding the videos requires `ffmpeg` to be installed")
+
+        # fmt: off
+        self.process = subprocess.Popen(
+            [
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+                "-c:v", "libx264", "-pix_fmt", "yuv420p", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", path,
+            ],
+            stdin=subprocess.PIPE,
+        )
+        # fmt: on
+
+    def write(self, frames: np.ndarray):
+        self.process.stdin.write(np.ascontiguousarray(frames, dtype=np.uint8).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with {self.process.returncode}")
+
+
+def render_chunks(
+    frames: np.ndarray,
+    expected_rewards: np.ndarray,
+    y_range: Optional[Tuple[float, float]] = None,
+    chunk_size: int = 128,
+    num_workers: int = 0,
+    **kwargs,
+) -> Iterator[np.ndarray]:
+    """Renders the video frames (see `render_frames`) in chunks of `chunk_size` steps, in order, where the chunks are
+    rendered by a pool of `num_workers` (spawned) processes with at most two chunks per worker rendered ahead, such
+    that the memory is bounded for any number of steps.
+
+    :param frames: The game frames of each step
+    :param expected_rewards: The expected rewards of each step
+    :param y_range: The charts' y-axis range, by default the range of all the expected rewards
+    :param chunk_size: The number of steps of each chunk
+    :param num_workers: The number of rendering processes, if 0 then the chunks are rendered in this process
+    :param kwargs: The keyword arguments of `render_frames`
+    :return: The chunks of video frames
+    """
+    y_range = expected_reward_range(expected_rewards) if y_range is None else y_range
+    render_fn = partial(render_frames, y_range=y_range, **kwargs)
+    starts = range(0, len(frames), chunk_size)
+    if num_workers == 0:
+        for start in starts:
+            yield render_fn(frames[start : start + chunk_size], expected_rewards[start : start + chunk_size])
+        return
+
+    with ProcessPoolExecutor(num_workers, mp_context=mp.get_context("spawn")) as executor:
+        pending = deque()
+        for start in starts:
+            chunk_frames = np.asarray(frames[start : start + chunk_size])
+            chunk_expected_rewards = np.asarray(expected_rewards[start : start + chunk_size])
+            pending.append(executor.submit(render_fn, chunk_frames, chunk_expected_rewards))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def render_video(
+    path: str,
+    frames: np.ndarray,
+    expected_rewards: np.ndarray,
+    fps: int = 30,
+    **kwargs,
+):
+    """Renders and encodes an expected reward video, see `render_chunks` for the keyword arguments"""
+    encoder = None
+    for chunk in render_chunks(frames, expected_rewards, **kwargs):
+        if encoder is None:
+            encoder = VideoEncoder(path, width=chunk.shape[2], height=chunk.shape[1], fps=fps)
+        encoder.write(chunk)
+    if encoder is not None:
+        encoder.close()
@@ -0,0 +1,129 @@
+import json
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+from gymnasium import spaces
+
+
+class ReplayBufferSamples(NamedTuple):
+    observations: np.ndarray
+    actions: np.ndarray
+    next_observations: np.ndarray
+    dones: np.ndarray
+    rewards: np.ndarray
+    teacher_q_values: Optional[np.ndarray] = None
+    # the buffer indices and importance-sampling weights of prioritized samples
+    indices: Optional[np.ndarray] = None
+    weights: Optional[np.ndarray] = None
+
+
+class ReplayBuffer:
+    """Ring buffer replay storage using NumPy arrays that samples into contiguous batches.
+
+    Unlike stable-baselines3's replay buffer, no torch tensors are created, observations are kept in the
+    observation space's dtype (i.e., uint8 for Atari) and any number of transitions can be added at once.
+    Each sample is gathered into new arrays rather than reused batch arrays, as an asynchronous `jax.device_put` or
+    jitted update can still be reading the previous sample when the next is drawn.
+
+    For QDagger, the teacher's q-values of each observation can be stored such that they are computed once
+    when the transition is added rather than for each sampled batch.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        observation_space: spaces.Space,
+        action_space: spaces.Discrete,
+        seed: Optional[int] = None,
+        store_teacher_q_values: bool = False,
+    ):
+        self.buffer_size = buffer_size
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.rng = np.random.default_rng(seed)
+
+        self.pos = 0
+        self.full = False
+
+        self.observations = np.zeros((buffer_size,) + observation_space.shape, dtype=observation_space.dtype)
+        self.next_observations = np.zeros((buffer_size,) + observation_space.shape, dtype=observation_space.dtype)
+        self.actions = np.zeros((buffer_size,) + action_space.shape, dtype=action_space.dtype)
+        self.rewards = np.zeros(buffer_size, dtype=np.float32)
+        self.dones = np.zeros(buffer_size, dtype=np.float32)
+        self.teacher_q_values = np.zeros((buffer_size, action_space.n), dtype=np.float32) if store_teacher_q_values else None
+
+    def size(self) -> int:
+        return self.buffer_size if self.full else self.pos
+
+    def _array_names(self):
+        names = ["observations", "next_observations", "actions", "rewards", "dones"]
+        if self.teacher_q_values is not None:
+            names.append("teacher_q_values")
+        return names
+
+    def add(self, observations, next_observations, actions, rewards, dones, teacher_q_values=None):
+        """Adds a batch of transitions to the replay buffer, overwriting the oldest transitions once full
+
+        :param observations: The observations that the agent acted on, shape (batch, ...)
+        :param next_observations: The next observations resulting in the actions being taken, shape (batch, ...)
+        :param actions: The actions that the agent took, shape (batch, ...)
+        :param rewards: The (n-step) rewards for the actions given the observations, shape (batch,)
+        :param dones: If the transitions resulted in the environment terminating, shape (batch,)
+        :param teacher_q_values: The teacher's q-values of the observations, shape (batch, num_actions)
+        """
+        num_transitions = len(observations)
+        assert num_transitions <= self.buffer_size
+
+        if self.pos + num_transitions <= self.buffer_size:
+            indices = slice(self.pos, self.pos + num_transitions)
+        else:
+            indices = (self.pos + np.arange(num_transitions)) % self.buffer_size
+
+        self.observations[indices] = observations
+        self.next_observations[indices] = next_observations
+        self.actions[indices] = np.reshape(actions, (num_transitions,) + self.action_space.shape)
+        self.rewards[indices] = rewards
+        self.dones[indices] = dones
+        if self.teacher_q_values is not None:
+            self.teacher_q_values[indices] = teacher_q_values
+
+        self.full = self.full or self.pos + num_transitions >= self.buffer_size
+        self.pos = (self.pos + num_transitions) % self.buffer_size
+
+    def save(self, path: str):
+        """Saves the buffer's arrays as `.npy` files within the `path` directory"""
+        os.makedirs(path, exist_ok=True)
+        for name in self._array_names():
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "replay_buffer.json"), "w") as file:
+            json.dump({"pos": self.pos, "full": self.full}, file)
+
+    def load(self, path: str, mmap_mode: Optional[str] = "c"):
+        """Loads the buffer's arrays saved within the `path` directory.
+
+        By default, the arrays are memory-mapped copy-on-write, such that no data is read until sampled
+        and the added transitions are kept in memory without modifying the saved files.
+        """
+        for name in self._array_names():
+            array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            assert array.shape == getattr(self, name).shape and array.dtype == getattr(self, name).dtype, name
+            setattr(self, name, array)
+        with open(os.path.join(path, "replay_buffer.json")) as file:
+            state = json.load(file)
+        self.pos, self.full = state["pos"], state["full"]
+
+    def sample(self, batch_size: int) -> ReplayBufferSamples:
+        """Uniformly samples a batch of transitions"""
+        indices = self.rng.integers(0, self.size(), size=batch_size)
+        return self._get_samples(indices)
+
+    def _get_samples(self, indices: np.ndarray) -> ReplayBufferSamples:
+        return ReplayBufferSamples(
+            observations=np.take(self.observations, indices, axis=0),
+            actions=np.take(self.actions, indices, axis=0),
+            next_observations=np.take(self.next_observations, indices, axis=0),
+            dones=np.take(self.dones, indices, axis=0),
+            rewards=np.take(self.rewards, indices, axis=0),
+            teacher_q_values=None if self.teacher_q_values is None else np.take(self.teacher_q_values, indices, axis=0),
+        )
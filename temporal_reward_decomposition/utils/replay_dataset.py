@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Sequence
+
+
+def replay_dataset_path(dataset_dir: str, env_id: str, seed: int, teacher_model_path: str, **config) -> str:
+    """The directory of a teacher replay dataset keyed by the env, seed, teacher checkpoint and any collection config"""
+    with open(teacher_model_path, "rb") as file:
+        teacher_hash = hashlib.sha256(file.read()).hexdigest()[:12]
+    config_hash = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+    return os.path.join(dataset_dir, f"{env_id}-seed-{seed}-teacher-{teacher_hash}-{config_hash}")
+
+
+def make_teacher_buffer_config(args, names: Sequence[str], n_step_name: str = "n_step") -> Dict:
+    """The collection config of a teacher replay dataset (see `replay_dataset_path`) from a run's arguments, where a
+    lazy n-step dataset is shared by every n-step (or bin width) as the n-step transitions are computed when sampled
+
+    :param args: The run's arguments, with `lazy_n_step` and `gamma`
+    :param names: The arguments of the config
+    :param n_step_name: The argument of the n-step, only in the config of an eager n-step dataset
+    """
+    config = {name: vars(args)[name] for name in names}
+    if not args.lazy_n_step:
+        config.update(gamma=args.gamma, **{n_step_name: vars(args)[n_step_name]})
+    return config
+
+
+def save_replay_dataset(buffer, path: str, **metadata):
+    """Saves the replay buffer to `path` such that a partially written dataset is never loaded"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    buffer.save(tmp_path)
+    with open(os.path.join(tmp_path, "metadata.json"), "w") as file:
+        json.dump(metadata, file, indent=2, sort_keys=True)
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # another run saved the same dataset first
+        shutil.rmtree(tmp_path)
+
+
+def load_replay_dataset(buffer, path: str) -> bool:
+    """Loads the replay dataset at `path` into the replay buffer (memory-mapped), returning if the dataset exists"""
+    if not os.path.exists(os.path.join(path, "metadata.json")):
+        return False
+
+    buffer.load(path)
+    return True
+
+
+def save_teacher_returns(path: str, episodic_returns, **metadata):
+    """Saves the teacher's evaluation returns to the json file `path`, such that the evaluation is shared between runs"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)  # the evaluation is saved before the replay dataset
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as file:
+        json.dump({"episodic_returns": [float(r) for r in episodic_returns], **metadata}, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def load_teacher_returns(path: str) -> Optional[List[float]]:
+    """Loads the teacher's evaluation returns saved at `path`, returning None if they don't exist"""
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as file:
+        return json.load(file)["episodic_returns"]
@@ -0,0 +1,206 @@
+from functools import partial
+from typing import Any, Callable, Optional, Sequence
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+# the decomposed q-values of the parameters and a batch of observations, `(batch, actions, num_bins)`
+DecomposedQValueFn = Callable[[Any, jnp.ndarray], jnp.ndarray]
+
+SALIENCY_METHODS = ("gradient", "integrated_gradients", "perturbation")
+
+
+def greedy_actions(decomposed_fn: DecomposedQValueFn, params: Any, observations: jnp.ndarray) -> jnp.ndarray:
+    """The actions with the maximum q-value, i.e., the sum of their expected rewards"""
+    return jnp.argmax(jnp.sum(decomposed_fn(params, observations), axis=-1), axis=-1)
+
+
+def _action_rewards(decomposed_q_values: jnp.ndarray, actions: jnp.ndarray, bins: Optional[Sequence[int]]) -> jnp.ndarray:
+    """The expected rewards of each observation's action (and bins), `(batch, bins)`"""
+    expected_rewards = decomposed_q_values[jnp.arange(len(actions)), actions]
+    return expected_rewards if bins is None else expected_rewards[:, jnp.asarray(bins)]
+
+
+def bin_gradients(
+    decomposed_fn: DecomposedQValueFn,
+    params: Any,
+    observations: jnp.ndarray,
+    actions: Optional[jnp.ndarray] = None,
+    bins: Optional[Sequence[int]] = None,
+    bin_batch_size: Optional[int] = None,
+) -> jnp.ndarray:
+    """The gradients of each expected reward with respect to the observations, `(batch, bins, *observation_shape)`.
+
+    The network is evaluated once (with `jax.vjp`) then the backward pass of every bin is vectorised over the bins,
+    rather than `num_bins` separate forward and backward passes. The observations are much larger than the bins, so
+    this (reverse-mode) direction of the Jacobian is the cheaper one.
+
+    :param decomposed_fn: The decomposed q-values of the parameters and observations
+    :param params: The network parameters
+    :param observations: The batch of observations, e.g., uint8 frames that are differentiated as float32
+    :param actions: The actions of the expected rewards, by default the greedy actions
+    :param bins: The bins to differentiate, by default every bin
+    :param bin_batch_size: If set, the number of bins whose backward passes are vectorised together to bound the memory
+    """
+    observations = jnp.asarray(observations, dtype=jnp.float32)
+    if actions is None:
+        actions = greedy_actions(decomposed_fn, params, observations)
+
+    expected_rewards, vjp_fn = jax.vjp(
+        lambda obs: _action_rewards(decomposed_fn(params, obs), actions, bins), observations
+    )
+    num_bins = expected_rewards.shape[1]
+    cotangents = jnp.broadcast_to(jnp.eye(num_bins)[:, None, :], (num_bins, *expected_rewards.shape))
+
+    if bin_batch_size is None:
+        (gradients,) = jax.vmap(vjp_fn)(cotangents)
+    else:
+        (gradients,) = jax.lax.map(vjp_fn, cotangents, batch_size=bin_batch_size)
+    return jnp.swapaxes(gradients, 0, 1)
+
+
+def integrated_gradients(
+    decomposed_fn: DecomposedQValueFn,
+    params: Any,
+    observations: jnp.ndarray,
+    actions: Optional[jnp.ndarray] = None,
+    bins: Optional[Sequence[int]] = None,
+    baseline: Optional[jnp.ndarray] = None,
+    steps: int = 32,
+    bin_batch_size: Optional[int] = None,
+) -> jnp.ndarray:
+    """The integrated gradients (https://arxiv.org/abs/1703.01365) of each expected reward, `(batch, bins, *observation_shape)`,
+    such that each bin's attributions sum to (approximately) the difference in its expected reward from the baseline.
+
+    The path's gradients are summed with a `lax.scan`, such that the memory is of a single `bin_gradients`.
+
+    :param decomposed_fn: The decomposed q-values of the parameters and observations
+    :param params: The network parameters
+    :param observations: The batch of observations
+    :param actions: The actions of the expected rewards, by default the observations' greedy actions
+    :param bins: The bins to differentiate, by default every bin
+    :param baseline: The baseline observation(s), by default a black frame (zeros)
+    :param steps: The number of points of the path's (midpoint) Riemann sum
+    :param bin_batch_size: See `bin_gradients`
+    """
+    observations = jnp.asarray(observations, dtype=jnp.float32)
+    baseline = jnp.zeros_like(observations) if baseline is None else jnp.broadcast_to(baseline, observations.shape)
+    if actions is None:
+        actions = greedy_actions(decomposed_fn, params, observations)
+
+    def path_step(total, alpha):
+        path_observations = baseline + alpha * (observations - baseline)
+        return total + bin_gradients(decomposed_fn, params, path_observations, actions, bins, bin_batch_size), None
+
+    num_bins = jax.eval_shape(decomposed_fn, params, observations).shape[-1] if bins is None else len(bins)
+    total, _ = jax.lax.scan(
+        path_step, jnp.zeros((len(observations), num_bins, *observations.shape[1:])), (jnp.arange(steps) + 0.5) / steps
+    )
+    return total / steps * jnp.expand_dims(observations - baseline, 1)
+
+
+def perturbation_saliency(
+    decomposed_fn: DecomposedQValueFn,
+    params: Any,
+    observations: jnp.ndarray,
+    actions: Optional[jnp.ndarray] = None,
+    bins: Optional[Sequence[int]] = None,
+    patch_size: int = 4,
+    baseline: Optional[jnp.ndarray] = None,
+    patch_batch_size: Optional[int] = None,
+) -> jnp.ndarray:
+    """The change in each expected reward when a patch of the observations is occluded, for every patch,
+    `(batch, bins, height, width)` where each pixel is its patch's change.
+
+    The patches are `patch_size` squares of the observations' last two (spatial) axes, occluded in every channel,
+    e.g., each frame of a frame stack. Only forward passes are needed, vectorised over the patches.
+
+    :param decomposed_fn: The decomposed q-values of the parameters and observations
+    :param params: The network parameters
+    :param observations: The batch of observations, `(batch, ..., height, width)`
+    :param actions: The actions of the expected rewards, by default the observations' greedy actions
+    :param bins: The bins, by default every bin
+    :param patch_size: The height and width of the occluded patches
+    :param baseline: The occluded pixels' value(s), by default the observations' mean
+    :param patch_batch_size: If set, the number of patches whose forward passes are vectorised together to bound the memory
+    """
+    observations = jnp.asarray(observations, dtype=jnp.float32)
+    if baseline is None:
+        baseline = jnp.mean(observations, axis=(-2, -1), keepdims=True)
+    baseline = jnp.broadcast_to(baseline, observations.shape)
+    if actions is None:
+        actions = greedy_actions(decomposed_fn, params, observations)
+
+    height, width = observations.shape[-2:]
+    rows, columns = -(-height // patch_size), -(-width // patch_size)
+    expected_rewards = _action_rewards(decomposed_fn(params, observations), actions, bins)
+
+    def occluded_change(patch):
+        row, column = jnp.divmod(patch, columns)
+        mask = (jnp.arange(height)[:, None] // patch_size == row) & (jnp.arange(width)[None, :] // patch_size == column)
+        occluded = jnp.where(mask, baseline, observations)
+        return expected_rewards - _action_rewards(decomposed_fn(params, occluded), actions, bins)
+
+    changes = jax.lax.map(occluded_change, jnp.arange(rows * columns), batch_size=patch_batch_size or rows * columns)
+    changes = jnp.reshape(jnp.moveaxis(changes, 0, -1), (*expected_rewards.shape, rows, columns))
+    return jnp.repeat(jnp.repeat(changes, patch_size, axis=-2), patch_size, axis=-1)[..., :height, :width]
+
+
+def saliency_maps(
+    method: str,
+    decomposed_fn: DecomposedQValueFn,
+    params: Any,
+    observations: jnp.ndarray,
+    actions: Optional[jnp.ndarray] = None,
+    **kwargs,
+) -> jnp.ndarray:
+    """Per-bin saliency maps, `(batch, bins, height, width)`, of a saliency method for observations with a channel axis,
+    e.g., `(batch, frames, height, width)`, where the channels are reduced to a single map per bin.
+
+    The channels of the gradients are reduced by the sum of their magnitude, and of the integrated gradients by
+    their sum (keeping their completeness). The perturbation saliency is already a single map per bin.
+
+    :param method: The saliency method, "gradient", "integrated_gradients" or "perturbation"
+    :param decomposed_fn: The decomposed q-values of the parameters and observations
+    :param params: The network parameters
+    :param observations: The batch of observations
+    :param actions: The actions of the expected rewards, by default the observations' greedy actions
+    :param kwargs: The method's keyword arguments, e.g., `bins`
+    """
+    if method == "gradient":
+        return jnp.sum(jnp.abs(bin_gradients(decomposed_fn, params, observations, actions, **kwargs)), axis=2)
+    elif method == "integrated_gradients":
+        return jnp.sum(integrated_gradients(decomposed_fn, params, observations, actions, **kwargs), axis=2)
+    elif method == "perturbation":
+        return perturbation_saliency(decomposed_fn, params, observations, actions, **kwargs)
+    raise ValueError(f"Unknown saliency method {method}, expected one of {SALIENCY_METHODS}")
+
+
+def batched_saliency_maps(
+    method: str,
+    decomposed_fn: DecomposedQValueFn,
+    params: Any,
+    observations: np.ndarray,
+    actions: Optional[np.ndarray] = None,
+    batch_size: int = 32,
+    **kwargs,
+) -> np.ndarray:
+    """The `saliency_maps` of any number of observations, e.g., a whole episode, computed by a single jitted function
+    in padded batches of `batch_size` observations to bound the memory (see `map_episode_store` for an episode store).
+    """
+    if method not in SALIENCY_METHODS:
+        raise ValueError(f"Unknown saliency method {method}, expected one of {SALIENCY_METHODS}")
+
+    maps_fn = jax.jit(partial(saliency_maps, method, decomposed_fn, **kwargs))
+    maps = []
+    for start in range(0, len(observations), batch_size):
+        batch = np.asarray(observations[start : start + batch_size])
+        length = len(batch)
+        batch_actions = None if actions is None else np.asarray(actions[start : start + batch_size])
+        if length < batch_size:
+            batch = np.concatenate([batch, np.zeros((batch_size - length, *batch.shape[1:]), dtype=batch.dtype)])
+            if batch_actions is not None:
+                batch_actions = np.concatenate([batch_actions, np.zeros(batch_size - length, dtype=batch_actions.dtype)])
+        maps.append(maps_fn(params, batch, batch_actions)[:length])
+    return np.concatenate([np.asarray(batch_maps) for batch_maps in maps])
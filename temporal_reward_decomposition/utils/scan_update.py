@@ -0,0 +1,53 @@
+from typing import Any, Callable, Tuple
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+from flax.training.train_state import TrainState
+
+
+def target_network_syncs(update_steps: np.ndarray, train_frequency: int, target_network_frequency: int) -> np.ndarray:
+    """If the target network is updated after each update, i.e., a multiple of `target_network_frequency` is
+    within the steps since the previous update
+
+    :param update_steps: The global steps of the updates
+    :param train_frequency: The number of global steps between updates
+    :param target_network_frequency: The number of global steps between the target network updates
+    """
+    return update_steps // target_network_frequency != (update_steps - train_frequency) // target_network_frequency
+
+
+def scan_update(
+    update: Callable[[TrainState, Any], Tuple],
+    q_state: TrainState,
+    xs: Any,
+    sync_target: jnp.ndarray,
+    tau: float,
+) -> Tuple[Tuple, TrainState]:
+    """Runs an update for each of the stacked `xs` with `jax.lax.scan`, such that K updates are a single dispatch
+
+    :param update: The update function, `update(q_state, x) -> (*metrics, q_state)`, where `x` is a batch or sample key
+    :param q_state: The train state with `target_params`
+    :param xs: The stacked batches (or keys) with a leading axis of K
+    :param sync_target: If the target network is updated after each update, shape (K,)
+    :param tau: The target network update rate
+    :return: The stacked metrics of each update, shape (K, ...), and the updated train state
+    """
+    def body(q_state, x_and_sync):
+        x, sync = x_and_sync
+        *metrics, q_state = update(q_state, x)
+        target_params = jax.lax.cond(
+            sync,
+            lambda: optax.incremental_update(q_state.params, q_state.target_params, tau),
+            lambda: q_state.target_params,
+        )
+        return q_state.replace(target_params=target_params), tuple(metrics)
+
+    q_state, metrics = jax.lax.scan(body, q_state, (xs, sync_target))
+    return metrics, q_state
+
+
+def stack_batches(samples, num_batches: int):
+    """Reshapes a sample of `num_batches * batch_size` transitions to `num_batches` stacked batches"""
+    return jax.tree_util.tree_map(lambda x: x.reshape((num_batches, -1) + x.shape[1:]), samples)
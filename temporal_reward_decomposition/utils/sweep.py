@@ -0,0 +1,74 @@
+import os
+import subprocess
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+
+class SweepJob(NamedTuple):
+    name: str
+    command: List[str]
+    log_path: str
+    depends_on: Optional[str] = None
+
+
+def run_jobs(
+    jobs: Sequence[SweepJob],
+    max_workers: int,
+    env: Optional[Dict[str, str]] = None,
+    poll_interval: float = 1.0,
+) -> Dict[str, Optional[int]]:
+    """Runs the jobs as subprocesses with at most `max_workers` running at once, where a job is started (in order)
+    once the job it depends on has succeeded.
+
+    :param jobs: The jobs, with each job's stdout and stderr written to its `log_path`
+    :param max_workers: The maximum number of concurrently running jobs
+    :param env: The environment variables of the jobs, by default the current environment
+    :param poll_interval: The seconds between checking if the running jobs have finished
+    :return: The return code of each job, or None if the job wasn't run as the job it depends on failed
+    """
+    assert max_workers >= 1
+    names = {job.name for job in jobs}
+    assert len(names) == len(jobs), "the job names must be unique"
+    assert all(job.depends_on is None or job.depends_on in names for job in jobs)
+
+    pending, running, return_codes = list(jobs), {}, {}
+    try:
+        while pending or running:
+            for job in list(pending):
+                if job.depends_on is None or job.depends_on not in return_codes:
+                    continue
+                elif return_codes[job.depends_on] != 0:
+                    print(f"Skipping {job.name} as {job.depends_on} failed")
+                    return_codes[job.name] = None
+                    pending.remove(job)
+                elif len(running) < max_workers:
+                    running[job.name] = _start(job, env)
+                    pending.remove(job)
+            for job in list(pending):
+                if job.depends_on is None and len(running) < max_workers:
+                    running[job.name] = _start(job, env)
+                    pending.remove(job)
+
+            finished = [name for name, (process, _, _) in running.items() if process.poll() is not None]
+            for name in finished:
+                process, log_file, start_time = running.pop(name)
+                log_file.close()
+                return_codes[name] = process.returncode
+                print(f"Finished {name} with return code {process.returncode} in {time.time() - start_time:.0f} seconds")
+            if not finished:
+                time.sleep(poll_interval)
+    finally:
+        for process, log_file, _ in running.values():
+            process.terminate()
+            process.wait()
+            log_file.close()
+
+    return return_codes
+
+
+def _start(job: SweepJob, env: Optional[Dict[str, str]]):
+    print(f"Starting {job.name}")
+    os.makedirs(os.path.dirname(os.path.abspath(job.log_path)), exist_ok=True)
+    log_file = open(job.log_path, "w")
+    process = subprocess.Popen(job.command, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+    return process, log_file, time.time()
@@ -0,0 +1,51 @@
+import queue
+
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.actor_pool import ActorPool, latest_params
+
+
+def counting_actor(actor_id, params_queue, transition_queue, stop_event, num_envs):
+    """Pushes (step, params) for its envs, with the params refreshed each step"""
+    params, step = None, 0
+    while not stop_event.is_set():
+        params = latest_params(params_queue, params)
+        try:
+            transition_queue.put((actor_id, (np.full(num_envs, step), params["version"])), timeout=0.1)
+            step += 1
+        except queue.Full:
+            continue
+
+
+def failing_actor(actor_id, params_queue, transition_queue, stop_event):
+    raise ValueError("actor failed")
+
+
+def test_actor_pool(num_actors: int = 2, num_envs: int = 3):
+    with ActorPool(counting_actor, num_actors, (num_envs,), queue_size=4) as actor_pool:
+        actor_pool.update_params({"version": np.array(0)})
+
+        actor_steps = {actor_id: 0 for actor_id in range(num_actors)}
+        for _ in range(20):
+            actor_id, (steps, version) = actor_pool.get(timeout=30)
+            # each actor's transitions are received in order
+            assert np.all(steps == actor_steps[actor_id]) and version == 0
+            actor_steps[actor_id] += 1
+
+        actor_pool.update_params({"version": np.array(1)})
+        # the actors eventually use the updated params
+        versions = {actor_id: 0 for actor_id in range(num_actors)}
+        while not all(versions.values()):
+            actor_id, (_, version) = actor_pool.get(timeout=30)
+            versions[actor_id] = version
+        processes = actor_pool.processes
+
+    assert all(not process.is_alive() for process in processes)
+
+
+def test_actor_error():
+    with ActorPool(failing_actor, 1) as actor_pool:
+        actor_pool.processes[0].join(timeout=30)
+        with pytest.raises(RuntimeError, match="actor 0 exited"):
+            actor_pool.get(timeout=0.1)
@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+
+from temporal_reward_decomposition.utils.benchmark import (
+    BenchmarkResult,
+    benchmark_metadata,
+    compare_results,
+    load_results,
+    save_results,
+    time_calls,
+)
+
+
+def test_time_calls():
+    calls = []
+    durations = time_calls(lambda: (calls.append(None), time.sleep(0.005)), repeats=3, warmup=2)
+    assert len(calls) == 5 and durations.shape == (3,) and np.all(durations >= 0.005)
+
+
+def test_save_and_load_results(tmp_path):
+    results = [
+        BenchmarkResult("sample", {"buffer_size": 10_000, "batch_size": 32}, "median_latency", 0.001, "s"),
+        BenchmarkResult("n_step_add", {"n_step": 3}, "throughput", 1e6, "transitions/s", higher_is_better=True),
+    ]
+    metadata = benchmark_metadata()
+    save_results(results, str(tmp_path / "results" / "run.json"), metadata)
+
+    assert load_results(str(tmp_path / "results" / "run.json")) == results
+    assert metadata["backend"] is not None and metadata["jax"] is not None
+
+
+def test_compare_results():
+    baseline = [
+        BenchmarkResult("update", {"num_bins": 2}, "step_time", 1.0, "s"),
+        BenchmarkResult("update", {"num_bins": 4}, "step_time", 1.0, "s"),
+        BenchmarkResult("sps", {}, "sps", 100.0, "steps/s", higher_is_better=True),
+    ]
+    results = [
+        BenchmarkResult("update", {"num_bins": 2}, "step_time", 1.5, "s"),  # slower
+        BenchmarkResult("update", {"num_bins": 4}, "step_time", 0.5, "s"),  # faster
+        BenchmarkResult("update", {"num_bins": 8}, "step_time", 9.0, "s"),  # no baseline
+        BenchmarkResult("sps", {}, "sps", 50.0, "steps/s", higher_is_better=True),  # fewer steps per second
+    ]
+
+    regressions = compare_results(results, baseline, threshold=0.2)
+    assert [(result.params, change) for result, change in regressions] == [({"num_bins": 2}, 0.5), ({}, 0.5)]
+    assert compare_results(results, baseline, threshold=0.6) == []
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.compilation import aot_compile
+
+
+def test_aot_compile():
+    @jax.jit
+    def update(params, batch, coeff):
+        return params - coeff * jnp.mean(batch["x"], axis=0), jnp.sum(batch["x"])
+
+    params, batch = jnp.ones(3), {"x": np.arange(12, dtype=np.float32).reshape(4, 3)}
+    compiled_update, compile_time = aot_compile(update, params, batch, 1.0)
+    assert compile_time > 0
+
+    for coeff in [0.5, np.float64(0.25)]:
+        for expected, output in zip(update(params, batch, coeff), compiled_update(params, batch, coeff)):
+            np.testing.assert_allclose(expected, output)
+
+    # the compiled update doesn't recompile for other types
+    with pytest.raises(TypeError):
+        compiled_update(params, {"x": np.zeros((8, 3), dtype=np.float32)}, 1.0)
+    with pytest.raises(TypeError):
+        compiled_update(params, batch, 0)
+
+
+def test_enable_compilation_cache(tmp_path):
+    # run in a subprocess as the cache is initialised once per process
+    code = (
+        "import jax, jax.numpy as jnp\n"
+        "from temporal_reward_decomposition.utils.compilation import enable_compilation_cache\n"
+        f"enable_compilation_cache({str(tmp_path / 'cache')!r}, min_compile_time=0)\n"
+        "jax.jit(lambda x: jnp.tanh(x @ x.T))(jnp.ones((8, 8))).block_until_ready()\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+    assert len(os.listdir(tmp_path / "cache")) > 0
@@ -0,0 +1,103 @@
+import itertools
+
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.contrastive import (
+    action_pair_differences,
+    contrast_scores,
+    contrastive_explanations,
+    mine_contrasts,
+    top_contrasts,
+)
+
+
+@pytest.fixture
+def decomposed_q_values():
+    return np.random.default_rng(1).normal(size=(50, 4, 6)).astype(np.float32)
+
+
+def brute_force_contrasts(decomposed_q_values, score, actions=None, max_q_value_difference=None):
+    contrasts = []
+    for state, values in enumerate(decomposed_q_values):
+        if actions is None:
+            pairs = itertools.combinations(range(len(values)), 2)
+        else:
+            pairs = [(actions[state], b) for b in range(len(values)) if b != actions[state]]
+        for a, b in pairs:
+            difference = values[a] - values[b]
+            if max_q_value_difference is not None and abs(difference.sum()) > max_q_value_difference:
+                continue
+            contrasts.append((float(contrast_scores(difference, score)), state, a, b))
+    return sorted(contrasts, reverse=True)
+
+
+def test_action_pair_differences(decomposed_q_values):
+    differences = action_pair_differences(decomposed_q_values)
+    assert differences.shape == (50, 4, 4, 6)
+    np.testing.assert_allclose(differences[3, 1, 2], decomposed_q_values[3, 1] - decomposed_q_values[3, 2])
+    np.testing.assert_allclose(differences, -jnp.swapaxes(differences, 1, 2))
+
+
+def test_contrast_scores():
+    differences = jnp.array([[1.0, -1.0, 0.5], [2.0, 0.0, 0.0]])
+    np.testing.assert_allclose(contrast_scores(differences, "l1"), [2.5, 2.0])
+    np.testing.assert_allclose(contrast_scores(differences, "q_value"), [0.5, 2.0])
+    np.testing.assert_allclose(contrast_scores(differences, "timing"), [2.0, 0.0])
+    with pytest.raises(ValueError):
+        contrast_scores(differences, "l2")
+
+
+@pytest.mark.parametrize("score", ["l1", "q_value", "timing"])
+@pytest.mark.parametrize("use_actions", [False, True])
+def test_top_contrasts(decomposed_q_values, score, use_actions):
+    actions = np.random.default_rng(2).integers(0, 4, size=50) if use_actions else None
+    contrasts = top_contrasts(decomposed_q_values, 10, score=score, actions=actions)
+
+    expected = brute_force_contrasts(decomposed_q_values, score, actions)[:10]
+    np.testing.assert_allclose(contrasts.scores, [s for s, *_ in expected], rtol=1e-5)
+    pairs = zip(contrasts.states, contrasts.actions, contrasts.contrast_actions)
+    assert [(int(s), int(a), int(b)) for s, a, b in pairs] == [(state, a, b) for _, state, a, b in expected]
+
+    values = decomposed_q_values[np.asarray(contrasts.states)]
+    np.testing.assert_allclose(
+        contrasts.differences,
+        values[np.arange(10), contrasts.actions] - values[np.arange(10), contrasts.contrast_actions],
+    )
+
+
+def test_top_contrasts_filtered(decomposed_q_values):
+    contrasts = top_contrasts(decomposed_q_values, 10, score="timing", max_q_value_difference=0.5, state_offset=100)
+    expected = brute_force_contrasts(decomposed_q_values, "timing", max_q_value_difference=0.5)[:10]
+    np.testing.assert_allclose(contrasts.scores, [s for s, *_ in expected], rtol=1e-5)
+    assert np.all(np.asarray(contrasts.states) >= 100)
+    assert np.all(np.abs(np.sum(contrasts.differences, axis=-1)) <= 0.5)
+
+    # filtered (or invalid) contrasts are -inf
+    valid = np.arange(50) < 1
+    contrasts = top_contrasts(decomposed_q_values, 10, valid=valid)
+    assert np.sum(np.isfinite(contrasts.scores)) == 6 and np.all(np.asarray(contrasts.states)[:6] == 0)
+
+
+@pytest.mark.parametrize("batch_size", [7, 16, 64])
+def test_mine_contrasts(decomposed_q_values, batch_size):
+    actions = np.random.default_rng(2).integers(0, 4, size=50)
+    for kwargs in [{}, {"actions": actions, "score": "timing"}, {"max_q_value_difference": 0.5}]:
+        contrasts = mine_contrasts(decomposed_q_values, 20, batch_size=batch_size, **kwargs)
+        expected = top_contrasts(decomposed_q_values, 20, **kwargs)
+        np.testing.assert_allclose(contrasts.scores, expected.scores, rtol=1e-5)
+        np.testing.assert_array_equal(contrasts.states, expected.states)
+        np.testing.assert_allclose(contrasts.differences, expected.differences)
+
+    # fewer contrasts than k are returned without the filtered contrasts
+    contrasts = mine_contrasts(decomposed_q_values[:2], 20, batch_size=batch_size)
+    assert len(contrasts.scores) == 12 and np.all(np.isfinite(contrasts.scores))
+
+
+def test_contrastive_explanations(decomposed_q_values):
+    def decomposed_fn(params, observations):
+        return observations * params
+
+    contrasts = contrastive_explanations(decomposed_fn, 2.0, decomposed_q_values, 5, score="q_value")
+    np.testing.assert_allclose(contrasts.scores, top_contrasts(decomposed_q_values * 2.0, 5, score="q_value").scores)
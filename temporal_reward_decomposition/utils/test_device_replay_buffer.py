@@ -0,0 +1,59 @@
+from functools import partial
+
+import jax
+import numpy as np
+from gymnasium.spaces import Box, Discrete
+from temporal_reward_decomposition.utils.device_replay_buffer import DeviceFrameStackReplayBuffer, DeviceReplayBuffer
+from temporal_reward_decomposition.utils.frame_stack_buffer import FrameStackReplayBuffer
+from temporal_reward_decomposition.utils.test_frame_stack_buffer import frame_stacked_rollout
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+
+
+@partial(jax.jit, static_argnames="batch_size")
+def sample(device_buffer, key, batch_size):
+    return device_buffer.sample(key, batch_size)
+
+
+def test_sample(buffer_size: int = 20, batch_size: int = 16):
+    buffer = ReplayBuffer(buffer_size, Box(0, 255, (2, 3), dtype=np.uint8), Discrete(4))
+    timesteps = np.arange(15)
+    buffer.add(
+        observations=np.broadcast_to(timesteps[:, None, None], (15, 2, 3)),
+        next_observations=np.broadcast_to(timesteps[:, None, None] + 1, (15, 2, 3)),
+        actions=timesteps % 4,
+        rewards=timesteps,
+        dones=timesteps % 2,
+    )
+
+    device_buffer = DeviceReplayBuffer.from_replay_buffer(buffer)
+    assert device_buffer.size() == 15
+
+    samples = jax.device_get(sample(device_buffer, jax.random.PRNGKey(0), batch_size))
+    assert samples.observations.dtype == np.uint8 and samples.observations.shape == (batch_size, 2, 3)
+
+    sampled_timesteps = samples.rewards.astype(np.int64)
+    assert np.all(sampled_timesteps < 15)
+    assert np.all(samples.observations[:, 0, 0] == sampled_timesteps)
+    assert np.all(samples.next_observations[:, 0, 0] == sampled_timesteps + 1)
+    assert np.all(samples.actions == sampled_timesteps % 4)
+    assert np.all(samples.dones == sampled_timesteps % 2)
+
+
+def test_frame_stack_sample(num_envs: int = 2, timesteps: int = 30, batch_size: int = 16):
+    buffer = FrameStackReplayBuffer(64, Box(0, 255, (4, 2, 2), dtype=np.uint8), Discrete(3), 2, 0.9, num_envs)
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps):
+        buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+
+    device_buffer = DeviceFrameStackReplayBuffer.from_frame_stack_buffer(buffer)
+    samples = jax.device_get(sample(device_buffer, jax.random.PRNGKey(0), batch_size))
+    assert samples.observations.shape == samples.next_observations.shape == (batch_size, 4, 2, 2)
+
+    # every sampled transition is a transition of the host buffer
+    transitions = buffer.buffer
+    host_observations = buffer.frames[transitions.observations[:buffer.size()] % buffer.frame_buffer_size]
+    host_next_observations = buffer.frames[transitions.next_observations[:buffer.size()] % buffer.frame_buffer_size]
+    for i in range(batch_size):
+        matches = np.all(host_observations == samples.observations[i], axis=(1, 2, 3)) \
+            & np.all(host_next_observations == samples.next_observations[i], axis=(1, 2, 3)) \
+            & (transitions.rewards[:buffer.size()] == samples.rewards[i])
+        assert np.any(matches)
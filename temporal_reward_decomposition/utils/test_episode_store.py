@@ -0,0 +1,88 @@
+import json
+import os
+
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.episode_store import EpisodeStore, map_episode_store
+
+
+def make_store(path, lengths=(5, 7, 3), chunk_size=4):
+    store = EpisodeStore.create(
+        str(path), fields={"observations": ((2, 3), np.uint8), "rewards": ((), np.float32)}, chunk_size=chunk_size, env_id="test"
+    )
+    episodes = []
+    for episode, length in enumerate(lengths):
+        observations = np.random.default_rng(episode).integers(0, 255, size=(length, 2, 3), dtype=np.uint8)
+        rewards = np.arange(length, dtype=np.float32) + episode
+        store.add_episode(observations=observations, rewards=rewards, episodic_return=float(rewards.sum()))
+        episodes.append((observations, rewards))
+    return store, episodes
+
+
+def test_episode_store(tmp_path):
+    store, episodes = make_store(tmp_path / "store")
+    assert store.num_episodes == 3 and store.num_steps == 15
+    assert len(os.listdir(tmp_path / "store" / "observations")) == 4  # ceil(15 / 4) chunks
+
+    for index, (observations, rewards) in enumerate(episodes):
+        np.testing.assert_array_equal(store.episode(index, "observations"), observations)
+        np.testing.assert_array_equal(store.episode(index, "rewards"), rewards)
+        assert store.episodes[index]["episodic_return"] == float(rewards.sum())
+
+    # the steps within a chunk are a memory-mapped view
+    assert isinstance(store.read("rewards", 4, 8), np.memmap)
+    np.testing.assert_array_equal(store.read("rewards"), np.concatenate([rewards for _, rewards in episodes]))
+    assert store.read("rewards", 3, 3).shape == (0,)
+    with pytest.raises(IndexError):
+        store.read("rewards", 10, 16)
+
+    episode, step = store.locate([0, 4, 5, 11, 12, 14])
+    np.testing.assert_array_equal(episode, [0, 0, 1, 1, 2, 2])
+    np.testing.assert_array_equal(step, [0, 4, 0, 6, 0, 2])
+
+    # reopened read-only, including a field added without being written
+    store.add_field("values", (4,), np.float32)
+    store.flush()
+    reopened = EpisodeStore(str(tmp_path / "store"), mmap_mode="r")
+    assert reopened.metadata == {"env_id": "test"}
+    assert reopened.fields == store.fields
+    np.testing.assert_array_equal(reopened.episode(1, "observations"), episodes[1][0])
+    np.testing.assert_array_equal(reopened.episode(1, "values"), np.zeros((7, 4), dtype=np.float32))
+
+    with pytest.raises(FileExistsError):
+        EpisodeStore.create(str(tmp_path / "store"), fields={})
+    with pytest.raises(ValueError):
+        store.add_episode(observations=episodes[0][0], rewards=episodes[1][1])
+
+
+def test_episode_store_interrupted(tmp_path):
+    store, _ = make_store(tmp_path / "store", lengths=(5,))
+    # steps written without an episode, e.g., a crash mid-episode, aren't indexed
+    store.num_steps += 3
+    store.write("rewards", 5, np.ones(3, dtype=np.float32))
+
+    with open(tmp_path / "store" / "metadata.json") as file:
+        assert json.load(file)["num_steps"] == 5
+    assert EpisodeStore(str(tmp_path / "store")).num_steps == 5
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 6, 32])
+def test_map_episode_store(tmp_path, batch_size):
+    store, episodes = make_store(tmp_path / "store")
+
+    def fn(params, observations):
+        return jnp.sum(observations, axis=-1, dtype=jnp.float32)[..., None] * params
+
+    params = jnp.array([1.0, 2.0])
+    map_episode_store(store, fn, params, input_field="observations", output_field="values", batch_size=batch_size)
+    assert store.fields["values"] == ((2, 2), np.dtype(np.float32))
+    for index, (observations, _) in enumerate(episodes):
+        np.testing.assert_allclose(store.episode(index, "values"), np.asarray(fn(params, observations)))
+
+    # the outputs are overwritten for other parameters of the same shape
+    map_episode_store(store, fn, params * 2, input_field="observations", output_field="values", batch_size=batch_size)
+    np.testing.assert_allclose(store.episode(2, "values"), np.asarray(fn(params * 2, episodes[2][0])))
+    with pytest.raises(ValueError):
+        map_episode_store(store, fn, jnp.ones(3), input_field="observations", output_field="values")
@@ -0,0 +1,63 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.evaluator import BackgroundEvaluator, evaluate_episodes
+
+
+def make_envs(num_envs: int = 4):
+    return gym.vector.SyncVectorEnv(
+        [lambda: gym.wrappers.RecordEpisodeStatistics(gym.make("CartPole-v1")) for _ in range(num_envs)]
+    )
+
+
+def pole_policy(params, observations):
+    """Pushes the cart towards the pole's lean, where `params` flips the direction"""
+    return ((observations[:, 2] > 0) ^ params).astype(np.int64)
+
+
+def rollout_return(seed: int, params) -> float:
+    env = gym.make("CartPole-v1")
+    obs, _ = env.reset(seed=seed)
+    episodic_return, done = 0.0, False
+    while not done:
+        obs, reward, terminated, truncated, _ = env.step(int(pole_policy(params, obs[None])[0]))
+        episodic_return += reward
+        done = terminated or truncated
+    return episodic_return
+
+
+@pytest.mark.parametrize("params", [False, True])
+def test_evaluate_episodes(params: bool, num_envs: int = 4):
+    envs = make_envs(num_envs)
+    episodic_returns = evaluate_episodes(envs, pole_policy, params, seed=3)
+    # each env's episode matches running the episode on its own, with the env seeds of the vector env reset
+    np.testing.assert_array_equal(episodic_returns, [rollout_return(3 + i, params) for i in range(num_envs)])
+
+    # with epsilon = 1, the actions are random
+    random_returns = evaluate_episodes(envs, pole_policy, params, epsilon=1.0, seed=3)
+    assert random_returns.shape == (num_envs,) and not np.any(np.isnan(random_returns))
+
+
+def test_background_evaluator():
+    with BackgroundEvaluator(make_envs, pole_policy, seed=3) as evaluator:
+        for step, params in enumerate([False, True, False]):
+            evaluator.submit(params, step, "offline")
+        results = evaluator.results(wait=True)
+        assert evaluator.results() == []
+
+    assert [(step, tag) for step, tag, _ in results] == [(0, "offline"), (1, "offline"), (2, "offline")]
+    # each evaluation is of fresh episodes, with the envs' seeds offset by the evaluation's index
+    np.testing.assert_array_equal(results[0][2], evaluate_episodes(make_envs(), pole_policy, False, seed=3))
+    np.testing.assert_array_equal(results[2][2], evaluate_episodes(make_envs(), pole_policy, False, seed=3 + 2 * 4))
+    assert not np.array_equal(results[0][2], results[2][2])
+
+
+def test_background_evaluator_error():
+    def failing_policy(params, observations):
+        raise ValueError("policy failed")
+
+    evaluator = BackgroundEvaluator(make_envs, failing_policy)
+    evaluator.submit(None, 0)
+    with pytest.raises(ValueError, match="policy failed"):
+        evaluator.close()
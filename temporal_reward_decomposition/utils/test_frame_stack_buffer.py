@@ -0,0 +1,174 @@
+import numpy as np
+from gymnasium.spaces import Box, Discrete
+from temporal_reward_decomposition.utils.frame_stack_buffer import FrameStackReplayBuffer
+from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+import pytest
+
+
+def frame_stacked_rollout(num_envs: int, timesteps: int, stack_size: int = 4, seed: int = 0):
+    """Generates frame stacked observations like `gym.wrappers.FrameStack` with each frame's value unique"""
+    rng = np.random.default_rng(seed)
+    terminated = rng.random((timesteps, num_envs)) < 0.05
+    truncated = rng.random((timesteps, num_envs)) < 0.02
+
+    frame_id = 1
+    stacks = np.zeros((num_envs, stack_size, 2, 2), dtype=np.uint8)
+    for env in range(num_envs):
+        stacks[env] = frame_id % 256
+        frame_id += 1
+
+    rollout = []
+    for t in range(timesteps):
+        observations = stacks.copy()
+        next_observations = np.concatenate([stacks[:, 1:], np.zeros((num_envs, 1, 2, 2), dtype=np.uint8)], axis=1)
+        for env in range(num_envs):
+            next_observations[env, -1] = frame_id % 256
+            frame_id += 1
+        rollout.append((observations, next_observations, rng.integers(0, 3, num_envs), rng.random(num_envs).astype(np.float32), terminated[t], truncated[t]))
+
+        stacks = next_observations.copy()
+        for env in np.nonzero(terminated[t] | truncated[t])[0]:
+            stacks[env] = frame_id % 256  # reset observation repeats the first frame
+            frame_id += 1
+    return rollout
+
+
+@pytest.mark.parametrize("n_step", [1, 3])
+@pytest.mark.parametrize("num_envs", [1, 4])
+def test_matches_replay_buffer(n_step: int, num_envs: int, timesteps: int = 50, buffer_size: int = 64):
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    frame_buffer = FrameStackReplayBuffer(
+        buffer_size, observation_space, Discrete(3), n_step, 0.9, num_envs, seed=1, store_teacher_q_values=True
+    )
+    reference_buffer = NStepReplayBuffer(
+        ReplayBuffer(buffer_size, observation_space, Discrete(3), seed=1, store_teacher_q_values=True), n_step, 0.9, num_envs
+    )
+
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps):
+        teacher_q_values = observations[:, -1, 0, :1].astype(np.float32) + np.arange(3, dtype=np.float32)
+        frame_buffer.add(observations, next_observations, actions, rewards, terminated, truncated, teacher_q_values)
+        reference_buffer.add(observations, next_observations, actions, rewards, terminated, truncated, teacher_q_values)
+
+    assert frame_buffer.size() == reference_buffer.buffer.size()
+    # each transition costs roughly a single frame
+    assert frame_buffer.frames_added < 1.25 * timesteps * num_envs
+
+    for _ in range(5):
+        samples, expected = frame_buffer.sample(32), reference_buffer.sample(32)
+        for field in samples._fields:
+            assert np.all(getattr(samples, field) == getattr(expected, field)), field
+        # the teacher's q-values are of the transition's observation
+        assert np.all(samples.teacher_q_values[:, 0] == samples.observations[:, -1, 0, 0])
+
+
+def test_reset(num_envs: int = 2, timesteps: int = 20, buffer_size: int = 128):
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    frame_buffer = FrameStackReplayBuffer(buffer_size, observation_space, Discrete(3), 3, 0.9, num_envs, seed=1)
+    reference_buffer = NStepReplayBuffer(ReplayBuffer(buffer_size, observation_space, Discrete(3), seed=1), 3, 0.9, num_envs)
+
+    # the environments are recreated between the rollouts, so the pending transitions are dropped
+    for seed in range(2):
+        for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps, seed=seed):
+            frame_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+            reference_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        frame_buffer.reset()
+        reference_buffer.reset()
+
+    assert frame_buffer.size() == reference_buffer.buffer.size()
+    samples, expected = frame_buffer.sample(64), reference_buffer.sample(64)
+    for field in samples._fields:
+        assert np.all(getattr(samples, field) == getattr(expected, field)), field
+
+
+@pytest.mark.parametrize("n_step", [1, 3])
+def test_lazy_n_step(n_step: int, num_envs: int = 2, timesteps: int = 50, buffer_size: int = 128):
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    frame_buffer = FrameStackReplayBuffer(buffer_size, observation_space, Discrete(3), n_step, 0.9, num_envs, seed=1, lazy_n_step=True)
+    reference_buffer = NStepReplayBuffer(ReplayBuffer(buffer_size, observation_space, Discrete(3)), n_step, 0.9, num_envs)
+
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps):
+        frame_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        reference_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+
+    def transitions(samples):
+        return {
+            (obs.tobytes(), next_obs.tobytes(), round(float(reward), 4), bool(done))
+            for obs, next_obs, reward, done in zip(samples.observations, samples.next_observations, samples.rewards, samples.dones)
+        }
+
+    expected = transitions(reference_buffer.buffer._get_samples(np.arange(reference_buffer.size())))
+    assert transitions(frame_buffer.sample(4_000)) == expected
+
+
+@pytest.mark.parametrize("lazy_n_step", [False, True])
+def test_stale_frames(lazy_n_step: bool, num_envs: int = 2, timesteps: int = 100, buffer_size: int = 64):
+    # without any slack, the reset observations' extra frames overwrite the oldest transitions' frames
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    frame_buffer = FrameStackReplayBuffer(
+        buffer_size, observation_space, Discrete(3), 2, 0.9, num_envs, frame_buffer_slack=0, seed=1, lazy_n_step=lazy_n_step
+    )
+    reference_buffer = NStepReplayBuffer(ReplayBuffer(buffer_size, observation_space, Discrete(3)), 2, 0.9, num_envs)
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps):
+        frame_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        reference_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+
+    transitions = frame_buffer.n_step_buffer if lazy_n_step else frame_buffer.buffer
+    oldest_frame = frame_buffer.frames_added - frame_buffer.frame_buffer_size
+    assert np.any(transitions.observations[:frame_buffer.size(), 0] < oldest_frame)
+
+    # only the transitions with every frame are sampled
+    def observation_pairs(samples):
+        return {(obs.tobytes(), next_obs.tobytes()) for obs, next_obs in zip(samples.observations, samples.next_observations)}
+
+    expected = reference_buffer.buffer._get_samples(np.arange(reference_buffer.size()))
+    assert observation_pairs(frame_buffer.sample(256)) <= observation_pairs(expected)
+
+    frame_buffer.frames_added += frame_buffer.frame_buffer_size  # every frame is overwritten
+    with pytest.raises(ValueError, match="increase `frame_buffer_slack`"):
+        frame_buffer.sample(8)
+
+
+def test_lazy_n_step_load(tmp_path, num_envs: int = 2, timesteps: int = 50, buffer_size: int = 128):
+    # a lazy dataset saved for a bin width (n-step) is loaded for another
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    saved_buffer = FrameStackReplayBuffer(buffer_size, observation_space, Discrete(3), 2, 0.9, num_envs, seed=1, lazy_n_step=True)
+    reference_buffer = NStepReplayBuffer(ReplayBuffer(buffer_size, observation_space, Discrete(3)), 4, 0.9, num_envs)
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps):
+        saved_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        reference_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+    saved_buffer.save(str(tmp_path))
+
+    frame_buffer = FrameStackReplayBuffer(buffer_size, observation_space, Discrete(3), 4, 0.9, num_envs, seed=1, lazy_n_step=True)
+    frame_buffer.load(str(tmp_path))
+
+    samples = frame_buffer.sample(4_000)
+    expected = reference_buffer.buffer._get_samples(np.arange(reference_buffer.size()))
+    assert {(obs.tobytes(), round(float(reward), 4)) for obs, reward in zip(samples.observations, samples.rewards)} == {
+        (obs.tobytes(), round(float(reward), 4)) for obs, reward in zip(expected.observations, expected.rewards)
+    }
+
+
+def test_actor_env_ids(num_actors: int = 3, num_envs: int = 2, timesteps: int = 30, buffer_size: int = 256):
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    frame_buffer = FrameStackReplayBuffer(buffer_size, observation_space, Discrete(3), 3, 0.9, num_envs, seed=1)
+    reference_buffer = NStepReplayBuffer(ReplayBuffer(buffer_size, observation_space, Discrete(3), seed=1), 3, 0.9, num_envs)
+    # the actors' envs are added after the buffer is filled by a single set of envs
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, timesteps):
+        frame_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        reference_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+    frame_buffer.reset(num_envs * num_actors)
+    reference_buffer.reset(num_envs * num_actors)
+
+    rng = np.random.default_rng(0)
+    rollouts = [frame_stacked_rollout(num_envs, timesteps, seed=actor + 1) for actor in range(num_actors)]
+    while any(rollouts):
+        actor = rng.choice([actor for actor, rollout in enumerate(rollouts) if rollout])
+        env_ids = actor * num_envs + np.arange(num_envs)
+        frame_buffer.add(*rollouts[actor][0], env_ids=env_ids)
+        reference_buffer.add(*rollouts[actor].pop(0), env_ids=env_ids)
+
+    assert frame_buffer.size() == reference_buffer.size()
+    samples, expected = frame_buffer.sample(64), reference_buffer.sample(64)
+    for field in samples._fields:
+        assert np.all(getattr(samples, field) == getattr(expected, field)), field
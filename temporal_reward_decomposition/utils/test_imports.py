@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+import jax
+import numpy as np
+
+from temporal_reward_decomposition.models import MultiHeadQNetwork, QNetwork, head_params
+
+
+def test_lightweight_imports():
+    # run in a subprocess such that the modules imported by other tests aren't included
+    code = (
+        "import os, sys\n"
+        "import temporal_reward_decomposition.models, temporal_reward_decomposition.envs\n"
+        "import temporal_reward_decomposition.dqn_trd, temporal_reward_decomposition.dqn_trd_qdagger\n"
+        "import temporal_reward_decomposition.dqn_atari_trd_qdagger, temporal_reward_decomposition.explain_trd\n"
+        "heavy = {'torch', 'stable_baselines3', 'cleanrl', 'cleanrl_utils'} & {name.split('.')[0] for name in sys.modules}\n"
+        "assert not heavy, heavy\n"
+        "assert 'XLA_PYTHON_CLIENT_MEM_FRACTION' not in os.environ\n"
+    )
+    env = {key: value for key, value in os.environ.items() if key != "XLA_PYTHON_CLIENT_MEM_FRACTION"}
+    subprocess.run([sys.executable, "-c", code], check=True, env=env)
+
+
+def test_head_params():
+    observations = np.random.default_rng(1).integers(0, 255, size=(2, 4, 84, 84), dtype=np.uint8)
+    multi_head_network = MultiHeadQNetwork(action_dim=3, num_bins=(2, 4))
+    params = multi_head_network.init(jax.random.PRNGKey(1), observations)
+
+    # each head's parameters are a `QNetwork`'s with the head's q-values
+    for head, num_bins in enumerate((2, 4)):
+        q_network = QNetwork(action_dim=3, num_bins=num_bins)
+        np.testing.assert_allclose(
+            q_network.apply(head_params(params, head), observations, method=QNetwork.decomposed_q_value),
+            multi_head_network.apply(params, observations, method=MultiHeadQNetwork.decomposed_q_value)[head],
+            rtol=1e-5,
+        )
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from gymnasium.spaces import Box, Discrete
+
+from temporal_reward_decomposition.utils.lazy_n_step_buffer import LazyNStepReplayBuffer
+from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+
+
+def rollout(num_envs: int, timesteps: int, seed: int = 0):
+    """Random transitions where each observation is unique, the next observation is (observation + 1)"""
+    rng = np.random.default_rng(seed)
+    observations = np.arange(timesteps * num_envs).reshape(timesteps, num_envs) * 2
+    rewards = rng.normal(size=(timesteps, num_envs)).astype(np.float32)
+    terminated = rng.random((timesteps, num_envs)) < 0.1
+    truncated = ~terminated & (rng.random((timesteps, num_envs)) < 0.05)
+    actions = rng.integers(0, 2, size=(timesteps, num_envs))
+    return observations, actions, rewards, terminated, truncated
+
+
+def sampled_transitions(samples):
+    return {
+        (int(obs), int(next_obs), round(float(reward), 4), bool(done))
+        for obs, next_obs, reward, done in zip(samples.observations[:, 0], samples.next_observations[:, 0], samples.rewards, samples.dones)
+    }
+
+
+@pytest.mark.parametrize("num_envs", [1, 3])
+def test_matches_n_step_buffer(num_envs: int, timesteps: int = 40):
+    observations, actions, rewards, terminated, truncated = rollout(num_envs, timesteps)
+    observation_space = Box(0, np.iinfo(np.int64).max, (1,), dtype=np.int64)
+    action_space = Discrete(2)
+
+    lazy_buffer = LazyNStepReplayBuffer(timesteps * num_envs, observation_space, action_space, 1, 0.9, num_envs, seed=0)
+    n_step_buffers = {
+        (n_step, gamma): NStepReplayBuffer(ReplayBuffer(timesteps * num_envs, observation_space, action_space), n_step, gamma, num_envs)
+        for n_step in (1, 3, 5) for gamma in (0.9, 0.99)
+    }
+    for t in range(timesteps):
+        for buffer in [lazy_buffer, *n_step_buffers.values()]:
+            buffer.add(
+                observations[t][:, None], observations[t][:, None] + 1, actions[t], rewards[t], terminated[t], truncated[t]
+            )
+
+    for (n_step, gamma), n_step_buffer in n_step_buffers.items():
+        expected = sampled_transitions(n_step_buffer.buffer._get_samples(np.arange(n_step_buffer.size())))
+        actual = sampled_transitions(lazy_buffer.sample(5_000, n_step=n_step, gamma=gamma))
+        assert actual == expected
+
+
+def test_reset_and_save(tmp_path, num_envs: int = 2, timesteps: int = 20):
+    observations, actions, rewards, terminated, truncated = rollout(num_envs, timesteps, seed=1)
+    observation_space = Box(0, np.iinfo(np.int64).max, (1,), dtype=np.int64)
+
+    lazy_buffer = LazyNStepReplayBuffer(timesteps * num_envs, observation_space, Discrete(2), 3, 0.9, num_envs, seed=0)
+    n_step_buffer = NStepReplayBuffer(ReplayBuffer(timesteps * num_envs, observation_space, Discrete(2)), 3, 0.9, num_envs)
+    for t in range(timesteps):
+        for buffer in (lazy_buffer, n_step_buffer):
+            buffer.add(
+                observations[t][:, None], observations[t][:, None] + 1, actions[t], rewards[t], terminated[t], truncated[t]
+            )
+            # the environments are recreated partway through
+            if t == timesteps // 2:
+                buffer.reset()
+
+    lazy_buffer.save(str(tmp_path))
+    loaded_buffer = LazyNStepReplayBuffer(timesteps * num_envs, observation_space, Discrete(2), 3, 0.9, num_envs, seed=0)
+    loaded_buffer.load(str(tmp_path))
+
+    expected = sampled_transitions(n_step_buffer.buffer._get_samples(np.arange(n_step_buffer.size())))
+    assert sampled_transitions(lazy_buffer.sample(2_000)) == expected
+    assert sampled_transitions(loaded_buffer.sample(2_000)) == expected
+
+
+def test_incomplete_windows(num_envs: int = 2, timesteps: int = 40, n_step: int = 5):
+    observation_space = Box(0, np.iinfo(np.int64).max, (1,), dtype=np.int64)
+    lazy_buffer = LazyNStepReplayBuffer(timesteps * num_envs, observation_space, Discrete(2), n_step, 0.9, num_envs, seed=0)
+    n_step_buffer = NStepReplayBuffer(ReplayBuffer(timesteps * num_envs, observation_space, Discrete(2)), n_step, 0.9, num_envs)
+
+    # the episodes are truncated before any n-step window completes, except for the last episode's termination
+    observations = np.arange(timesteps * num_envs).reshape(timesteps, num_envs) * 2
+    terminated = np.zeros((timesteps, num_envs), dtype=np.bool_)
+    truncated = np.zeros((timesteps, num_envs), dtype=np.bool_)
+    truncated[1::2] = True
+    terminated[-1, 0], truncated[-1, 0] = True, False
+    for t in range(timesteps):
+        for buffer in (lazy_buffer, n_step_buffer):
+            buffer.add(
+                observations[t][:, None], observations[t][:, None] + 1, np.zeros(num_envs), np.ones(num_envs, dtype=np.float32),
+                terminated[t], truncated[t],
+            )
+
+    expected = sampled_transitions(n_step_buffer.buffer._get_samples(np.arange(n_step_buffer.size())))
+    assert len(expected) == 2 and sampled_transitions(lazy_buffer.sample(64)) == expected
+
+    # without a complete window, e.g., the environments are recreated before `n_step` steps
+    lazy_buffer = LazyNStepReplayBuffer(timesteps * num_envs, observation_space, Discrete(2), n_step, 0.9, num_envs, seed=0)
+    for t in range(2):
+        lazy_buffer.add(
+            observations[t][:, None], observations[t][:, None] + 1, np.zeros(num_envs), np.ones(num_envs, dtype=np.float32),
+            np.zeros(num_envs, dtype=np.bool_), np.zeros(num_envs, dtype=np.bool_),
+        )
+    lazy_buffer.reset()
+    with pytest.raises(ValueError, match="no complete 5-step transitions"):
+        lazy_buffer.sample(64)
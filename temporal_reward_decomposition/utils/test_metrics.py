@@ -0,0 +1,64 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.metrics import MetricsFlusher, accumulate_metrics, init_metrics
+
+
+def test_accumulate_metrics():
+    metrics = init_metrics(loss=(), td_loss=(2,))
+
+    @jax.jit
+    def update(metrics, loss):
+        return accumulate_metrics(metrics, loss=loss, td_loss=jnp.stack([loss, 2 * loss]))
+
+    for loss in [1.0, 2.0, 3.0]:
+        metrics = update(metrics, loss)
+    assert metrics["count"] == 3 and metrics["loss"] == 6
+    np.testing.assert_allclose(metrics["td_loss"], [6, 12])
+
+    # the accumulated metrics must match the initial metrics
+    with pytest.raises(AssertionError):
+        accumulate_metrics(metrics, loss=1.0)
+
+
+def test_accumulate_metrics_scan():
+    # the metrics are carried through a scan with the same shapes and dtypes
+    def body(metrics, loss):
+        return accumulate_metrics(metrics, loss=loss), None
+
+    metrics, _ = jax.lax.scan(body, init_metrics(loss=()), jnp.arange(4.0))
+    assert metrics["count"] == 4 and metrics["loss"] == 6
+
+
+def test_metrics_flusher():
+    flusher = MetricsFlusher()
+    metrics = init_metrics(loss=(), q_values=())
+    for step in range(1, 7):
+        metrics = accumulate_metrics(metrics, loss=float(step), q_values=1.0)
+        if step % 3 == 0:
+            metrics = flusher.flush(metrics, step)
+            # the returned metrics are reset
+            assert metrics["count"] == 0 and metrics["loss"] == 0
+    # a flush without any updates is skipped
+    flusher.flush(metrics, 7)
+
+    results = flusher.results(wait=True)
+    assert [step for step, _ in results] == [3, 6]
+    assert results[0][1] == {"loss": 2, "q_values": 1} and results[1][1] == {"loss": 5, "q_values": 1}
+    assert flusher.results(wait=True) == []
+
+
+def test_metrics_flusher_stacked():
+    # the metrics of the train states of several seeds, stacked and updated with a vmap
+    metrics = jax.tree_util.tree_map(lambda *xs: jnp.stack(xs), *[init_metrics(loss=(), td_loss=(2,))] * 3)
+    update = jax.vmap(lambda metrics, loss: accumulate_metrics(metrics, loss=loss, td_loss=jnp.stack([loss, 2 * loss])))
+    for step in range(1, 5):
+        metrics = update(metrics, jnp.arange(3.0) + step)
+
+    flusher = MetricsFlusher()
+    flusher.flush(metrics, 4)
+    ((step, means),) = flusher.results(wait=True)
+    np.testing.assert_allclose(means["loss"], [2.5, 3.5, 4.5])
+    np.testing.assert_allclose(means["td_loss"], [[2.5, 5], [3.5, 7], [4.5, 9]])
@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.micro_batcher import MicroBatcher
+
+
+def test_micro_batcher():
+    batch_shapes = []
+
+    def fn(inputs):
+        batch_shapes.append(inputs.shape)
+        return inputs.sum(axis=-1) * 2
+
+    inputs = np.random.default_rng(1).normal(size=(100, 3)).astype(np.float32)
+    outputs = [None] * len(inputs)
+    with MicroBatcher(fn, (3,), np.float32, max_batch_size=16, max_latency=0.05) as batcher:
+        assert batcher.batch_sizes == [1, 2, 4, 8, 16]
+
+        def client(i):
+            outputs[i] = batcher(inputs[i])
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(len(inputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    np.testing.assert_allclose(np.array(outputs), inputs.sum(axis=-1) * 2, rtol=1e-6)
+    # the concurrent inputs are batched, and padded to the batch sizes
+    assert batcher.num_inputs == 100 and batcher.num_batches < 100
+    assert all(batch_size in (1, 2, 4, 8, 16) and shape == 3 for batch_size, shape in batch_shapes)
+
+
+def test_micro_batcher_latency():
+    with MicroBatcher(lambda x: x + 1, (), np.int64, max_batch_size=4, max_latency=0.01, batch_sizes=[4]) as batcher:
+        # a single input is run once the latency has passed, padded to the only batch size
+        assert batcher(1) == 2
+        futures = [batcher.submit(i) for i in range(10)]
+        assert [future.result() for future in futures] == list(range(1, 11))
+        assert batcher.num_batches >= 4
+
+
+def test_micro_batcher_errors():
+    def fn(inputs):
+        if np.any(inputs < 0):
+            raise ValueError("negative input")
+        return inputs
+
+    with MicroBatcher(fn, (2,), np.float32, max_latency=0.01) as batcher:
+        with pytest.raises(ValueError, match="shape"):
+            batcher.submit(np.zeros(3))
+        with pytest.raises(ValueError, match="negative input"):
+            batcher(np.array([-1.0, 0.0]))
+        # the batcher continues after an error
+        np.testing.assert_array_equal(batcher(np.array([1.0, 2.0])), [1.0, 2.0])
+
+
+def test_micro_batcher_warmup():
+    batch_sizes = []
+
+    def fn(inputs):
+        batch_sizes.append(len(inputs))
+        return inputs
+
+    with MicroBatcher(fn, (2,), np.uint8, max_batch_size=6) as batcher:
+        batcher.warmup()
+    assert batch_sizes == [1, 2, 4, 6]
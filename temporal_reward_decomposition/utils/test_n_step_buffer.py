@@ -1,99 +1,136 @@
 import numpy as np
 from gymnasium.spaces import Discrete
 from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
-from stable_baselines3.common.buffers import ReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
 import pytest
 
 
-@pytest.mark.parametrize("n_step", [1, 3, 5])
-def test_non_terminating(n_step: int, timesteps: int = 10):
-    buffer = ReplayBuffer(timesteps, Discrete(timesteps), Discrete(timesteps))
-    n_step_buffer = NStepReplayBuffer(buffer, n_step, 0.9)
+def expected_transitions(observations, rewards, terminated, truncated, n_step, gamma):
+    """Naively computes the n-step transitions of a single env, ordered by (emit timestep, observation)"""
+    transitions = []
+    for start in range(len(observations)):
+        end = start
+        while end < start + n_step - 1 and not (terminated[end] or truncated[end]) and end + 1 < len(observations):
+            end += 1
 
-    for i in range(timesteps+n_step-1):
-        n_step_buffer.add(
-            observation=np.array([i]),
-            action=np.array([i]),
-            next_observation=np.array([i+1]),
-            reward=i+1,
-            terminated=False,
-            truncated=False
-        )
+        if end == start + n_step - 1 or terminated[end]:
+            n_step_reward = sum(gamma ** k * rewards[start + k] for k in range(end - start + 1))
+            transitions.append((end, observations[start], observations[end] + 1, n_step_reward, bool(terminated[end])))
+    return sorted(transitions, key=lambda transition: transition[0])
 
-    print()
-    for i in range(timesteps):
-        print(f'o={buffer.observations[i]}, '
-              f'a={buffer.actions[i]}, '
-              f"o'={buffer.next_observations[i]}, "
-              f'r={buffer.rewards[i]}, '
-              f't={buffer.dones[i]}, ')
 
-    # samples = buffer._get_samples(np.arange(timesteps))
-    # assert np.all(samples.observations.numpy() == np.array([[0], [1], [2], [3], [4], [5], [6], [7], [8], [9]]))
-    # assert np.all(samples.actions.numpy() == np.array([[0], [1], [2], [3], [4], [5], [6], [7], [8], [9]]))
-    # assert samples.next_observations == np.arange(timesteps)
-    # assert samples.rewards == np.arange(timesteps)
-    # assert samples.dones == np.zeros(timesteps, dtype=np.bool_)
+def buffer_transitions(buffer: ReplayBuffer):
+    return [
+        (buffer.observations[i], buffer.next_observations[i], buffer.rewards[i], bool(buffer.dones[i]))
+        for i in range(buffer.size())
+    ]
 
 
-@pytest.mark.parametrize("n_step", [1, 3, 5])
-def test_terminating(n_step: int, timesteps: int = 10):
-    """MISSING OBS=9"""
-    buffer = ReplayBuffer(timesteps, Discrete(timesteps), Discrete(timesteps))
-    n_step_buffer = NStepReplayBuffer(buffer, n_step, 0.9)
+def run_single_env(n_step: int, terminated, truncated, gamma: float = 0.9):
+    timesteps = len(terminated)
+    buffer = ReplayBuffer(timesteps, Discrete(timesteps + 1), Discrete(timesteps + 1))
+    n_step_buffer = NStepReplayBuffer(buffer, n_step, gamma)
 
     for i in range(timesteps):
         n_step_buffer.add(
             observation=np.array([i]),
             action=np.array([i]),
             next_observation=np.array([i+1]),
-            reward=i+1,
-            terminated=i == 6 or i == 9,
-            truncated=False
+            reward=np.array([i+1], dtype=np.float32),
+            terminated=np.array([terminated[i]]),
+            truncated=np.array([truncated[i]]),
         )
 
-    print()
-    for i in range(timesteps):
-        print(f'o={buffer.observations[i]}, '
-              f'a={buffer.actions[i]}, '
-              f"o'={buffer.next_observations[i]}, "
-              f'r={buffer.rewards[i]}, '
-              f't={buffer.dones[i]}, ')
+    expected = expected_transitions(np.arange(timesteps), np.arange(1, timesteps + 1), terminated, truncated, n_step, gamma)
+    actual = buffer_transitions(buffer)
+    assert len(actual) == len(expected)
+    for (obs, next_obs, reward, done), (_, expected_obs, expected_next_obs, expected_reward, expected_done) in zip(actual, expected):
+        assert obs == expected_obs and next_obs == expected_next_obs and done == expected_done
+        assert reward == pytest.approx(expected_reward, rel=1e-5)
+
+
+@pytest.mark.parametrize("n_step", [1, 3, 5])
+def test_non_terminating(n_step: int, timesteps: int = 10):
+    run_single_env(n_step, np.zeros(timesteps + n_step - 1, dtype=np.bool_), np.zeros(timesteps + n_step - 1, dtype=np.bool_))
+
 
-    # samples = buffer._get_samples(np.arange(timesteps))
-    # assert samples.observations == np.arange(timesteps)
-    # assert samples.actions == np.arange(timesteps)
-    # assert samples.next_observations == np.arange(timesteps)
-    # assert samples.rewards == np.arange(timesteps)
-    # assert samples.dones == np.array([False, False, False, False, False, True, False, False, False])
+@pytest.mark.parametrize("n_step", [1, 3, 5])
+def test_terminating(n_step: int, timesteps: int = 10):
+    terminated = np.isin(np.arange(timesteps), [6, 9])
+    run_single_env(n_step, terminated, np.zeros(timesteps, dtype=np.bool_))
 
 
 @pytest.mark.parametrize("n_step", [1, 2, 3])
 def test_truncating(n_step: int, timesteps: int = 10):
-    buffer = ReplayBuffer(timesteps, Discrete(timesteps), Discrete(timesteps))
-    n_step_buffer = NStepReplayBuffer(buffer, n_step, 0.9)
+    truncated = np.isin(np.arange(timesteps), [6, 9])
+    run_single_env(n_step, np.zeros(timesteps, dtype=np.bool_), truncated)
+
+
+@pytest.mark.parametrize("n_step", [1, 3, 5])
+@pytest.mark.parametrize("num_envs", [2, 4])
+def test_vectorized(n_step: int, num_envs: int, timesteps: int = 40, gamma: float = 0.9):
+    rng = np.random.default_rng(n_step + num_envs)
+    observations = np.arange(timesteps)[:, None] * num_envs + np.arange(num_envs)[None, :]
+    rewards = rng.integers(0, 5, size=(timesteps, num_envs)).astype(np.float32)
+    terminated = rng.random((timesteps, num_envs)) < 0.1
+    truncated = rng.random((timesteps, num_envs)) < 0.05
 
-    for i in range(10):
+    capacity = timesteps * num_envs
+    buffer = ReplayBuffer(capacity, Discrete(capacity + num_envs), Discrete(capacity + num_envs))
+    n_step_buffer = NStepReplayBuffer(buffer, n_step, gamma, num_envs=num_envs)
+    for i in range(timesteps):
         n_step_buffer.add(
-            observation=np.array([i]),
-            action=np.array([i]),
-            next_observation=np.array([i+1]),
-            reward=i+1,
-            terminated=False,
-            truncated=i == 6 or i == 9,
+            observation=observations[i],
+            action=observations[i],
+            next_observation=observations[i] + num_envs,
+            reward=rewards[i],
+            terminated=terminated[i],
+            truncated=truncated[i],
         )
 
-    print()
+    # each env's transitions are emitted in the order of the timestep they complete on, then by env
+    expected = []
+    for env in range(num_envs):
+        # the next observation of the env at timestep i is i * num_envs + env + num_envs == observations[i, env] + num_envs
+        for end, obs, _, reward, done in expected_transitions(
+            observations[:, env], rewards[:, env], terminated[:, env], truncated[:, env], n_step, gamma
+        ):
+            expected.append((end, env, obs, observations[end, env] + num_envs, reward, done))
+    expected = sorted(expected, key=lambda transition: transition[:3])
+
+    actual = buffer_transitions(buffer)
+    assert len(actual) == len(expected)
+    for (obs, next_obs, reward, done), (_, _, expected_obs, expected_next_obs, expected_reward, expected_done) in zip(actual, expected):
+        assert obs == expected_obs and next_obs == expected_next_obs and done == expected_done
+        assert reward == pytest.approx(expected_reward, rel=1e-5)
+
+
+@pytest.mark.parametrize("n_step", [1, 3])
+def test_env_ids(n_step: int, num_actors: int = 3, num_envs: int = 2, timesteps: int = 30, gamma: float = 0.9):
+    """Adding the envs of each actor separately and out of step gives the same transitions as adding every env together"""
+    rng = np.random.default_rng(n_step)
+    total_envs = num_actors * num_envs
+    observations = np.arange(timesteps)[:, None] * total_envs + np.arange(total_envs)[None, :]
+    rewards = rng.integers(0, 5, size=(timesteps, total_envs)).astype(np.float32)
+    terminated = rng.random((timesteps, total_envs)) < 0.1
+    truncated = rng.random((timesteps, total_envs)) < 0.05
+
+    capacity = timesteps * total_envs
+    buffers = [ReplayBuffer(capacity, Discrete(capacity + total_envs), Discrete(capacity + total_envs)) for _ in range(2)]
+    together = NStepReplayBuffer(buffers[0], n_step, gamma, num_envs=1)
+    together.reset(num_envs=total_envs)
+    separate = NStepReplayBuffer(buffers[1], n_step, gamma, num_envs=total_envs)
+
+    actor_steps = np.zeros(num_actors, dtype=np.int64)
     for i in range(timesteps):
-        print(f'o={buffer.observations[i]}, '
-              f'a={buffer.actions[i]}, '
-              f"o'={buffer.next_observations[i]}, "
-              f'r={buffer.rewards[i]}, '
-              f't={buffer.dones[i]}, ')
-
-    # samples = buffer._get_samples(np.arange(timesteps))
-    # assert samples.observations == np.arange(timesteps)
-    # assert samples.actions == np.arange(timesteps)
-    # assert samples.next_observations == np.arange(timesteps)
-    # assert samples.rewards == np.arange(timesteps)
-    # assert samples.dones == np.zeros(timesteps, dtype=np.bool_)
+        together.add(observations[i], observations[i] + total_envs, observations[i], rewards[i], terminated[i], truncated[i])
+    while np.any(actor_steps < timesteps):
+        actor = rng.choice(np.nonzero(actor_steps < timesteps)[0])
+        i, env_ids = actor_steps[actor], actor * num_envs + np.arange(num_envs)
+        separate.add(
+            observations[i, env_ids], observations[i, env_ids] + total_envs, observations[i, env_ids], rewards[i, env_ids],
+            terminated[i, env_ids], truncated[i, env_ids], env_ids=env_ids,
+        )
+        actor_steps[actor] += 1
+
+    assert sorted(buffer_transitions(buffers[1]), key=lambda t: t[0]) == sorted(buffer_transitions(buffers[0]), key=lambda t: t[0])
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from gymnasium.spaces import Box, Discrete
+
+from temporal_reward_decomposition.utils.prefetch_sampler import PrefetchSampler
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+
+
+def make_buffer(buffer_size: int = 256, num_transitions: int = 100):
+    buffer = ReplayBuffer(buffer_size, Box(0, np.inf, (2,)), Discrete(3), seed=0, store_teacher_q_values=True)
+    add_transitions(buffer, 0, num_transitions)
+    return buffer
+
+
+def add_transitions(buffer, start: int, num_transitions: int):
+    observations = np.repeat(np.arange(start, start + num_transitions, dtype=np.float32)[:, None], 2, axis=1)
+    buffer.add(
+        observations, observations + 1, observations[:, 0].astype(np.int64) % 3, observations[:, 0], np.zeros(num_transitions),
+        np.repeat(observations[:, :1], 3, axis=1),
+    )
+
+
+def next_transition(index: int):
+    observation = np.full((1, 2), index, dtype=np.float32)
+    return observation, observation + 1, np.array([index % 3]), np.array([index], dtype=np.float32), np.zeros(1), np.full((1, 3), index)
+
+
+def assert_valid(samples, num_transitions: int):
+    assert np.all(samples.next_observations == samples.observations + 1)
+    assert np.all(samples.rewards == samples.observations[:, 0])
+    assert np.all(samples.teacher_q_values == samples.observations[:, :1])
+    assert np.all(samples.observations < num_transitions)
+
+
+@pytest.mark.parametrize("prefetch", [0, 1, 4])
+def test_sample(prefetch: int, batch_size: int = 32):
+    with PrefetchSampler(make_buffer(), batch_size, prefetch) as sampler:
+        for _ in range(20):
+            samples = sampler.sample()
+            assert samples.observations.shape == (batch_size, 2)
+            assert_valid(samples, 100)
+
+
+def test_add_while_sampling(batch_size: int = 16):
+    with PrefetchSampler(make_buffer(), batch_size, prefetch=2) as sampler:
+        for step in range(20):
+            sampler.add(*next_transition(100 + step))
+            assert_valid(sampler.sample(), 100 + step + 1)
+        worker = sampler._worker_thread
+    assert not worker.is_alive()
+
+
+def test_worker_error():
+    class FailingBuffer:
+        def sample(self, batch_size):
+            raise RuntimeError("sample failed")
+
+    with PrefetchSampler(FailingBuffer(), 8, prefetch=2) as sampler:
+        with pytest.raises(RuntimeError, match="sample failed"):
+            sampler.sample()
+
+
+def test_batches_not_reused(batch_size: int = 32):
+    # a batch stays valid after the next samples, e.g., while its device transfer or update is in flight
+    with PrefetchSampler(make_buffer(), batch_size, prefetch=2) as sampler:
+        samples = sampler.sample()
+        expected = [None if array is None else array.copy() for array in samples]
+        for _ in range(20):
+            sampler.sample()
+    assert all(np.array_equal(array, copy) for array, copy in zip(samples, expected) if array is not None)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from gymnasium.spaces import Box, Discrete
+
+from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.prioritized_replay_buffer import PrioritizedReplayBuffer, SumTree
+
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1000])
+def test_sum_tree(size: int):
+    rng = np.random.default_rng(size)
+    tree = SumTree(size)
+    leaves = np.zeros(size)
+    for _ in range(3):
+        indices = rng.choice(size, size=max(size // 2, 1), replace=False)
+        values = rng.random(len(indices))
+        tree.update(indices, values)
+        leaves[indices] = values
+
+    assert tree.total() == pytest.approx(leaves.sum())
+    np.testing.assert_allclose(tree[np.arange(size)], leaves)
+
+    prefix_values = rng.random(100) * leaves.sum()
+    np.testing.assert_array_equal(tree.find(prefix_values), np.searchsorted(np.cumsum(leaves), prefix_values, side="right"))
+
+
+def make_buffer(buffer_size: int = 100, num_transitions: int = 50, **kwargs):
+    buffer = PrioritizedReplayBuffer(buffer_size, Box(0, np.inf, (1,)), Discrete(2), seed=0, **kwargs)
+    observations = np.arange(num_transitions, dtype=np.float32)[:, None]
+    buffer.add(observations, observations + 1, np.zeros(num_transitions), np.zeros(num_transitions), np.zeros(num_transitions))
+    return buffer
+
+
+def test_sample_proportional(batch_size: int = 1_000):
+    buffer = make_buffer(alpha=1.0, beta=1.0, epsilon=0.0)
+    priorities = np.arange(1, 51, dtype=np.float64)
+    buffer.update_priorities(np.arange(50), priorities)
+
+    counts = np.zeros(50)
+    for _ in range(100):
+        samples = buffer.sample(batch_size)
+        assert np.all(samples.observations[:, 0] == samples.indices)
+        counts += np.bincount(samples.indices, minlength=50)
+
+        # with beta = 1, the weights are inversely proportional to the priorities
+        sampled_priorities = priorities[samples.indices]
+        np.testing.assert_allclose(samples.weights, sampled_priorities.min() / sampled_priorities, rtol=1e-5)
+
+    np.testing.assert_allclose(counts / counts.sum(), priorities / priorities.sum(), atol=2e-3)
+
+
+def test_new_transitions_max_priority():
+    buffer = make_buffer(alpha=1.0, epsilon=0.0)
+    buffer.update_priorities(np.arange(10), np.full(10, 5.0))
+    buffer.add(np.full((1, 1), 50.0), np.full((1, 1), 51.0), np.zeros(1), np.zeros(1), np.zeros(1))
+    assert buffer.sum_tree[np.array([50])] == 5.0
+    assert buffer.size() == 51 and np.all(buffer.sample(256).indices < 51)
+
+
+def test_n_step_and_save(tmp_path):
+    buffer = PrioritizedReplayBuffer(64, Box(0, np.inf, (1,)), Discrete(2), seed=0)
+    n_step_buffer = NStepReplayBuffer(buffer, 3, 0.9)
+    for t in range(40):
+        n_step_buffer.add(np.full((1, 1), t), np.full((1, 1), t + 1), np.zeros(1), np.ones(1, dtype=np.float32), np.zeros(1, dtype=np.bool_), np.zeros(1, dtype=np.bool_))
+    samples = n_step_buffer.sample(16)
+    assert samples.weights.shape == (16,) and samples.weights.max() == 1.0
+    buffer.update_priorities(samples.indices, np.linspace(0, 2, 16))
+
+    n_step_buffer.save(str(tmp_path))
+    loaded_buffer = PrioritizedReplayBuffer(64, Box(0, np.inf, (1,)), Discrete(2), seed=0)
+    loaded_buffer.load(str(tmp_path))
+    np.testing.assert_array_equal(loaded_buffer.sum_tree.tree, buffer.sum_tree.tree)
+    assert loaded_buffer.max_priority == pytest.approx(buffer.max_priority)
+
+
+def test_save_empty(tmp_path):
+    PrioritizedReplayBuffer(64, Box(0, np.inf, (1,)), Discrete(2)).save(str(tmp_path))
+    loaded_buffer = PrioritizedReplayBuffer(64, Box(0, np.inf, (1,)), Discrete(2))
+    loaded_buffer.load(str(tmp_path))
+    assert loaded_buffer.size() == 0 and loaded_buffer.max_priority == 1.0
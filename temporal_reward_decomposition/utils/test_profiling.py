@@ -0,0 +1,71 @@
+import os
+import time
+from collections import defaultdict
+
+import jax.numpy as jnp
+import pytest
+
+from temporal_reward_decomposition.utils.profiling import PhaseTimer, ProfilerWindow
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.histograms, self.scalars = defaultdict(list), defaultdict(list)
+
+    def add_histogram(self, tag, values, step):
+        self.histograms[tag].append((values, step))
+
+    def add_scalar(self, tag, value, step):
+        self.scalars[tag].append((value, step))
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    for _ in range(3):
+        with timer.phase("sleep"):
+            time.sleep(0.01)
+        with timer.phase("update"):
+            timer.block(jnp.ones(4) * 2)
+    assert len(timer.durations["sleep"]) == 3 and min(timer.durations["sleep"]) >= 0.01
+
+    writer = RecordingWriter()
+    timer.write(writer, 10, "timers/online")
+    values, step = writer.histograms["timers/online/sleep_ms"][0]
+    assert step == 10 and len(values) == 3 and values.min() >= 10
+    assert 0 < writer.scalars["timers/online/sleep_fraction"][0][0] <= 1
+    assert set(writer.histograms) == {"timers/online/sleep_ms", "timers/online/update_ms"}
+
+    # the durations are cleared by writing
+    assert len(timer.durations) == 0
+    timer.write(writer, 20)
+    assert len(writer.histograms["timers/online/sleep_ms"]) == 1
+
+
+def test_disabled_phase_timer():
+    timer = PhaseTimer(enabled=False, sync=True)
+    with timer.phase("sleep"):
+        pass
+    assert len(timer.durations) == 0
+
+
+def test_phase_timer_exception():
+    timer = PhaseTimer()
+    with pytest.raises(ValueError):
+        with timer.phase("failing"):
+            raise ValueError()
+    assert len(timer.durations["failing"]) == 1
+
+
+def test_profiler_window(tmp_path):
+    window = ProfilerWindow((2, 4), str(tmp_path))
+    for step in range(0, 8, 3):  # the loop's steps skip the window's start
+        window.step(step)
+        assert window.active == (step == 3)
+        jnp.ones(4).sum().block_until_ready()
+    window.close()
+    assert len(os.listdir(tmp_path)) > 0
+
+    # nothing is traced without a window
+    window = ProfilerWindow(None, str(tmp_path / "none"))
+    window.step(0)
+    assert not window.active and not os.path.exists(tmp_path / "none")
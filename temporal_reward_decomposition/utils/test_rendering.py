@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.utils.rendering import (
+    AXIS_COLOUR,
+    BACKGROUND_COLOUR,
+    NEGATIVE_COLOUR,
+    POSITIVE_COLOUR,
+    expected_reward_range,
+    render_bar_charts,
+    render_chunks,
+    render_frames,
+    render_video,
+)
+
+
+def test_expected_reward_range():
+    assert expected_reward_range(np.array([[0.5, 1.0]]), margin=0) == (0.0, 1.0)
+    assert expected_reward_range(np.array([[-1.0, 1.0]]), margin=0.5) == (-2.0, 2.0)
+    assert expected_reward_range(np.array([[-1.0, -0.5]]), margin=0) == (-1.0, 0.0)
+
+
+def test_render_bar_charts():
+    charts = render_bar_charts(np.array([[1.0, -0.5], [0.0, 0.5]]), height=8, width=8, y_range=(-1.0, 1.0))
+    assert charts.shape == (2, 8, 8, 3) and charts.dtype == np.uint8
+
+    # the first bin's bar is columns 0 to 2 (column 3 is a gap), from the zero axis (row 4) to the top
+    np.testing.assert_array_equal(charts[0, :4, :3], np.broadcast_to(POSITIVE_COLOUR, (4, 3, 3)))
+    np.testing.assert_array_equal(charts[0, :4, 3], np.broadcast_to(BACKGROUND_COLOUR, (4, 3)))
+    np.testing.assert_array_equal(charts[0, 4, :4], np.broadcast_to(AXIS_COLOUR, (4, 3)))
+    np.testing.assert_array_equal(charts[0, 5:, :3], np.broadcast_to(BACKGROUND_COLOUR, (3, 3, 3)))
+    # the second bin's bar is down to -0.5 (rows 4 and 5)
+    np.testing.assert_array_equal(charts[0, 4:6, 4:7], np.broadcast_to(NEGATIVE_COLOUR, (2, 3, 3)))
+    np.testing.assert_array_equal(charts[0, :4, 4:7], np.broadcast_to(BACKGROUND_COLOUR, (4, 3, 3)))
+    np.testing.assert_array_equal(charts[0, 6:, 4:7], np.broadcast_to(BACKGROUND_COLOUR, (2, 3, 3)))
+
+    # without any bars, the zero axis is drawn
+    np.testing.assert_array_equal(charts[1, 4, :3], np.broadcast_to(AXIS_COLOUR, (3, 3)))
+    np.testing.assert_array_equal(charts[1, 2:4, 4:7], np.broadcast_to(POSITIVE_COLOUR, (2, 3, 3)))
+
+
+def test_render_frames():
+    frames = np.random.default_rng(1).integers(0, 255, size=(3, 6, 5), dtype=np.uint8)
+    expected_rewards = np.random.default_rng(2).normal(size=(3, 4))
+    video_frames = render_frames(frames, expected_rewards, y_range=(-3.0, 3.0), scale=2, chart_width=10)
+    assert video_frames.shape == (3, 12, 20, 3)
+
+    np.testing.assert_array_equal(video_frames[:, ::2, :10:2, 0], frames)
+    np.testing.assert_array_equal(video_frames[:, 1::2, 1:10:2, 2], frames)
+    np.testing.assert_array_equal(video_frames[:, :, 10:], render_bar_charts(expected_rewards, 12, 10, (-3.0, 3.0)))
+
+    rgb_frames = np.random.default_rng(1).integers(0, 255, size=(3, 6, 5, 3), dtype=np.uint8)
+    np.testing.assert_array_equal(render_frames(rgb_frames, expected_rewards, (-3.0, 3.0), scale=1)[:, :, :5], rgb_frames)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_render_chunks(num_workers):
+    frames = np.random.default_rng(1).integers(0, 255, size=(50, 84, 84), dtype=np.uint8)
+    expected_rewards = np.random.default_rng(2).normal(size=(50, 8))
+
+    chunks = list(render_chunks(frames, expected_rewards, chunk_size=8, num_workers=num_workers))
+    assert [len(chunk) for chunk in chunks] == [8] * 6 + [2]
+    np.testing.assert_array_equal(
+        np.concatenate(chunks), render_frames(frames, expected_rewards, expected_reward_range(expected_rewards))
+    )
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_render_video(tmp_path):
+    frames = np.random.default_rng(1).integers(0, 255, size=(20, 84, 84), dtype=np.uint8)
+    expected_rewards = np.random.default_rng(2).normal(size=(20, 8))
+    render_video(str(tmp_path / "video.mp4"), frames, expected_rewards, chunk_size=8)
+    assert os.path.getsize(tmp_path / "video.mp4") > 0
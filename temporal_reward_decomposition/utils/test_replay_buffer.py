@@ -0,0 +1,67 @@
+import jax
+import numpy as np
+from gymnasium.spaces import Box, Discrete
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+import pytest
+
+
+def add_timesteps(buffer: ReplayBuffer, start: int, end: int):
+    timesteps = np.arange(start, end)
+    buffer.add(
+        observations=np.broadcast_to(timesteps[:, None, None], (len(timesteps),) + buffer.observation_space.shape),
+        next_observations=np.broadcast_to(timesteps[:, None, None] + 1, (len(timesteps),) + buffer.observation_space.shape),
+        actions=timesteps % buffer.action_space.n,
+        rewards=timesteps,
+        dones=timesteps % 2,
+    )
+
+
+@pytest.mark.parametrize("batch_sizes", [[3], [1, 4, 2], [7, 7, 7]])
+def test_wrap_around(batch_sizes, buffer_size: int = 10):
+    buffer = ReplayBuffer(buffer_size, Box(0, 255, (2, 3), dtype=np.uint8), Discrete(4))
+
+    added = 0
+    for batch_size in batch_sizes:
+        add_timesteps(buffer, added, added + batch_size)
+        added += batch_size
+
+    assert buffer.size() == min(added, buffer_size)
+    assert buffer.pos == added % buffer_size
+    # the buffer contains the last `buffer_size` timesteps
+    stored = np.sort(buffer.observations[:buffer.size(), 0, 0])
+    assert np.all(stored == np.arange(max(added - buffer_size, 0), added))
+
+
+def test_sample(buffer_size: int = 20, batch_size: int = 8):
+    buffer = ReplayBuffer(buffer_size, Box(0, 255, (2, 3), dtype=np.uint8), Discrete(4), seed=1)
+    add_timesteps(buffer, 0, 15)
+
+    samples = buffer.sample(batch_size)
+    assert samples.observations.dtype == np.uint8 and samples.observations.shape == (batch_size, 2, 3)
+    assert samples.observations.flags.c_contiguous
+    assert samples.rewards.shape == samples.dones.shape == samples.actions.shape == (batch_size,)
+
+    timesteps = samples.rewards.astype(np.int64)
+    assert np.all(timesteps < 15)
+    assert np.all(samples.observations[:, 0, 0] == timesteps)
+    assert np.all(samples.next_observations[:, 0, 0] == timesteps + 1)
+    assert np.all(samples.actions == timesteps % 4)
+    assert np.all(samples.dones == timesteps % 2)
+
+
+def test_sample_while_transferring(buffer_size: int = 1000, batch_size: int = 256):
+    # the transfers aren't blocked on before resampling, as in the training loops
+    buffer = ReplayBuffer(buffer_size, Box(0, 255, (84, 84), dtype=np.uint8), Discrete(4), seed=1)
+    add_timesteps(buffer, 0, 200)
+
+    samples = buffer.sample(batch_size)
+    expected = jax.tree_util.tree_map(np.copy, samples)
+    device_samples = jax.device_put(samples)
+    observation_sums = jax.jit(lambda x: x.observations.sum(axis=(1, 2)))(samples)
+    for _ in range(10):
+        buffer.sample(batch_size)
+
+    # the resampling doesn't overwrite the first batch, whose transfer and update might not have read it yet
+    assert all(np.array_equal(x, y) for x, y in zip(samples, expected) if x is not None)
+    assert all(np.array_equal(x, y) for x, y in zip(jax.device_get(device_samples), expected) if x is not None)
+    assert np.all(np.asarray(observation_sums) == expected.rewards * 84 * 84)
@@ -0,0 +1,99 @@
+import os
+from argparse import Namespace
+
+import numpy as np
+from gymnasium.spaces import Box, Discrete
+from temporal_reward_decomposition.utils.frame_stack_buffer import FrameStackReplayBuffer
+from temporal_reward_decomposition.utils.n_step_buffer import NStepReplayBuffer
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBuffer
+from temporal_reward_decomposition.utils.replay_dataset import (
+    load_replay_dataset,
+    load_teacher_returns,
+    make_teacher_buffer_config,
+    replay_dataset_path,
+    save_replay_dataset,
+    save_teacher_returns,
+)
+from temporal_reward_decomposition.utils.test_frame_stack_buffer import frame_stacked_rollout
+
+
+def make_buffers(frame_stack: bool, num_envs: int = 2):
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+    if frame_stack:
+        return [FrameStackReplayBuffer(128, observation_space, Discrete(3), 2, 0.9, num_envs, seed=1) for _ in range(2)]
+    return [NStepReplayBuffer(ReplayBuffer(128, observation_space, Discrete(3), seed=1), 2, 0.9, num_envs) for _ in range(2)]
+
+
+def test_dataset_path(tmp_path):
+    teacher_model_path = tmp_path / "teacher.cleanrl_model"
+    teacher_model_path.write_bytes(b"params")
+
+    path = replay_dataset_path(str(tmp_path), "PongNoFrameskip-v4", 1, str(teacher_model_path), bin_width=1)
+    assert path == replay_dataset_path(str(tmp_path), "PongNoFrameskip-v4", 1, str(teacher_model_path), bin_width=1)
+    assert path != replay_dataset_path(str(tmp_path), "PongNoFrameskip-v4", 1, str(teacher_model_path), bin_width=2)
+
+    teacher_model_path.write_bytes(b"other params")
+    assert path != replay_dataset_path(str(tmp_path), "PongNoFrameskip-v4", 1, str(teacher_model_path), bin_width=1)
+
+
+def test_lazy_n_step_handoff(tmp_path, num_envs: int = 2, bin_widths=(1, 3)):
+    # as `sweep_trd_qdagger`, a teacher job collects the lazy dataset at the first bin width for every bin width's students
+    teacher_model_path = tmp_path / "teacher.cleanrl_model"
+    teacher_model_path.write_bytes(b"params")
+    observation_space = Box(0, 255, (4, 2, 2), dtype=np.uint8)
+
+    def run(bin_width: int, lazy_n_step: bool = True):
+        args = Namespace(num_envs=num_envs, buffer_size=128, lazy_n_step=lazy_n_step, gamma=0.9, bin_width=bin_width)
+        config = make_teacher_buffer_config(args, ("num_envs", "buffer_size", "lazy_n_step"), "bin_width")
+        buffer = FrameStackReplayBuffer(
+            args.buffer_size, observation_space, Discrete(3), bin_width, 0.9, num_envs, seed=1, lazy_n_step=lazy_n_step
+        )
+        return buffer, replay_dataset_path(str(tmp_path), "PongNoFrameskip-v4", 1, str(teacher_model_path), **config)
+
+    teacher_buffer, path = run(bin_widths[0])
+    for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, 30):
+        teacher_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+    save_replay_dataset(teacher_buffer, path, env_id="test")
+
+    for bin_width in bin_widths:
+        student_buffer, student_path = run(bin_width)
+        assert student_path == path and load_replay_dataset(student_buffer, student_path)
+        assert student_buffer.sample(32).observations.shape == (32, 4, 2, 2)
+    # the eager n-step datasets are collected for each bin width
+    assert run(bin_widths[0], lazy_n_step=False)[1] != run(bin_widths[1], lazy_n_step=False)[1]
+
+
+def test_save_load(tmp_path, num_envs: int = 2):
+    for frame_stack in [False, True]:
+        buffer, loaded_buffer = make_buffers(frame_stack, num_envs)
+        path = str(tmp_path / f"dataset-{frame_stack}")
+        assert not load_replay_dataset(loaded_buffer, path)
+
+        for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, 30):
+            buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        save_replay_dataset(buffer, path, env_id="test")
+        assert load_replay_dataset(loaded_buffer, path)
+
+        samples, loaded_samples = buffer.sample(32), loaded_buffer.sample(32)
+        for field in samples._fields:
+            assert np.all(getattr(samples, field) == getattr(loaded_samples, field)), field
+
+        # adding to the loaded buffer doesn't modify the saved dataset
+        for observations, next_observations, actions, rewards, terminated, truncated in frame_stacked_rollout(num_envs, 30, seed=1):
+            loaded_buffer.add(observations, next_observations, actions, rewards, terminated, truncated)
+        _, reloaded_buffer = make_buffers(frame_stack, num_envs)
+        assert load_replay_dataset(reloaded_buffer, path)
+        buffer.buffer.rng, reloaded_buffer.buffer.rng = np.random.default_rng(0), np.random.default_rng(0)
+        samples, reloaded_samples = buffer.sample(32), reloaded_buffer.sample(32)
+        for field in samples._fields:
+            assert np.all(getattr(samples, field) == getattr(reloaded_samples, field)), field
+
+
+def test_teacher_returns(tmp_path):
+    # the dataset directory is created by the first save
+    path = str(tmp_path / "datasets" / "teacher-eval.json")
+    assert load_teacher_returns(path) is None
+
+    save_teacher_returns(path, np.array([1.0, 2.5], dtype=np.float32), env_id="test")
+    assert load_teacher_returns(path) == [1.0, 2.5]
+    assert not any(name.startswith("teacher-eval.json.tmp") for name in os.listdir(tmp_path / "datasets"))
@@ -0,0 +1,135 @@
+from functools import partial
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.models import QNetwork
+from temporal_reward_decomposition.utils.saliency import (
+    batched_saliency_maps,
+    bin_gradients,
+    integrated_gradients,
+    perturbation_saliency,
+    saliency_maps,
+)
+
+
+def linear_decomposed_fn(params, observations):
+    return jnp.einsum("bchw,akchw->bak", observations / 255.0, params)
+
+
+def tanh_decomposed_fn(params, observations):
+    return jnp.tanh(linear_decomposed_fn(params, observations))
+
+
+@pytest.fixture
+def params():
+    return jax.random.normal(jax.random.PRNGKey(1), (3, 4, 2, 6, 6))
+
+
+@pytest.fixture
+def observations():
+    return np.random.default_rng(1).integers(0, 255, size=(5, 2, 6, 6), dtype=np.uint8)
+
+
+def test_bin_gradients():
+    q_network = QNetwork(action_dim=3, num_bins=4)
+    observations = np.random.default_rng(1).integers(0, 255, size=(2, 4, 84, 84), dtype=np.uint8)
+    params = q_network.init(jax.random.PRNGKey(1), observations)
+    decomposed_fn = partial(q_network.apply, method=QNetwork.decomposed_q_value)
+
+    actions = jnp.array([2, 0])
+    gradients = jax.jit(partial(bin_gradients, decomposed_fn))(params, observations, actions)
+    assert gradients.shape == (2, 4, 4, 84, 84)
+
+    # the same as a backward pass of each bin
+    @jax.jit
+    def bin_gradient(obs, b):
+        return jax.grad(lambda obs: jnp.sum(decomposed_fn(params, obs)[jnp.arange(2), actions, b]))(obs)
+
+    for b in range(4):
+        expected = bin_gradient(jnp.asarray(observations, dtype=jnp.float32), b)
+        np.testing.assert_allclose(gradients[:, b], expected, rtol=1e-4, atol=1e-8)
+
+    np.testing.assert_allclose(
+        jax.jit(partial(bin_gradients, decomposed_fn, bins=[3, 1], bin_batch_size=1))(params, observations, actions),
+        gradients[:, [3, 1]],
+        rtol=1e-4,
+        atol=1e-8,
+    )
+
+
+def test_bin_gradients_greedy_actions(params, observations):
+    # the default actions are the greedy actions
+    actions = jnp.argmax(jnp.sum(tanh_decomposed_fn(params, observations), axis=-1), axis=-1)
+    np.testing.assert_allclose(
+        bin_gradients(tanh_decomposed_fn, params, observations),
+        bin_gradients(tanh_decomposed_fn, params, observations, actions),
+    )
+
+
+def test_integrated_gradients(params, observations):
+    actions = jnp.array([0, 1, 2, 0, 1])
+    attributions = integrated_gradients(tanh_decomposed_fn, params, observations, actions, steps=256)
+    assert attributions.shape == (5, 4, 2, 6, 6)
+
+    # completeness, each bin's attributions sum to its difference from the baseline
+    expected_rewards = tanh_decomposed_fn(params, jnp.asarray(observations, dtype=jnp.float32))[jnp.arange(5), actions]
+    baseline_rewards = tanh_decomposed_fn(params, jnp.zeros((5, 2, 6, 6)))[jnp.arange(5), actions]
+    np.testing.assert_allclose(
+        jnp.sum(attributions, axis=(2, 3, 4)), expected_rewards - baseline_rewards, rtol=1e-3, atol=1e-4
+    )
+
+
+def test_perturbation_saliency(params, observations):
+    actions = jnp.array([0, 1, 2, 0, 1])
+    saliency = perturbation_saliency(linear_decomposed_fn, params, observations, actions, bins=[1, 3], patch_size=4)
+    assert saliency.shape == (5, 2, 6, 6)
+
+    # for a linear function, the change is the patch's (every channel) weighted difference from the baseline
+    observations = jnp.asarray(observations, dtype=jnp.float32)
+    contributions = jnp.einsum(
+        "bchw,bkchw->bkhw",
+        (observations - jnp.mean(observations, axis=(-2, -1), keepdims=True)) / 255.0,
+        params[actions][:, jnp.array([1, 3])],
+    )
+    for rows, columns in [(slice(0, 4), slice(0, 4)), (slice(0, 4), slice(4, 6)), (slice(4, 6), slice(4, 6))]:
+        expected = jnp.sum(contributions[:, :, rows, columns], axis=(-2, -1))
+        patch = saliency[:, :, rows, columns]
+        np.testing.assert_allclose(patch, np.broadcast_to(expected[..., None, None], patch.shape), rtol=1e-4, atol=1e-5)
+
+    np.testing.assert_allclose(
+        perturbation_saliency(
+            linear_decomposed_fn, params, observations, actions, bins=[1, 3], patch_size=4, patch_batch_size=3
+        ),
+        saliency,
+        rtol=1e-5,
+    )
+
+
+@pytest.mark.parametrize("method", ["gradient", "integrated_gradients", "perturbation"])
+def test_batched_saliency_maps(params, observations, method):
+    kwargs = {"steps": 4} if method == "integrated_gradients" else {}
+    maps = saliency_maps(method, tanh_decomposed_fn, params, observations, **kwargs)
+    assert maps.shape == (5, 4, 6, 6)
+
+    # the padded batches are the same as a single batch
+    np.testing.assert_allclose(
+        batched_saliency_maps(method, tanh_decomposed_fn, params, observations, batch_size=2, **kwargs),
+        maps,
+        rtol=1e-4,
+        atol=1e-6,
+    )
+    actions = np.array([2, 2, 1, 0, 1])
+    np.testing.assert_allclose(
+        batched_saliency_maps(method, tanh_decomposed_fn, params, observations, actions, batch_size=3, **kwargs),
+        saliency_maps(method, tanh_decomposed_fn, params, observations, actions, **kwargs),
+        rtol=1e-4,
+        atol=1e-6,
+    )
+
+
+def test_unknown_saliency_method(params, observations):
+    with pytest.raises(ValueError):
+        batched_saliency_maps("occlusion", tanh_decomposed_fn, params, observations)
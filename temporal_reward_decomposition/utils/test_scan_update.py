@@ -0,0 +1,140 @@
+from functools import partial
+
+import chex
+import flax
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+import pytest
+from flax.training.train_state import TrainState
+
+from temporal_reward_decomposition import dqn_atari_trd_qdagger, dqn_trd, dqn_trd_qdagger
+from temporal_reward_decomposition.utils.metrics import init_metrics
+from temporal_reward_decomposition.utils.replay_buffer import ReplayBufferSamples
+from temporal_reward_decomposition.utils.scan_update import scan_update, stack_batches, target_network_syncs
+
+
+class TargetTrainState(TrainState):
+    target_params: flax.core.FrozenDict
+
+
+def linear_update(q_state, batch):
+    observations, targets = batch
+
+    def loss_fn(params):
+        predictions = observations @ params["weights"] + jnp.sum(q_state.target_params["weights"])
+        return jnp.mean(jnp.square(predictions - targets))
+
+    loss, grads = jax.value_and_grad(loss_fn)(q_state.params)
+    return loss, q_state.apply_gradients(grads=grads)
+
+
+def test_target_network_syncs():
+    update_steps = np.arange(10, 110, 10)
+    assert np.all(target_network_syncs(update_steps, 10, 30) == (update_steps % 30 < 10))
+    # every update step with a train frequency of 1
+    assert np.all(target_network_syncs(np.arange(10), 1, 4) == (np.arange(10) % 4 == 0))
+
+
+@pytest.mark.parametrize("tau", [1.0, 0.5])
+def test_matches_sequential_updates(tau: float, num_updates: int = 8):
+    rng = np.random.default_rng(0)
+    params = {"weights": jnp.zeros(3)}
+    q_state = TargetTrainState.create(apply_fn=None, params=params, target_params=params, tx=optax.sgd(0.1))
+    batches = stack_batches(
+        (rng.normal(size=(num_updates * 16, 3)).astype(np.float32), rng.normal(size=num_updates * 16).astype(np.float32)),
+        num_updates,
+    )
+    sync_target = np.arange(num_updates) % 3 == 0
+
+    expected_state, expected_losses = q_state, []
+    for idx in range(num_updates):
+        loss, expected_state = jax.jit(linear_update)(expected_state, jax.tree_util.tree_map(lambda x: x[idx], batches))
+        expected_losses.append(loss)
+        if sync_target[idx]:
+            expected_state = expected_state.replace(
+                target_params=optax.incremental_update(expected_state.params, expected_state.target_params, tau)
+            )
+
+    (losses,), q_state = jax.jit(scan_update, static_argnums=(0, 4))(linear_update, q_state, batches, sync_target, tau)
+    assert losses.shape == (num_updates,)
+    np.testing.assert_allclose(losses, expected_losses, rtol=1e-5)
+    np.testing.assert_allclose(q_state.params["weights"], expected_state.params["weights"], rtol=1e-5)
+    np.testing.assert_allclose(q_state.target_params["weights"], expected_state.target_params["weights"], rtol=1e-5)
+
+
+def script_update(script: str, batch_size: int, num_actions: int = 3):
+    """A script's update of a batch, `update(q_state, data, distill_coeff) -> (*metrics, q_state)`, with the
+    observation shape and dtype, and a seed's initial train state"""
+    if script == "dqn_atari_trd_qdagger":
+        q_network = dqn_atari_trd_qdagger.MultiHeadQNetwork(action_dim=num_actions, num_bins=(4, 2))
+        update = dqn_atari_trd_qdagger.make_update(q_network, batch_size, 0.9, temperature=1.0)
+        observation_shape, observation_dtype = (4, 84, 84), np.uint8
+        metrics = init_metrics(loss=(), td_loss=(2,), distill_loss=(2,), q_values=(), teacher_error=(2,))
+    else:
+        module = dqn_trd if script == "dqn_trd" else dqn_trd_qdagger
+        q_network = module.QNetwork(action_dim=num_actions, num_bins=4)
+        update = dqn_trd.make_update(q_network, batch_size, 0.9) if script == "dqn_trd" else (
+            dqn_trd_qdagger.make_update(q_network, batch_size, 0.9, temperature=1.0)
+        )
+        observation_shape, observation_dtype = (4,), np.float32
+        metrics = None if script == "dqn_trd" else init_metrics(loss=(), td_loss=(), distill_loss=(), q_values=())
+
+    def batch_update(q_state, data, distill_coeff):
+        args = (q_state, data.observations, data.actions, data.next_observations, data.rewards, data.dones)
+        return update(*args) if script == "dqn_trd" else update(*args, data.teacher_q_values, distill_coeff)
+
+    tx = optax.sgd(0.01)  # the same optimiser for each seed, as the stacked train states' static fields must match
+
+    def init_state(key):
+        params = q_network.init(key, np.zeros((1,) + observation_shape, dtype=observation_dtype))
+        train_state = {"dqn_trd": dqn_trd, "dqn_trd_qdagger": dqn_trd_qdagger}.get(script, dqn_atari_trd_qdagger).TrainState
+        return train_state.create(
+            apply_fn=q_network.apply,
+            params=params,
+            target_params=params,
+            tx=tx,
+            **({} if metrics is None else {"metrics": metrics}),
+        )
+
+    return batch_update, observation_shape, observation_dtype, init_state
+
+
+@pytest.mark.parametrize("script", ["dqn_trd", "dqn_trd_qdagger", "dqn_atari_trd_qdagger"])
+def test_vmapped_seeds_match_single_seeds(script: str, num_seeds: int = 3, num_updates: int = 4, batch_size: int = 4):
+    # with `--num-seeds`, the seeds' train states are stacked and the update vmapped, where each seed's updates must
+    # match those of the seed on its own
+    batch_update, observation_shape, observation_dtype, init_state = script_update(script, batch_size)
+    rng = np.random.default_rng(0)
+
+    def random_batches():
+        observations = rng.integers(0, 255, size=(2, num_updates, batch_size) + observation_shape).astype(observation_dtype)
+        return ReplayBufferSamples(
+            observations=observations[0],
+            actions=rng.integers(0, 3, size=(num_updates, batch_size, 1)),
+            next_observations=observations[1],
+            dones=rng.integers(0, 2, size=(num_updates, batch_size)).astype(np.float32),
+            rewards=rng.normal(size=(num_updates, batch_size)).astype(np.float32),
+            teacher_q_values=rng.normal(size=(num_updates, batch_size, 3)).astype(np.float32),
+        )
+
+    q_states = [init_state(jax.random.PRNGKey(seed)) for seed in range(num_seeds)]
+    batches = [random_batches() for _ in range(num_seeds)]
+    distill_coeff = np.linspace(0.2, 1.0, num_seeds, dtype=np.float32)
+    sync_target = np.arange(num_updates) % 2 == 1
+
+    def seed_update(q_state, batches, sync_target, distill_coeff):
+        return scan_update(partial(batch_update, distill_coeff=distill_coeff), q_state, batches, sync_target, 1.0)
+
+    def stack(trees):
+        return jax.tree_util.tree_map(lambda *xs: jnp.stack(xs), *trees)
+
+    metrics, q_state = jax.jit(jax.vmap(seed_update, in_axes=(0, 0, None, 0)))(
+        stack(q_states), stack(batches), sync_target, distill_coeff
+    )
+    for seed_idx in range(num_seeds):
+        expected = jax.jit(seed_update)(q_states[seed_idx], batches[seed_idx], sync_target, distill_coeff[seed_idx])
+        chex.assert_trees_all_close(
+            jax.tree_util.tree_map(lambda x: x[seed_idx], (metrics, q_state)), expected, rtol=1e-4, atol=1e-5
+        )
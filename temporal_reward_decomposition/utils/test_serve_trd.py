@@ -0,0 +1,56 @@
+import http.client
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from temporal_reward_decomposition.serve_trd import make_server
+from temporal_reward_decomposition.utils.micro_batcher import MicroBatcher
+
+
+@pytest.fixture
+def server():
+    def fn(inputs):
+        if np.any(inputs < 0):
+            raise RuntimeError("negative observation")
+        return np.repeat(inputs[:, :, None], 3, axis=-1)
+
+    batcher = MicroBatcher(fn, (2,), np.float32, max_latency=0.01)
+    server = make_server({"model": batcher}, {"model": {"action_dim": 2, "num_bins": 3}}, ("127.0.0.1", 0))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+
+    server.shutdown()
+    thread.join()
+    server.server_close()
+    batcher.close()
+
+
+def post(server, path, content):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request("POST", path, json.dumps(content), {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    status, body = response.status, json.loads(response.read())
+    connection.close()
+    return status, body
+
+
+def test_serve_trd(server):
+    status, body = post(server, "/models/model", {"observation": [1.0, 2.0]})
+    assert status == 200
+    np.testing.assert_array_equal(body["decomposed_q_value"], [[1.0, 1.0, 1.0], [2.0, 2.0, 2.0]])
+
+    assert post(server, "/models/other", {"observation": [1.0, 2.0]})[0] == 404
+    assert post(server, "/models/model", {"observation": [1.0, 2.0, 3.0]})[0] == 400
+
+
+def test_serve_trd_failing_batch(server):
+    # the failing batch's request is an error response rather than a dropped connection
+    status, body = post(server, "/models/model", {"observation": [-1.0, 2.0]})
+    assert status == 500 and "negative observation" in body["error"]
+
+    # the server continues after the failing batch
+    status, body = post(server, "/models/model", {"observation": [1.0, 2.0]})
+    assert status == 200 and len(body["decomposed_q_value"]) == 2
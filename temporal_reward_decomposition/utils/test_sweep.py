@@ -0,0 +1,27 @@
+import sys
+
+from temporal_reward_decomposition.utils.sweep import SweepJob, run_jobs
+
+
+def python_job(tmp_path, name: str, code: str, depends_on=None) -> SweepJob:
+    return SweepJob(name, [sys.executable, "-c", code], str(tmp_path / "logs" / f"{name}.log"), depends_on)
+
+
+def test_run_jobs(tmp_path, max_workers: int = 2):
+    order_path = tmp_path / "order.txt"
+    append = f"open({str(order_path)!r}, 'a').write('{{}}\\n')"
+    jobs = [
+        python_job(tmp_path, "teacher", append.format("teacher")),
+        python_job(tmp_path, "failed-teacher", "import sys; print('failed'); sys.exit(3)"),
+        *[python_job(tmp_path, f"student-{i}", append.format(f"student-{i}"), "teacher") for i in range(3)],
+        python_job(tmp_path, "skipped", append.format("skipped"), "failed-teacher"),
+        python_job(tmp_path, "skipped-twice", append.format("skipped-twice"), "skipped"),
+    ]
+    return_codes = run_jobs(jobs, max_workers, poll_interval=0.01)
+
+    assert return_codes == {
+        "teacher": 0, "failed-teacher": 3, "student-0": 0, "student-1": 0, "student-2": 0, "skipped": None, "skipped-twice": None
+    }
+    order = order_path.read_text().split()
+    assert order[0] == "teacher" and sorted(order[1:]) == ["student-0", "student-1", "student-2"]
+    assert (tmp_path / "logs" / "failed-teacher.log").read_text() == "failed\n"